@@ -4,6 +4,7 @@ from pathlib import Path
 import os
 import numpy as np
 from util.image_manager import read_datas
+from util.catalog import find_catalog
 import seaborn as sns
 import pandas as pd
 import cartopy.crs as ccrs
@@ -56,10 +57,16 @@ class DataAnalysis:
         UTM_east = []
         UTM_north = []
         
-        for img in self.__input_folder.rglob("*.jpg"):
-            img_datas = read_datas(img)
-            UTM_east.append(img_datas["UTM_east"])
-            UTM_north.append(img_datas["UTM_north"])
+        catalog = find_catalog(self.__input_folder)
+        if ( catalog is not None ):
+            catalog_datas = catalog.load(self.__input_folder, columns=["utm_east", "utm_north"])
+            UTM_east = catalog_datas["utm_east"].tolist()
+            UTM_north = catalog_datas["utm_north"].tolist()
+        else:
+            for img in self.__input_folder.rglob("*.jpg"):
+                img_datas = read_datas(img)
+                UTM_east.append(img_datas["UTM_east"])
+                UTM_north.append(img_datas["UTM_north"])
         
         self.__image_df = pd.DataFrame({
             'UTM_Easting': UTM_east,
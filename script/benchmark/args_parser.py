@@ -0,0 +1,237 @@
+import argparse
+from pathlib import Path
+from typing import Dict
+
+def index_args_parser() -> Dict[str, any]:
+    parser = argparse.ArgumentParser(
+        prog="argparse, args_parser.py",
+        description="Args parser for the index benchmark script",
+    )
+    parser.add_argument(
+        "-i", "--input_database_folder",
+        type=Path,
+        default=Path("./dataset/processed"),
+        help="Input folder of processed images, used to find the default descriptors store."
+    )
+    parser.add_argument(
+        "--descriptors_store",
+        type=Path,
+        default=None,
+        help="Folder of the database descriptors store, if None <--input_database_folder>.descriptors"
+    )
+    parser.add_argument(
+        "-q", "--num_queries",
+        type=int,
+        default=1000,
+        help="Number of database descriptors held out of the index and used as queries."
+    )
+    parser.add_argument(
+        "--nlist",
+        type=int,
+        nargs="+",
+        default=[256, 1024],
+        help="IVF number of cells to benchmark."
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16, 64],
+        help="IVF number of visited cells to benchmark for each --nlist."
+    )
+    parser.add_argument(
+        "--hnsw_m",
+        type=int,
+        nargs="+",
+        default=[32],
+        help="HNSW number of links per node to benchmark."
+    )
+    parser.add_argument(
+        "--ef_search",
+        type=int,
+        nargs="+",
+        default=[16, 32, 64, 128],
+        help="HNSW candidates list sizes to benchmark for each --hnsw_m."
+    )
+    parser.add_argument(
+        "--train_sample",
+        type=int,
+        default=65536,
+        help="Maximum number of database descriptors sampled to train the IVF index and the PCA-whitening"
+    )
+    parser.add_argument(
+        "--pca_dim",
+        type=int,
+        nargs="+",
+        default=[],
+        help="Dimensions of the PCA-whitening to benchmark with the flat index (e.g. 256 512)."
+    )
+    parser.add_argument(
+        "-o", "--output_json",
+        type=Path,
+        default=None,
+        help="Save the results to this json file."
+    )
+    return vars(parser.parse_args())
+
+def partition_args_parser() -> Dict[str, any]:
+    parser = argparse.ArgumentParser(
+        prog="argparse, args_parser.py",
+        description="Args parser for the index partitions benchmark script",
+    )
+    parser.add_argument(
+        "-i", "--input_database_folder",
+        type=Path,
+        default=Path("./dataset/processed"),
+        help="Input folder of processed images, used to find the default descriptors store."
+    )
+    parser.add_argument(
+        "--descriptors_store",
+        type=Path,
+        default=None,
+        help="Folder of the database descriptors store, if None <--input_database_folder>.descriptors"
+    )
+    parser.add_argument(
+        "-q", "--num_queries",
+        type=int,
+        default=1000,
+        help="Number of database descriptors held out of the index and used as queries, with the heading and the position of their names."
+    )
+    parser.add_argument(
+        "--heading_sectors",
+        type=int,
+        nargs="+",
+        default=[4, 8],
+        help="Numbers of heading sectors to benchmark."
+    )
+    parser.add_argument(
+        "--partition_polygon",
+        type=Path,
+        default=None,
+        help="Path to csv polygon file, if given the sectors are also split in the cells of its grid."
+    )
+    parser.add_argument(
+        "--partition_grid_size",
+        type=int,
+        default=100,
+        help="Size in meters of the cells of --partition_polygon"
+    )
+    parser.add_argument(
+        "--prior_radius",
+        type=float,
+        default=None,
+        help="Also benchmark queries with a GPS prior of this radius in meters at their position."
+    )
+    parser.add_argument(
+        "-o", "--output_json",
+        type=Path,
+        default=None,
+        help="Save the results to this json file."
+    )
+    return vars(parser.parse_args())
+
+def evaluator_args_parser() -> Dict[str, any]:
+    parser = argparse.ArgumentParser(
+        prog="argparse, args_parser.py",
+        description="Args parser for the offline Evaluator benchmark script",
+    )
+    parser.add_argument(
+        "-p", "--csv_polygon",
+        type=Path,
+        default=Path("./script/polygon.csv"),
+        help="Path to csv polygon file, the synthetic images are drawn inside."
+    )
+    parser.add_argument(
+        "-n", "--num_images",
+        type=int,
+        default=1000,
+        help="Number of synthetic database images."
+    )
+    parser.add_argument(
+        "-q", "--num_queries",
+        type=int,
+        default=100,
+        help="Number of synthetic query images given to evaluate, and of descriptors held out for the search latency."
+    )
+    parser.add_argument(
+        "--height",
+        type=int,
+        default=512,
+        help="Height of the synthetic images."
+    )
+    parser.add_argument(
+        "--width",
+        type=int,
+        default=512,
+        help="Width of the synthetic images."
+    )
+    parser.add_argument(
+        "--database_sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Database sizes of the search latency, padded with random descriptors beyond --num_images."
+    )
+    parser.add_argument(
+        "--backbone",
+        type=str,
+        default="ResNet18",
+        choices=["VGG16", "ResNet18", "ResNet50", "ResNet101", "ResNet152"],
+        help="Backbone of the model, built with random weights."
+    )
+    parser.add_argument(
+        "--fc_output_dim",
+        type=int,
+        default=512,
+        help="Output dimension of final fully connected layer"
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cpu",
+        choices=["cuda", "cpu"],
+        help="Device of the model"
+    )
+    parser.add_argument(
+        "--infer_batch_size",
+        type=int,
+        default=32,
+        help="Batch size of the database extraction"
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=4,
+        help="Number of workers decoding the database images"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the synthetic images, of the model weights and of the queries."
+    )
+    parser.add_argument(
+        "--work_folder",
+        type=Path,
+        default=None,
+        help="Folder of the synthetic images and descriptors, kept after the run, if None a temporary folder."
+    )
+    parser.add_argument(
+        "-o", "--output_json",
+        type=Path,
+        default=None,
+        help="Save the results to this json file."
+    )
+    parser.add_argument(
+        "-b", "--baseline_json",
+        type=Path,
+        default=None,
+        help="Results json of a previous run, the metrics are compared against it and the script fails on a regression."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative change of a metric against --baseline_json above which it is a regression"
+    )
+    return vars(parser.parse_args())
@@ -0,0 +1,141 @@
+import os
+import time
+import faiss
+import torch
+import numpy as np
+from tqdm import tqdm
+from pathlib import Path
+from typing import Dict, List
+from evaluation.evaluator import Evaluator
+from evaluation.database_loader import DatabaseLoaderPIL
+from evaluation.database_index import DatabaseIndex
+from evaluation.descriptor_store import DescriptorStore, read_store
+from benchmark.index_benchmark import split_queries, latency_percentiles
+
+
+class EvaluatorBenchmark():
+    def __init__(self, database_folder : Path, query_paths : List[Path], model : torch.nn.Module, fc_output_dim : int,
+                 device : str = "cpu", infer_batch_size : int = 32, num_workers : int = 4, seed : int = 0):
+        """Database extraction throughput, search latency over database sizes and end-to-end evaluate latency of Evaluator.
+
+        Nothing is downloaded: model may have random weights (GeoLocalizationNet with pretrained False) and the images
+        synthetic (see generate_synthetic_images), only the speed is measured, not the accuracy.
+        """
+        self.__database_folder = database_folder
+        self.__query_paths = query_paths
+        self.__model = model.eval()
+        self.__fc_output_dim = fc_output_dim
+        self.__device = device
+        self.__infer_batch_size = infer_batch_size
+        self.__num_workers = num_workers
+        self.__seed = seed
+
+    def __extraction(self, store_folder : Path) -> Evaluator:
+        descriptor_store = DescriptorStore(self.__database_folder, "benchmark", self.__fc_output_dim, store_folder)
+        start = time.perf_counter()
+        evaluator = Evaluator(DatabaseLoaderPIL(self.__database_folder), self.__model, infer_batch_size=self.__infer_batch_size, num_workers=self.__num_workers,
+                              device=self.__device, fc_output_dim=self.__fc_output_dim, descriptor_store=descriptor_store)
+        seconds = time.perf_counter() - start
+        self.__extraction_result = {"images" : len(evaluator.database_index), "seconds" : seconds, "images_per_second" : len(evaluator.database_index) / seconds}
+        return evaluator
+
+    def __database_of_size(self, descriptors : np.ndarray, size : int, rng : np.random.Generator) -> np.ndarray:
+        # Beyond the extracted descriptors the database is padded with random unit vectors
+        if ( size <= len(descriptors) ):
+            return descriptors[np.sort(rng.choice(len(descriptors), size, replace=False))]
+        padding = rng.standard_normal((size - len(descriptors), self.__fc_output_dim)).astype("float32")
+        padding /= np.linalg.norm(padding, axis=1, keepdims=True)
+        return np.concatenate((descriptors, padding))
+
+    def __search_latency(self, descriptors : np.ndarray, database_sizes : List[int], num_queries : int) -> List[Dict[str, float]]:
+        rng = np.random.default_rng(self.__seed)
+        database_rows, query_rows = split_queries(len(descriptors), num_queries, self.__seed)
+        queries = np.ascontiguousarray(descriptors[query_rows])
+        results = []
+        for size in tqdm(database_sizes, desc="Search latency", unit="size"):
+            database = self.__database_of_size(descriptors[database_rows], size, rng)
+            database_index = DatabaseIndex(self.__fc_output_dim)
+            database_index.train(database)
+            database_index.add([Path(str(row)) for row in range(size)], database, (np.zeros((size, 2)), np.zeros((size, 2))))
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                database_index.search(query[None], 1)
+                latencies.append(time.perf_counter() - start)
+            results.append({"database_size" : size, **latency_percentiles(latencies)})
+        return results
+
+    def __evaluate_latency(self, evaluator : Evaluator) -> Dict[str, float]:
+        # The first query pays for the lazy initializations, it is not measured
+        evaluator.evaluate(self.__query_paths[0])
+        latencies = []
+        for query_path in tqdm(self.__query_paths, desc="Evaluate latency", unit="query"):
+            start = time.perf_counter()
+            evaluator.evaluate(query_path)
+            latencies.append(time.perf_counter() - start)
+        return {"queries" : len(latencies), **latency_percentiles(latencies)}
+
+    def run(self, store_folder : Path, database_sizes : List[int] = [1000, 10000, 100000], num_queries : int = 100) -> Dict[str, any]:
+        """store_folder must not hold a store of the database, else nothing is extracted."""
+        evaluator = self.__extraction(store_folder)
+        _, descriptors = read_store(store_folder)
+        results = {
+            "environment" : {
+                "device" : self.__device,
+                "torch" : torch.__version__,
+                "faiss" : faiss.__version__,
+                "torch_threads" : torch.get_num_threads(),
+                "cpu_count" : os.cpu_count(),
+                "fc_output_dim" : self.__fc_output_dim,
+            },
+            "extraction" : self.__extraction_result,
+            "search" : self.__search_latency(descriptors[:], database_sizes, num_queries),
+            "evaluate" : self.__evaluate_latency(evaluator),
+        }
+        descriptors.close()
+        return results
+
+
+def benchmark_metrics(results : Dict[str, any]) -> Dict[str, float]:
+    """Flat metric name -> value of the results of EvaluatorBenchmark.run."""
+    metrics = {"extraction.images_per_second" : results["extraction"]["images_per_second"]}
+    for search in results["search"]:
+        metrics.update({f"search.{search['database_size']}.{key}" : search[key] for key in ["p50_ms", "p95_ms", "p99_ms"]})
+    metrics.update({f"evaluate.{key}" : results["evaluate"][key] for key in ["p50_ms", "p95_ms", "p99_ms"]})
+    return metrics
+
+def compare_with_baseline(results : Dict[str, any], baseline : Dict[str, any], tolerance : float = 0.2) -> List[Dict[str, any]]:
+    """Metrics present in both runs, a regression is a throughput lower or a latency higher than the baseline by more than tolerance."""
+    current_metrics = benchmark_metrics(results)
+    baseline_metrics = benchmark_metrics(baseline)
+    comparison = []
+    for metric, baseline_value in baseline_metrics.items():
+        if ( metric not in current_metrics ):
+            continue
+        current_value = current_metrics[metric]
+        change = (current_value - baseline_value) / baseline_value if baseline_value > 0 else 0.0
+        is_throughput = metric.endswith("per_second")
+        comparison.append({
+            "metric" : metric,
+            "baseline" : baseline_value,
+            "current" : current_value,
+            "change" : change,
+            "regression" : change < -tolerance if is_throughput else change > tolerance,
+        })
+    return comparison
+
+
+def display_results(results : Dict[str, any]):
+    extraction = results["extraction"]
+    print(f"Extraction : {extraction['images']} images in {extraction['seconds']:.2f} s, {extraction['images_per_second']:.1f} images/s")
+    print(f"{'database size':<15}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+    for search in results["search"]:
+        print(f"{search['database_size']:<15}{search['p50_ms']:>10.3f}{search['p95_ms']:>10.3f}{search['p99_ms']:>10.3f}")
+    evaluate = results["evaluate"]
+    print(f"Evaluate : {evaluate['queries']} queries, p50 {evaluate['p50_ms']:.2f} ms, p95 {evaluate['p95_ms']:.2f} ms, p99 {evaluate['p99_ms']:.2f} ms")
+
+def display_comparison(comparison : List[Dict[str, any]]):
+    print(f"{'metric':<36}{'baseline':>12}{'current':>12}{'change':>10}")
+    for entry in comparison:
+        flag = "  REGRESSION" if entry["regression"] else ""
+        print(f"{entry['metric']:<36}{entry['baseline']:>12.3f}{entry['current']:>12.3f}{entry['change']:>+10.1%}{flag}")
@@ -0,0 +1,102 @@
+import time
+import faiss
+import numpy as np
+from tqdm import tqdm
+from pathlib import Path
+from typing import Dict, List, Tuple
+from evaluation.database_index import DatabaseIndex
+
+def split_queries(number_of_descriptors : int, num_queries : int, seed : int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Hold out num_queries random rows as queries, the other rows are the database."""
+    num_queries = min(num_queries, number_of_descriptors // 2)
+    query_rows = np.sort(np.random.default_rng(seed).choice(number_of_descriptors, num_queries, replace=False))
+    database_rows = np.setdiff1d(np.arange(number_of_descriptors), query_rows)
+    return database_rows, query_rows
+
+def latency_percentiles(latencies : List[float]) -> Dict[str, float]:
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "mean_ms" : float(latencies_ms.mean()),
+        "p50_ms" : float(np.percentile(latencies_ms, 50)),
+        "p95_ms" : float(np.percentile(latencies_ms, 95)),
+        "p99_ms" : float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def index_size_mb(database_index : DatabaseIndex) -> float:
+    """Serialized size of the FAISS index, with the PCA projection when there is one."""
+    size = faiss.serialize_index(database_index.faiss_index).nbytes
+    if ( database_index.pca_matrix is not None ):
+        size += faiss.vector_to_array(database_index.pca_matrix.A).nbytes + faiss.vector_to_array(database_index.pca_matrix.b).nbytes
+    return size / 2**20
+
+
+class IndexBenchmark():
+    def __init__(self, image_paths : List[Path], descriptors : np.ndarray, num_queries : int = 1000, recall : int = 1, seed : int = 0):
+        """Query latency, top-1 agreement with the flat index and index size for several index settings.
+
+        The queries are database descriptors held out of the index, so no model is needed.
+        """
+        self.__recall = recall
+        database_rows, query_rows = split_queries(len(descriptors), num_queries, seed)
+        self.__database_paths = [image_paths[row] for row in database_rows]
+        self.__database_descriptors = np.ascontiguousarray(descriptors[database_rows], dtype="float32")
+        self.__queries = np.ascontiguousarray(descriptors[query_rows], dtype="float32")
+        self.__fc_output_dim = descriptors.shape[1]
+        self.__reference_ids = None
+
+    def __build(self, **index_params) -> Tuple[DatabaseIndex, float]:
+        start = time.perf_counter()
+        database_index = DatabaseIndex(self.__fc_output_dim, **index_params)
+        database_index.train(self.__database_descriptors)
+        database_index.add(self.__database_paths, self.__database_descriptors)
+        return database_index, time.perf_counter() - start
+
+    def __measure(self, database_index : DatabaseIndex) -> Dict[str, float]:
+        latencies = []
+        for query in self.__queries:
+            start = time.perf_counter()
+            database_index.search(query[None], self.__recall)
+            latencies.append(time.perf_counter() - start)
+        _, found_ids = database_index.search(self.__queries, self.__recall)
+        result = latency_percentiles(latencies)
+        result["index_mb"] = index_size_mb(database_index)
+        if ( self.__reference_ids is None ):
+            self.__reference_ids = found_ids[:, 0]
+        result["top1_agreement"] = float(np.mean(found_ids[:, 0] == self.__reference_ids))
+        return result
+
+    def run(self,
+            nlists      : List[int] = [256, 1024],
+            nprobes     : List[int] = [1, 4, 16, 64],
+            hnsw_ms     : List[int] = [32],
+            ef_searches : List[int] = [16, 32, 64, 128],
+            train_sample: int = 65536,
+            pca_dims    : List[int] = []
+            ) -> List[Dict[str, float]]:
+        results = []
+        flat_index, build_seconds = self.__build(index_type="flat")
+        results.append({"index_type" : "flat", "build_s" : build_seconds, **self.__measure(flat_index)})
+        del flat_index
+        for pca_dim in tqdm(pca_dims, desc="PCA dimensions", unit="dimension"):
+            pca_index, build_seconds = self.__build(index_type="flat", pca_dim=pca_dim, train_sample=train_sample)
+            results.append({"index_type" : "flat", "pca_dim" : pca_dim, "build_s" : build_seconds, **self.__measure(pca_index)})
+            del pca_index
+        for nlist in tqdm(nlists, desc="IVF settings", unit="nlist"):
+            ivf_index, build_seconds = self.__build(index_type="ivf", nlist=nlist, train_sample=train_sample)
+            for nprobe in nprobes:
+                ivf_index.set_search_parameters(nprobe=nprobe)
+                results.append({"index_type" : "ivf", "nlist" : nlist, "nprobe" : nprobe, "build_s" : build_seconds, **self.__measure(ivf_index)})
+        for hnsw_m in tqdm(hnsw_ms, desc="HNSW settings", unit="M"):
+            hnsw_index, build_seconds = self.__build(index_type="hnsw", hnsw_m=hnsw_m)
+            for ef_search in ef_searches:
+                hnsw_index.set_search_parameters(ef_search=ef_search)
+                results.append({"index_type" : "hnsw", "hnsw_m" : hnsw_m, "ef_search" : ef_search, "build_s" : build_seconds, **self.__measure(hnsw_index)})
+        return results
+
+
+def display_results(results : List[Dict[str, float]]):
+    print(f"{'index':<8}{'setting':<24}{'build (s)':>10}{'size (MB)':>11}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'top-1 agreement':>17}")
+    for result in results:
+        setting = ", ".join(f"{key}={result[key]}" for key in ["pca_dim", "nlist", "nprobe", "hnsw_m", "ef_search"] if key in result)
+        print(f"{result['index_type']:<8}{setting:<24}{result['build_s']:>10.2f}{result['index_mb']:>11.2f}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['top1_agreement']:>17.3f}")
@@ -0,0 +1,89 @@
+import time
+import numpy as np
+from tqdm import tqdm
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+from shapely.geometry import Point, Polygon
+from evaluation.database_index import DatabaseIndex, read_coordinates
+from evaluation.partitioned_index import PartitionedIndex, read_headings
+from benchmark.index_benchmark import split_queries, latency_percentiles
+
+
+class PartitionBenchmark():
+    def __init__(self, image_paths : List[Path], descriptors : np.ndarray, cells : List[Polygon] = [], num_queries : int = 1000, recall : int = 1, seed : int = 0):
+        """Query latency and accuracy of the heading sectors (and of the cells) of PartitionedIndex against the unpartitioned flat index.
+
+        The queries are database descriptors held out of the index, their heading and position are read from their names.
+        Accuracy is the top-1 agreement with the unpartitioned index and the distance in meters between the top-1 image and the query.
+        """
+        self.__recall = recall
+        self.__cells = cells
+        database_rows, query_rows = split_queries(len(descriptors), num_queries, seed)
+        utm_coordinates, lonlat = read_coordinates(image_paths)
+        headings = read_headings(image_paths)
+        self.__database_paths = [image_paths[row] for row in database_rows]
+        self.__database_descriptors = np.ascontiguousarray(descriptors[database_rows], dtype="float32")
+        self.__database_coordinates = (utm_coordinates[database_rows], lonlat[database_rows])
+        self.__database_headings = headings[database_rows]
+        self.__queries = np.ascontiguousarray(descriptors[query_rows], dtype="float32")
+        self.__queries_utm = utm_coordinates[query_rows]
+        self.__queries_lonlat = lonlat[query_rows]
+        self.__queries_headings = [int(heading) if heading >= 0 else None for heading in headings[query_rows]]
+        self.__fc_output_dim = descriptors.shape[1]
+        self.__reference_paths = None
+
+    def __build(self, heading_sectors : int = None) -> Tuple[Union[DatabaseIndex, PartitionedIndex], float]:
+        start = time.perf_counter()
+        if ( heading_sectors is None ):
+            database_index = DatabaseIndex(self.__fc_output_dim)
+            database_index.train(self.__database_descriptors)
+            database_index.add(self.__database_paths, self.__database_descriptors, self.__database_coordinates)
+        else:
+            database_index = PartitionedIndex(self.__fc_output_dim, self.__cells, heading_sectors)
+            database_index.train(self.__database_descriptors)
+            database_index.add(self.__database_paths, self.__database_descriptors, self.__database_coordinates, self.__database_headings)
+        return database_index, time.perf_counter() - start
+
+    def __search(self, database_index : Union[DatabaseIndex, PartitionedIndex], rows : slice, prior_radius : float = None) -> np.ndarray:
+        if ( isinstance(database_index, DatabaseIndex) ):
+            return database_index.search(self.__queries[rows], self.__recall)[1]
+        priors = None
+        if ( prior_radius is not None ):
+            priors = [(Point(*lonlat), prior_radius) for lonlat in self.__queries_lonlat[rows]]
+        return database_index.search(self.__queries[rows], self.__recall, priors, self.__queries_headings[rows])[1]
+
+    def __measure(self, database_index : Union[DatabaseIndex, PartitionedIndex], prior_radius : float = None) -> Dict[str, float]:
+        latencies = []
+        for query in range(len(self.__queries)):
+            start = time.perf_counter()
+            self.__search(database_index, slice(query, query + 1), prior_radius)
+            latencies.append(time.perf_counter() - start)
+        found_ids = self.__search(database_index, slice(None), prior_radius)
+        result = latency_percentiles(latencies)
+        found_utm, _ = database_index.coordinates_of(found_ids[:, 0])
+        # Ids are not comparable between a PartitionedIndex and a DatabaseIndex, the paths are
+        found_paths = database_index.paths_of(found_ids[:, 0])
+        if ( self.__reference_paths is None ):
+            self.__reference_paths = found_paths
+        result["top1_agreement"] = float(np.mean([found_path == reference_path for found_path, reference_path in zip(found_paths, self.__reference_paths)]))
+        result["error_m"] = float(np.nanmean(np.linalg.norm(found_utm - self.__queries_utm, axis=1)))
+        return result
+
+    def run(self, heading_sectors : List[int] = [4, 8], prior_radius : float = None) -> List[Dict[str, float]]:
+        results = []
+        flat_index, build_seconds = self.__build()
+        results.append({"partitions" : "none", "build_s" : build_seconds, **self.__measure(flat_index)})
+        del flat_index
+        for sectors in tqdm(heading_sectors, desc="Heading sectors", unit="setting"):
+            partitioned_index, build_seconds = self.__build(sectors)
+            results.append({"partitions" : "heading", "heading_sectors" : sectors, "cells" : len(self.__cells), "build_s" : build_seconds, **self.__measure(partitioned_index)})
+            if ( prior_radius is not None ):
+                results.append({"partitions" : "heading+prior", "heading_sectors" : sectors, "cells" : len(self.__cells), "prior_radius" : prior_radius, "build_s" : build_seconds, **self.__measure(partitioned_index, prior_radius)})
+        return results
+
+
+def display_results(results : List[Dict[str, float]]):
+    print(f"{'partitions':<15}{'setting':<48}{'build (s)':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'top-1 agreement':>17}{'error (m)':>11}")
+    for result in results:
+        setting = ", ".join(f"{key}={result[key]}" for key in ["heading_sectors", "cells", "prior_radius"] if key in result)
+        print(f"{result['partitions']:<15}{setting:<48}{result['build_s']:>10.2f}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['top1_agreement']:>17.3f}{result['error_m']:>11.2f}")
@@ -0,0 +1,35 @@
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+from pathlib import Path
+from typing import List
+from shapely.geometry import Point, Polygon
+from preprocess.preprocesser import save_image_for_dataset
+
+def random_points_in_polygon(polygon : Polygon, number_of_points : int, rng : np.random.Generator) -> List[Point]:
+    """Uniform random (lon, lat) points inside polygon, by rejection in its bounds."""
+    min_lon, min_lat, max_lon, max_lat = polygon.bounds
+    points = []
+    while ( len(points) < number_of_points ):
+        candidates = rng.uniform((min_lon, min_lat), (max_lon, max_lat), size=(number_of_points, 2))
+        points.extend(Point(round(lon, 5), round(lat, 5)) for lon, lat in candidates if polygon.contains(Point(lon, lat)))
+    return points[:number_of_points]
+
+def generate_synthetic_images(output_folder : Path, polygon : Polygon, number_of_images : int, width : int = 512, height : int = 512, seed : int = 0) -> List[Path]:
+    """Write number_of_images processed images at random positions and headings inside polygon (lon, lat).
+
+    The images are smooth random color fields, named like the images of the preprocessing (see save_image_for_dataset)
+    so every loader and index reads their position and heading. Returns the sorted image paths.
+    """
+    if ( polygon.is_empty ):
+        raise ValueError("Polygon is empty, no position to draw the synthetic images")
+    output_folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    locations = random_points_in_polygon(polygon, number_of_images, rng)
+    # One image in eight has no heading, like the raw images without GPSImgDirection
+    headings = np.where(rng.random(number_of_images) < 0.125, -1, rng.integers(0, 360, number_of_images))
+    for index, (location, heading) in enumerate(tqdm(list(zip(locations, headings)), desc="Generating synthetic images", unit="image")):
+        colors = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        image = Image.fromarray(colors).resize((width, height), Image.BILINEAR)
+        save_image_for_dataset(image, Path(f"SYNTHETIC_{seed}_{index:06d}.jpg"), output_folder, location, int(heading))
+    return sorted(output_folder.glob("*.jpg"))
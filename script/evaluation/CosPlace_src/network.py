@@ -18,16 +18,17 @@ CHANNELS_NUM_IN_LAST_CONV = {
 
 
 class GeoLocalizationNet(nn.Module):
-    def __init__(self, backbone : str, fc_output_dim : int):
+    def __init__(self, backbone : str, fc_output_dim : int, pretrained : bool = True):
         """Return a model for GeoLocalization.
         
         Args:
             backbone (str): which torchvision backbone to use. Must be VGG16 or a ResNet.
             fc_output_dim (int): the output dimension of the last fc layer, equivalent to the descriptors dimension.
+            pretrained (bool): start from the ImageNet weights of torchvision (downloaded), or from random weights.
         """
         super().__init__()
         assert backbone in CHANNELS_NUM_IN_LAST_CONV, f"backbone must be one of {list(CHANNELS_NUM_IN_LAST_CONV.keys())}"
-        self.backbone, features_dim = get_backbone(backbone)
+        self.backbone, features_dim = get_backbone(backbone, pretrained)
         self.aggregation = nn.Sequential(
             L2Norm(),
             GeM(),
@@ -42,10 +43,13 @@ class GeoLocalizationNet(nn.Module):
         return x
 
 
-def get_pretrained_torchvision_model(backbone_name : str) -> torch.nn.Module:
+def get_pretrained_torchvision_model(backbone_name : str, pretrained : bool = True) -> torch.nn.Module:
     """This function takes the name of a backbone and returns the corresponding pretrained
     model from torchvision. Examples of backbone_name are 'VGG16' or 'ResNet18'
+    With pretrained False the weights are random and nothing is downloaded.
     """
+    if not pretrained:
+        return getattr(torchvision.models, backbone_name.lower())(weights=None)
     try:  # Newer versions of pytorch require to pass weights=weights_module.DEFAULT
         weights_module = getattr(__import__('torchvision.models', fromlist=[f"{backbone_name}_Weights"]), f"{backbone_name}_Weights")
         model = getattr(torchvision.models, backbone_name.lower())(weights=weights_module.DEFAULT)
@@ -54,8 +58,8 @@ def get_pretrained_torchvision_model(backbone_name : str) -> torch.nn.Module:
     return model
 
 
-def get_backbone(backbone_name : str) -> Tuple[torch.nn.Module, int]:
-    backbone = get_pretrained_torchvision_model(backbone_name)
+def get_backbone(backbone_name : str, pretrained : bool = True) -> Tuple[torch.nn.Module, int]:
+    backbone = get_pretrained_torchvision_model(backbone_name, pretrained)
     if backbone_name.startswith("ResNet"):
         for name, child in backbone.named_children():
             if name == "layer3":  # Freeze layers before conv_3
@@ -1,12 +1,88 @@
 import argparse
 from pathlib import Path
 from typing import *
+from evaluation.model_options import MODEL_BACKENDS, INFERENCE_PRECISIONS
 
-def args_parser() -> Dict[str, any]:
-    parser = argparse.ArgumentParser(
-        prog="argparse, args_parser.py",
-        description="Args parser for preprocess scripts",
+def add_model_arguments(parser : argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """Arguments of the model and of its inference backend."""
+    parser.add_argument(
+        "-m", "--resume_model", 
+        type=Path, 
+        default=None,
+        help="path to model to resume, e.g. logs/.../best_model.pth -- If None, loaded from --model_registry using --backbone & --fc_output_dim args, Auto DL from CosPlace once if missing"
+    )
+    parser.add_argument(
+        "--device", 
+        type=str, 
+        default="cuda",
+        choices=["cuda", "cpu"], 
+        help="Device to use for calculation augmentation"
+    )
+    parser.add_argument(
+        "--backbone", 
+        type=str, 
+        default="ResNet50",
+        choices=["VGG16", "ResNet18", "ResNet50", "ResNet101", "ResNet152"], 
+        help="Choice of Backbone from CosPlace"
+    )
+    parser.add_argument(
+        "--fc_output_dim", 
+        type=int, 
+        default=2048,
+        help="Output dimension of final fully connected layer"
+    )
+    parser.add_argument(
+        "--model_registry",
+        type=Path,
+        default=Path("./models/registry"),
+        help="Folder of the local model registry, the CosPlace weights of --backbone & --fc_output_dim are stored there once and memory-mapped"
+    )
+    parser.add_argument(
+        "--registry_fp16",
+        action="store_true",
+        help="Read the float16 copy of the registry weights (half the bytes), cast back to float32"
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Never download the model, fail if it is not in --model_registry"
+    )
+    parser.add_argument(
+        "--model_backend",
+        type=str,
+        default="eager",
+        choices=MODEL_BACKENDS,
+        help="Run the model as eager PyTorch or from an artifact of main_model_export.py given by --model_artifact"
     )
+    parser.add_argument(
+        "--model_artifact",
+        type=Path,
+        default=None,
+        help="TorchScript (.pt) or ONNX (.onnx) artifact used when --model_backend is not eager"
+    )
+    parser.add_argument(
+        "--backend_tolerance",
+        type=float,
+        default=1e-4,
+        help="Maximum absolute difference allowed between the descriptors of the artifact and of the eager model"
+    )
+    parser.add_argument(
+        "--inference_precision",
+        type=str,
+        default="fp32",
+        choices=INFERENCE_PRECISIONS,
+        help="fp32, bf16 autocast or int8 (post-training quantized backbone calibrated on the database, cpu only)"
+    )
+    parser.add_argument(
+        "--calibration_images",
+        type=int,
+        default=256,
+        help="Number of database images used to calibrate the int8 backbone"
+    )
+    return parser
+
+def add_evaluator_arguments(parser : argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """Arguments of the model, the database and its index, shared by the evaluation scripts."""
     parser.add_argument(
         "-i", "--input_database_folder",
         type=Path,
@@ -26,31 +102,174 @@ def args_parser() -> Dict[str, any]:
         help="Batch size for inference (validating and testing)"
     )
     parser.add_argument(
-        "-m", "--resume_model", 
-        type=Path, 
+        "--loader_mode",
+        type=str,
+        default="float",
+        choices=["float", "uint8", "cached"],
+        help="Database loader output: normalized float32 images, uint8 images decoded with the JPEG draft mode, or uint8 images read from the decoded cache (--decoded_cache), uint8 images are normalized once per batch by the model"
+    )
+    parser.add_argument(
+        "--decoded_cache",
+        type=Path,
         default=None,
-        help="path to model to resume, e.g. logs/.../best_model.pth -- If None, Auto DL from CosPlace using --backbone & --fc_output_dim args"
+        help="Folder of the decoded images cache of --loader_mode cached, if None saved next to --input_database_folder as <folder>.decoded"
     )
     parser.add_argument(
-        "--device", 
-        type=str, 
-        default="cuda",
-        choices=["cuda", "cpu"], 
-        help="Device to use for calculation augmentation"
+        "--no_catalog",
+        action="store_true",
+        help="Do not read the database images from the catalog of the preprocessing, walk the folder and parse the image names."
     )
     parser.add_argument(
-        "--backbone", 
-        type=str, 
-        default="ResNet50",
-        choices=["VGG16", "ResNet18", "ResNet50", "ResNet101", "ResNet152"], 
-        help="Choice of Backbone from CosPlace"
+        "--extraction_processes",
+        type=int,
+        default=1,
+        help="Number of CPU processes extracting the database descriptors, each one with its own model replica and a contiguous range of images (cpu device only)"
     )
     parser.add_argument(
-        "--fc_output_dim", 
-        type=int, 
-        default=2048,
-        help="Output dimension of final fully connected layer"
+        "--threads_per_process",
+        type=int,
+        default=None,
+        help="Intra-op threads of each --extraction_processes process, if None the cores divided by the processes"
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=4096,
+        help="Number of extracted database descriptors between two checkpoints of the descriptors store (an interrupted extraction resumes from the last one)"
+    )
+    parser.add_argument(
+        "--stream_index",
+        action="store_true",
+        help="Add the database descriptors to the index by chunks of --chunk_size while they are extracted, instead of once at the end"
+    )
+    parser.add_argument(
+        "--background_extraction",
+        action="store_true",
+        help="With --stream_index, extract the database in a background thread, queries are answered from the chunks already indexed meanwhile"
+    )
+    add_model_arguments(parser)
+    parser.add_argument(
+        "--descriptors_store",
+        type=Path,
+        default=None,
+        help="Folder of the on-disk database descriptors store, if None saved next to --input_database_folder as <folder>.descriptors"
+    )
+    parser.add_argument(
+        "--no_descriptors_store",
+        action="store_true",
+        help="Do not reuse nor save the database descriptors, extract every image at each start."
+    )
+    parser.add_argument(
+        "--result_cache_size",
+        type=int,
+        default=1024,
+        help="Number of query images whose descriptor and prediction are cached by the sha256 of their bytes, 0 to disable"
+    )
+    parser.add_argument(
+        "--result_cache_ttl",
+        type=float,
+        default=3600.0,
+        help="Seconds after which a cached query result expires"
+    )
+    parser.add_argument(
+        "--stage_metrics",
+        action="store_true",
+        help="Time each stage of the evaluation (decode, normalization, forward, search, metadata, database extraction) into histograms, see GET /metrics of the server"
     )
+    parser.add_argument(
+        "--index_type",
+        type=str,
+        default="flat",
+        choices=["flat", "ivf", "hnsw"],
+        help="FAISS search structure of the database index: exhaustive flat, IVF-Flat or HNSW"
+    )
+    parser.add_argument(
+        "--nlist",
+        type=int,
+        default=1024,
+        help="Number of IVF cells for --index_type ivf (clamped to the training sample size)"
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=16,
+        help="Number of IVF cells visited per query for --index_type ivf"
+    )
+    parser.add_argument(
+        "--hnsw_m",
+        type=int,
+        default=32,
+        help="Number of links per node for --index_type hnsw"
+    )
+    parser.add_argument(
+        "--ef_search",
+        type=int,
+        default=64,
+        help="Size of the candidates list per query for --index_type hnsw"
+    )
+    parser.add_argument(
+        "--train_sample",
+        type=int,
+        default=65536,
+        help="Maximum number of database descriptors sampled to train the index"
+    )
+    parser.add_argument(
+        "--index_encoding",
+        type=str,
+        default="float32",
+        choices=["float32", "fp16", "sq8", "pq"],
+        help="Storage of the descriptors in the index, compressed encodings (fp16, 8-bit scalar or product quantization) are searched with inner product"
+    )
+    parser.add_argument(
+        "--pq_m",
+        type=int,
+        default=64,
+        help="Number of bytes per descriptor for --index_encoding pq, must divide --fc_output_dim (--pca_dim when set)"
+    )
+    parser.add_argument(
+        "--pca_dim",
+        type=int,
+        default=0,
+        help="Reduce the indexed descriptors to this many dimensions with a PCA-whitening learned on the database (e.g. 256 or 512), 0 to disable"
+    )
+    parser.add_argument(
+        "--rerank_k",
+        type=int,
+        default=0,
+        help="Re-rank this many candidates with the exact descriptors kept on disk, 0 to disable"
+    )
+    parser.add_argument(
+        "--rerank_file",
+        type=Path,
+        default=None,
+        help="File of the exact descriptors used by --rerank_k, if None a temporary file"
+    )
+    parser.add_argument(
+        "--partition_polygon",
+        type=Path,
+        default=None,
+        help="Path to csv polygon file, if given the database index is split in the cells of its grid and queries with a GPS prior only search the nearby cells"
+    )
+    parser.add_argument(
+        "--partition_grid_size",
+        type=int,
+        default=100,
+        help="Size in meters of the cells of --partition_polygon"
+    )
+    parser.add_argument(
+        "--heading_sectors",
+        type=int,
+        default=1,
+        help="Split the database index in this many compass sectors (e.g. 8 of 45 degrees), queries with a heading only search the adjacent sectors, 1 to disable"
+    )
+    return parser
+
+def args_parser() -> Dict[str, any]:
+    parser = argparse.ArgumentParser(
+        prog="argparse, args_parser.py",
+        description="Args parser for preprocess scripts",
+    )
+    add_evaluator_arguments(parser)
     parser.add_argument(
         "--image_to_evaluate",
         type=Path,
@@ -68,4 +287,114 @@ def args_parser() -> Dict[str, any]:
         action="store_true",
         help="Transform Path of the image to evaluate to a base64, simulation of server request."
     )
-    return vars(parser.parse_args())
\ No newline at end of file
+    parser.add_argument(
+        "--prior_radius",
+        type=float,
+        default=None,
+        help="Radius in meters of the GPS prior read in the EXIF of the image to evaluate, only the nearby cells of --partition_polygon are searched"
+    )
+    parser.add_argument(
+        "--snapshot",
+        type=Path,
+        default=None,
+        help="Snapshot written by main_snapshot.py, its model and database index are loaded instead of the model and database arguments"
+    )
+    return vars(parser.parse_args())
+
+def snapshot_args_parser() -> Dict[str, any]:
+    parser = argparse.ArgumentParser(
+        prog="argparse, args_parser.py",
+        description="Args parser for the snapshot script",
+    )
+    add_evaluator_arguments(parser)
+    parser.add_argument(
+        "-o", "--snapshot",
+        type=Path,
+        default=Path("./models/snapshot.zip"),
+        help="Snapshot file to write, the model as TorchScript and the database index, loaded with --snapshot by main_evaluation_example.py"
+    )
+    parser.add_argument(
+        "--num_images",
+        type=int,
+        default=4,
+        help="Number of database images used to trace the model"
+    )
+    return vars(parser.parse_args())
+def export_args_parser() -> Dict[str, any]:
+    parser = argparse.ArgumentParser(
+        prog="argparse, args_parser.py",
+        description="Args parser for the model export script",
+    )
+    add_model_arguments(parser)
+    parser.add_argument(
+        "-i", "--input_database_folder",
+        type=Path,
+        default=Path("./dataset/processed"),
+        help="Input folder of processed images, a sample is used to trace, check and benchmark the exported models."
+    )
+    parser.add_argument(
+        "-o", "--output_folder",
+        type=Path,
+        default=Path("./models"),
+        help="Folder of the exported artifacts, named <backbone>_<fc_output_dim>.pt / .onnx"
+    )
+    parser.add_argument(
+        "--formats",
+        type=str,
+        nargs="+",
+        default=["torchscript"],
+        choices=["torchscript", "onnx"],
+        help="Artifacts to export"
+    )
+    parser.add_argument(
+        "--num_images",
+        type=int,
+        default=64,
+        help="Number of database images used to check and benchmark the artifacts"
+    )
+    parser.add_argument(
+        "-b", "--infer_batch_size",
+        type=int,
+        default=16,
+        help="Batch size of the benchmark"
+    )
+    return vars(parser.parse_args())
+
+def precision_args_parser() -> Dict[str, any]:
+    parser = argparse.ArgumentParser(
+        prog="argparse, args_parser.py",
+        description="Args parser for the inference precision report",
+    )
+    add_model_arguments(parser)
+    parser.add_argument(
+        "-i", "--input_database_folder",
+        type=Path,
+        default=Path("./dataset/processed"),
+        help="Input folder of processed images, used to calibrate int8 and as queries of the report."
+    )
+    parser.add_argument(
+        "--num_images",
+        type=int,
+        default=256,
+        help="Number of database images of the report, each one queries the others"
+    )
+    parser.add_argument(
+        "-b", "--infer_batch_size",
+        type=int,
+        default=16,
+        help="Batch size for inference"
+    )
+    return vars(parser.parse_args())
+
+def registry_args_parser() -> Dict[str, any]:
+    parser = argparse.ArgumentParser(
+        prog="argparse, args_parser.py",
+        description="Args parser for the model registry script",
+    )
+    add_model_arguments(parser)
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="Only list the entries of --model_registry"
+    )
+    return vars(parser.parse_args())
@@ -0,0 +1,511 @@
+import os
+import json
+import faiss
+import shutil
+import tempfile
+import threading
+import numpy as np
+from pathlib import Path
+from typing import List, Tuple
+from util.image_manager import read_datas
+
+INDEX_TYPES = ["flat", "ivf", "hnsw"]
+INDEX_ENCODINGS = ["float32", "fp16", "sq8", "pq"]
+INDEX_FILE = "index.faiss"
+PCA_FILE = "pca.faiss"
+EXACT_DESCRIPTORS_FILE = "exact_descriptors.f32"
+
+def codec_string(encoding : str = "float32", pq_m : int = 64, pq_nbits : int = 8) -> str:
+    if ( encoding == "float32" ):
+        return "Flat"
+    if ( encoding == "fp16" ):
+        return "SQfp16"
+    if ( encoding == "sq8" ):
+        return "SQ8"
+    if ( encoding == "pq" ):
+        return f"PQ{pq_m}x{pq_nbits}"
+    raise ValueError(f"Index encoding : {encoding} is not one of {INDEX_ENCODINGS}")
+
+def index_factory_string(index_type : str = "flat", nlist : int = 1024, hnsw_m : int = 32, encoding : str = "float32", pq_m : int = 64, pq_nbits : int = 8) -> str:
+    codec = codec_string(encoding, pq_m, pq_nbits)
+    if ( index_type == "flat" ):
+        return codec
+    if ( index_type == "ivf" ):
+        return f"IVF{nlist},{codec}"
+    if ( index_type == "hnsw" ):
+        return f"HNSW{hnsw_m}" if encoding == "float32" else f"HNSW{hnsw_m}_{codec}"
+    raise ValueError(f"Index type : {index_type} is not one of {INDEX_TYPES}")
+
+def build_faiss_index(fc_output_dim : int, index_type : str = "flat", nlist : int = 1024, hnsw_m : int = 32, encoding : str = "float32", pq_m : int = 64, pq_nbits : int = 8) -> faiss.Index:
+    # Descriptors are L2 normalized (GeoLocalizationNet ends with L2Norm), compressed codes are compared with inner product
+    metric = faiss.METRIC_L2 if encoding == "float32" else faiss.METRIC_INNER_PRODUCT
+    return faiss.index_factory(fc_output_dim, index_factory_string(index_type, nlist, hnsw_m, encoding, pq_m, pq_nbits), metric)
+
+
+class ExactDescriptors():
+    def __init__(self, fc_output_dim : int, path : Path = None, read_only : bool = False):
+        """Append-only float32 descriptors file used to re-rank compressed search results, row i is the descriptor of id i.
+
+        The file is read back with np.memmap, so only the re-ranked rows are paged in memory.
+        If path is None a temporary file is used and deleted with the object.
+        With read_only the existing file at path is opened as is, see DatabaseIndex.load.
+        """
+        self.fc_output_dim = fc_output_dim
+        self.__is_temporary = path is None
+        self.__read_only = read_only
+        if ( path is None ):
+            file_descriptor, path = tempfile.mkstemp(suffix=".f32")
+            os.close(file_descriptor)
+        self.path = Path(path)
+        if ( not read_only ):
+            self.path.write_bytes(b"")
+        self.__length = self.path.stat().st_size // (4 * fc_output_dim)
+        self.__memmap = None
+
+    def __len__(self):
+        return self.__length
+
+    def append(self, descriptors : np.ndarray):
+        if ( self.__read_only ):
+            raise PermissionError(f"Exact descriptors : {self.path} are opened read-only")
+        with open(self.path, 'ab') as descriptors_file:
+            descriptors_file.write(np.ascontiguousarray(descriptors, dtype="float32").tobytes())
+        self.__length += len(descriptors)
+        self.__memmap = None
+
+    def __getitem__(self, ids : np.ndarray) -> np.ndarray:
+        if ( self.__memmap is None ):
+            self.__memmap = np.memmap(self.path, dtype="float32", mode='r', shape=(self.__length, self.fc_output_dim))
+        return self.__memmap[ids]
+
+    def __del__(self):
+        self.__memmap = None
+        if ( self.__is_temporary ):
+            self.path.unlink(missing_ok=True)
+
+
+class DatabaseIndex():
+    def __init__(self, 
+                 fc_output_dim          : int, 
+                 index_type             : str = "flat", 
+                 nlist                  : int = 1024, 
+                 nprobe                 : int = 16, 
+                 hnsw_m                 : int = 32, 
+                 ef_search              : int = 64, 
+                 train_sample           : int = 65536, 
+                 encoding               : str = "float32", 
+                 pq_m                   : int = 64, 
+                 pca_dim                : int = 0, 
+                 rerank_k               : int = 0, 
+                 rerank_file            : Path = None, 
+                 compaction_threshold   : int = 1024
+                 ):
+        """ID-mapped FAISS index of the database descriptors with its metadata table.
+
+        index_type selects the search structure: "flat" (exhaustive), "ivf" (IVF-Flat, nlist cells, nprobe visited)
+        or "hnsw" (hnsw_m links per node, ef_search candidates). IVF is trained on a random sample of at most
+        train_sample database descriptors, see train.
+
+        encoding selects how the vectors are stored: "float32", "fp16", "sq8" (8-bit scalar quantizer) or
+        "pq" (product quantizer, pq_m bytes per vector), compressed encodings are searched with inner product.
+        With pca_dim > 0 the descriptors are reduced to pca_dim dimensions by a PCA-whitening learned by train
+        (see pca_matrix) and L2 normalized again, both when they are added and when they are searched.
+        With rerank_k > 0 the rerank_k best candidates are re-ranked with the exact descriptors,
+        kept on disk in rerank_file (see ExactDescriptors) instead of in memory.
+
+        Rows of the metadata table (ids, paths, utm, lonlat) are kept sorted by id, an id is never reused.
+        utm and lonlat are contiguous (N, 2) arrays, filled once from the image names when the images are added.
+        Removed images are tombstoned: they are filtered out of the search results right away
+        and dropped from the FAISS index and the metadata table by a background compaction
+        once compaction_threshold tombstones are pending.
+        """
+        if ( index_type not in INDEX_TYPES ):
+            raise ValueError(f"Index type : {index_type} is not one of {INDEX_TYPES}")
+        if ( encoding not in INDEX_ENCODINGS ):
+            raise ValueError(f"Index encoding : {encoding} is not one of {INDEX_ENCODINGS}")
+        if ( pca_dim < 0 or pca_dim > fc_output_dim ):
+            raise ValueError(f"pca_dim : {pca_dim} must be between 0 and fc_output_dim : {fc_output_dim}")
+        if ( encoding == "pq" and (pca_dim or fc_output_dim) % pq_m != 0 ):
+            raise ValueError(f"pq_m : {pq_m} must divide the indexed dimension : {pca_dim or fc_output_dim}")
+        self.fc_output_dim = fc_output_dim
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.train_sample = train_sample
+        self.encoding = encoding
+        self.pq_m = pq_m
+        self.pca_dim = pca_dim
+        self.pca_matrix = None
+        self.rerank_k = rerank_k
+        self.exact_descriptors = ExactDescriptors(fc_output_dim, rerank_file) if rerank_k > 0 else None
+        self.faiss_index = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.paths : List[Path] = []
+        self.utm = np.empty((0, 2), dtype=np.float64)
+        self.lonlat = np.empty((0, 2), dtype=np.float64)
+        self.read_only = False
+        self.version = 0 # incremented when images are added or removed, see ResultCache.sync
+        self.__rows_from_path = dict()
+        self.__tombstones = set()
+        self.__next_id = 0
+        self.__compaction_threshold = compaction_threshold
+        self.__compaction_thread = None
+        self.__lock = threading.RLock()
+        # Held by add and by the whole compaction, which only takes __lock to snapshot and swap
+        self.__write_lock = threading.RLock()
+
+    def train(self, descriptors : np.ndarray, seed : int = 0):
+        """Create the FAISS index, trained on a random sample of descriptors when the index type needs it."""
+        with self.__lock:
+            sample_size = min(len(descriptors), self.train_sample)
+            # IVF needs at least one training point per cell and PQ one per centroid
+            nlist = max(1, min(self.nlist, sample_size))
+            pq_nbits = max(1, min(8, int(np.log2(max(2, sample_size)))))
+            index = build_faiss_index(self.pca_dim or self.fc_output_dim, self.index_type, nlist, self.hnsw_m, self.encoding, self.pq_m, pq_nbits)
+            if ( self.pca_dim > 0 or not index.is_trained ):
+                rows = np.arange(len(descriptors))
+                if ( len(descriptors) > self.train_sample ):
+                    rows = np.sort(np.random.default_rng(seed).choice(len(descriptors), self.train_sample, replace=False))
+                # descriptors may be memory-mapped (see ShardedDescriptors), only the sampled rows are loaded
+                sample = np.ascontiguousarray(descriptors[rows], dtype="float32")
+                if ( self.pca_dim > 0 ):
+                    if ( len(sample) < self.pca_dim ):
+                        raise ValueError(f"pca_dim : {self.pca_dim} needs at least as many training descriptors, got {len(sample)}")
+                    # eigen_power -0.5 scales each component by the inverse square root of its variance (whitening)
+                    self.pca_matrix = faiss.PCAMatrix(self.fc_output_dim, self.pca_dim, -0.5)
+                    self.pca_matrix.train(sample)
+                    sample = self.__project(sample)
+                if ( not index.is_trained ):
+                    index.train(sample)
+            # IVF stores the ids itself, IndexIDMap2 would shift them on remove_ids
+            self.faiss_index = index if self.index_type == "ivf" else faiss.IndexIDMap2(index)
+            self.set_search_parameters(self.nprobe, self.ef_search)
+
+    def __project(self, descriptors : np.ndarray) -> np.ndarray:
+        """Descriptors as stored in the FAISS index: reduced by pca_matrix and L2 normalized when pca_dim > 0."""
+        descriptors = np.ascontiguousarray(descriptors, dtype="float32")
+        if ( self.pca_matrix is None ):
+            return descriptors
+        projected = self.pca_matrix.apply(descriptors)
+        faiss.normalize_L2(projected)
+        return projected
+
+    def set_search_parameters(self, nprobe : int = None, ef_search : int = None):
+        with self.__lock:
+            self.nprobe = nprobe if nprobe is not None else self.nprobe
+            self.ef_search = ef_search if ef_search is not None else self.ef_search
+            if ( self.faiss_index is None ):
+                return
+            if ( self.index_type == "ivf" ):
+                faiss.ParameterSpace().set_index_parameter(self.faiss_index, "nprobe", self.nprobe)
+            if ( self.index_type == "hnsw" ):
+                faiss.ParameterSpace().set_index_parameter(self.faiss_index, "efSearch", self.ef_search)
+
+    def empty_clone(self) -> "DatabaseIndex":
+        """Empty DatabaseIndex with the parameters and the trained FAISS index of this one, its exact descriptors use a temporary file."""
+        with self.__lock:
+            clone = DatabaseIndex(self.fc_output_dim, self.index_type, self.nlist, self.nprobe, self.hnsw_m, self.ef_search, self.train_sample,
+                                  self.encoding, self.pq_m, self.pca_dim, self.rerank_k, None, self.__compaction_threshold)
+            # The learned projection is only read, clones share it
+            clone.pca_matrix = self.pca_matrix
+            if ( self.faiss_index is not None ):
+                clone.faiss_index = faiss.clone_index(self.faiss_index)
+                clone.faiss_index.reset()
+                clone.set_search_parameters()
+        return clone
+
+    @property
+    def is_similarity(self) -> bool:
+        """True when search returns similarities (inner product or re-ranking, the larger the closer), False for L2 distances."""
+        return self.encoding != "float32" or self.rerank_k > 0
+
+    @property
+    def needs_training(self) -> bool:
+        """True when train must see a sample of the descriptors before any is added (IVF, sq8 and pq encodings)."""
+        return self.pca_dim > 0 or not build_faiss_index(self.pca_dim or self.fc_output_dim, self.index_type, self.nlist, self.hnsw_m, self.encoding, self.pq_m).is_trained
+
+    def __len__(self):
+        return len(self.ids) - len(self.__tombstones)
+
+    def __path_rows(self) -> dict:
+        # Built on first use, so workers of a loaded index that only search never pay for it
+        if ( self.__rows_from_path is None ):
+            self.__rows_from_path = {Path(image_path) : row for row, image_path in enumerate(self.paths)}
+        return self.__rows_from_path
+
+    def __check_writable(self):
+        if ( self.read_only ):
+            raise PermissionError("DatabaseIndex loaded with DatabaseIndex.load is read-only")
+
+    def __contains__(self, image_path : Path):
+        return image_path in self.__path_rows()
+
+    def add(self, image_paths : List[Path], descriptors : np.ndarray, coordinates : Tuple[np.ndarray, np.ndarray] = None) -> np.ndarray:
+        """Add the descriptors of image_paths, already indexed paths are replaced.
+
+        coordinates are the (utm, lonlat) arrays of image_paths, e.g. from the catalog, if None they are read from the image names.
+        """
+        self.__check_writable()
+        with self.__write_lock, self.__lock:
+            self.remove([image_path for image_path in image_paths if image_path in self.__path_rows()], compact=False)
+            new_ids = np.arange(self.__next_id, self.__next_id + len(image_paths), dtype=np.int64)
+            self.__next_id += len(image_paths)
+            if ( self.faiss_index is None ):
+                self.train(descriptors)
+            self.faiss_index.add_with_ids(self.__project(descriptors), new_ids)
+            if ( self.exact_descriptors is not None ):
+                self.exact_descriptors.append(descriptors)
+            first_row = len(self.ids)
+            self.ids = np.concatenate((self.ids, new_ids))
+            self.paths.extend(image_paths)
+            new_utm, new_lonlat = coordinates if coordinates is not None else read_coordinates(image_paths)
+            self.utm = np.concatenate((self.utm, new_utm))
+            self.lonlat = np.concatenate((self.lonlat, new_lonlat))
+            self.__path_rows().update({image_path : first_row + offset for offset, image_path in enumerate(image_paths)})
+            self.version += 1
+        return new_ids
+
+    def remove(self, image_paths : List[Path], compact : bool = True) -> int:
+        """Tombstone image_paths, return the number of removed images."""
+        self.__check_writable()
+        with self.__lock:
+            removed = 0
+            for image_path in image_paths:
+                row = self.__path_rows().pop(image_path, None)
+                if ( row is None ):
+                    continue
+                self.__tombstones.add(int(self.ids[row]))
+                removed += 1
+            if ( removed > 0 ):
+                self.version += 1
+        if ( compact and len(self.__tombstones) >= self.__compaction_threshold ):
+            self.compact_in_background()
+        return removed
+
+    def compact(self):
+        """Drop the tombstoned ids from the FAISS index and the metadata table.
+
+        The replacement index is built from a snapshot without holding the search lock, which is only taken
+        to snapshot and to swap: searches go on during the rebuild and ids tombstoned meanwhile stay
+        tombstoned. Additions wait for the compaction.
+        """
+        with self.__write_lock:
+            with self.__lock:
+                if ( len(self.__tombstones) == 0 ):
+                    return
+                tombstones = np.fromiter(self.__tombstones, dtype=np.int64)
+                ids, paths = self.ids, self.paths
+                utm, lonlat = self.utm, self.lonlat
+                if ( self.index_type == "hnsw" ):
+                    stored_ids = faiss.vector_to_array(self.faiss_index.id_map)
+                    # The exact descriptors are fc_output_dim wide, the index stores them reduced by pca_matrix
+                    vectors = np.array(self.exact_descriptors[stored_ids]) if self.exact_descriptors is not None else self.faiss_index.index.reconstruct_n(0, self.faiss_index.ntotal)
+                else:
+                    faiss_index = faiss.clone_index(self.faiss_index)
+            if ( self.index_type == "hnsw" ):
+                faiss_index = self.__rebuild_without(stored_ids, self.__project(vectors) if self.exact_descriptors is not None else vectors, tombstones)
+            else:
+                faiss_index.remove_ids(tombstones)
+            kept_rows = np.flatnonzero(~np.isin(ids, tombstones))
+            kept_ids = ids[kept_rows]
+            kept_paths = [paths[row] for row in kept_rows]
+            rows_from_path = {image_path : row for row, image_path in enumerate(kept_paths)}
+            with self.__lock:
+                # Ids tombstoned during the rebuild are still in the new index
+                new_tombstones = self.__tombstones.difference(tombstones.tolist())
+                for row in np.flatnonzero(np.isin(kept_ids, np.fromiter(new_tombstones, dtype=np.int64))):
+                    rows_from_path.pop(kept_paths[row], None)
+                self.faiss_index = faiss_index
+                self.set_search_parameters()
+                self.ids = kept_ids
+                self.paths = kept_paths
+                self.utm = utm[kept_rows]
+                self.lonlat = lonlat[kept_rows]
+                self.__rows_from_path = rows_from_path
+                self.__tombstones = new_tombstones
+
+    def __rebuild_without(self, stored_ids : np.ndarray, vectors : np.ndarray, removed_ids : np.ndarray) -> faiss.Index:
+        # HNSW graphs do not support removal, the live vectors are re-inserted in an empty clone
+        is_kept = ~np.isin(stored_ids, removed_ids)
+        index = faiss.clone_index(self.faiss_index.index)
+        index.reset()
+        faiss_index = faiss.IndexIDMap2(index)
+        faiss_index.add_with_ids(vectors[is_kept], stored_ids[is_kept])
+        return faiss_index
+
+    def compact_in_background(self) -> threading.Thread:
+        with self.__lock:
+            if ( self.__compaction_thread is None or not self.__compaction_thread.is_alive() ):
+                self.__compaction_thread = threading.Thread(target=self.compact, name="DatabaseIndex-compaction", daemon=True)
+                self.__compaction_thread.start()
+            return self.__compaction_thread
+
+    def __rerank(self, descriptors : np.ndarray, candidate_ids : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        exact_descriptors = self.exact_descriptors[np.maximum(candidate_ids, 0)]
+        scores = np.einsum("qkd,qd->qk", exact_descriptors, descriptors)
+        scores[candidate_ids < 0] = -np.inf
+        order = np.argsort(-scores, axis=1, kind="stable")
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(candidate_ids, order, axis=1)
+
+    def search(self, descriptors : np.ndarray, k : int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the distances (similarities with inner product or re-ranking) and the ids of the k nearest live images, -1 where there is none."""
+        descriptors = np.ascontiguousarray(descriptors, dtype="float32")
+        candidates = max(k, self.rerank_k) if self.exact_descriptors is not None else k
+        with self.__lock:
+            fetch = min(candidates + len(self.__tombstones), self.faiss_index.ntotal if self.faiss_index is not None else 0)
+            if ( fetch == 0 ):
+                return np.full((len(descriptors), k), np.inf, dtype="float32"), np.full((len(descriptors), k), -1, dtype=np.int64)
+            distances, found_ids = self.faiss_index.search(self.__project(descriptors), fetch)
+            if ( len(self.__tombstones) > 0 ):
+                is_dead = np.isin(found_ids, np.fromiter(self.__tombstones, dtype=np.int64)) | (found_ids < 0)
+                order = np.argsort(is_dead, axis=1, kind="stable")
+                distances = np.take_along_axis(distances, order, axis=1)
+                found_ids = np.take_along_axis(found_ids, order, axis=1)
+                found_ids[np.take_along_axis(is_dead, order, axis=1)] = -1
+            distances, found_ids = distances[:, :candidates], found_ids[:, :candidates]
+            if ( self.exact_descriptors is not None ):
+                distances, found_ids = self.__rerank(descriptors, found_ids)
+        distances, found_ids = distances[:, :k], found_ids[:, :k]
+        if ( found_ids.shape[1] < k ):
+            distances = np.pad(distances, ((0, 0), (0, k - found_ids.shape[1])), constant_values=np.inf)
+            found_ids = np.pad(found_ids, ((0, 0), (0, k - found_ids.shape[1])), constant_values=-1)
+        return distances, found_ids
+
+    def rows_of(self, ids : np.ndarray) -> np.ndarray:
+        """Metadata rows of ids, -1 for unknown or already compacted ids."""
+        with self.__lock:
+            rows = np.searchsorted(self.ids, ids)
+            rows[rows >= len(self.ids)] = 0
+            is_known = (len(self.ids) > 0) & (ids >= 0)
+            if ( len(self.ids) > 0 ):
+                is_known &= self.ids[rows] == ids
+            rows[~is_known] = -1
+        return rows
+
+    def paths_of(self, ids : np.ndarray) -> List[Path]:
+        with self.__lock:
+            return [Path(self.paths[row]) if row >= 0 else None for row in self.rows_of(np.asarray(ids, dtype=np.int64)).ravel()]
+
+    def coordinates_of(self, ids : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """UTM east/north and lon/lat of ids, shape ids.shape + (2,), NaN for unknown ids."""
+        with self.__lock:
+            rows = self.rows_of(np.asarray(ids, dtype=np.int64))
+            utm = self.utm[rows] if len(self.ids) > 0 else np.empty(rows.shape + (2,))
+            lonlat = self.lonlat[rows] if len(self.ids) > 0 else np.empty(rows.shape + (2,))
+        utm[rows < 0] = np.nan
+        lonlat[rows < 0] = np.nan
+        return utm, lonlat
+
+    def save(self, index_folder : Path):
+        """Write the compacted FAISS index and the metadata table to index_folder, read back with DatabaseIndex.load."""
+        with self.__write_lock, self.__lock:
+            if ( self.faiss_index is None ):
+                raise ValueError("DatabaseIndex is empty, nothing to save")
+            self.compact()
+            staging_folder = index_folder.with_name(f"{index_folder.name}.staging")
+            shutil.rmtree(staging_folder, ignore_errors=True)
+            staging_folder.mkdir(parents=True)
+            faiss.write_index(self.faiss_index, str(staging_folder.joinpath(INDEX_FILE)))
+            if ( self.pca_matrix is not None ):
+                faiss.write_VectorTransform(self.pca_matrix, str(staging_folder.joinpath(PCA_FILE)))
+            np.save(staging_folder.joinpath("ids.npy"), self.ids)
+            np.save(staging_folder.joinpath("utm.npy"), self.utm)
+            np.save(staging_folder.joinpath("lonlat.npy"), self.lonlat)
+            # Fixed-width strings, so the paths can be memory-mapped like the other columns
+            np.save(staging_folder.joinpath("paths.npy"), np.array([str(image_path) for image_path in self.paths], dtype=str))
+            if ( self.exact_descriptors is not None ):
+                shutil.copyfile(self.exact_descriptors.path, staging_folder.joinpath(EXACT_DESCRIPTORS_FILE))
+            metadata = {
+                "fc_output_dim" : self.fc_output_dim,
+                "index_type" : self.index_type,
+                "nlist" : self.nlist,
+                "nprobe" : self.nprobe,
+                "hnsw_m" : self.hnsw_m,
+                "ef_search" : self.ef_search,
+                "train_sample" : self.train_sample,
+                "encoding" : self.encoding,
+                "pq_m" : self.pq_m,
+                "pca_dim" : self.pca_dim,
+                "rerank_k" : self.rerank_k,
+                "next_id" : self.__next_id,
+            }
+            with open(staging_folder.joinpath("metadata.json"), 'w') as metadata_file:
+                json.dump(metadata, metadata_file)
+            shutil.rmtree(index_folder, ignore_errors=True)
+            staging_folder.rename(index_folder)
+
+    @staticmethod
+    def load(index_folder : Path, mmap : bool = True) -> "DatabaseIndex":
+        """Open an index written by DatabaseIndex.save, read-only.
+
+        With mmap the FAISS index (IO_FLAG_MMAP_IFC: codes, inverted lists and graph) and the metadata columns are memory-mapped instead of copied,
+        so every process loading the same folder searches the same pages of the page cache.
+        """
+        if ( not index_folder.joinpath("metadata.json").exists() ):
+            raise FileNotFoundError(f"Folder : {index_folder} is not a saved DatabaseIndex")
+        with open(index_folder.joinpath("metadata.json"), 'r') as metadata_file:
+            metadata = json.load(metadata_file)
+        database_index = DatabaseIndex(metadata["fc_output_dim"],
+                                       index_type=metadata["index_type"],
+                                       nlist=metadata["nlist"],
+                                       nprobe=metadata["nprobe"],
+                                       hnsw_m=metadata["hnsw_m"],
+                                       ef_search=metadata["ef_search"],
+                                       train_sample=metadata["train_sample"],
+                                       encoding=metadata["encoding"],
+                                       pq_m=metadata["pq_m"],
+                                       pca_dim=metadata.get("pca_dim", 0))
+        io_flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else faiss.IO_FLAG_READ_ONLY
+        mmap_mode = 'r' if mmap else None
+        database_index.faiss_index = faiss.read_index(str(index_folder.joinpath(INDEX_FILE)), io_flags)
+        if ( database_index.pca_dim > 0 ):
+            database_index.pca_matrix = faiss.read_VectorTransform(str(index_folder.joinpath(PCA_FILE)))
+        database_index.ids = np.load(index_folder.joinpath("ids.npy"), mmap_mode=mmap_mode)
+        database_index.utm = np.load(index_folder.joinpath("utm.npy"), mmap_mode=mmap_mode)
+        database_index.lonlat = np.load(index_folder.joinpath("lonlat.npy"), mmap_mode=mmap_mode)
+        database_index.paths = np.load(index_folder.joinpath("paths.npy"), mmap_mode=mmap_mode)
+        database_index.rerank_k = metadata["rerank_k"]
+        if ( database_index.rerank_k > 0 ):
+            database_index.exact_descriptors = ExactDescriptors(metadata["fc_output_dim"], index_folder.joinpath(EXACT_DESCRIPTORS_FILE), read_only=True)
+        database_index.__next_id = metadata["next_id"]
+        database_index.__rows_from_path = None
+        database_index.read_only = True
+        database_index.set_search_parameters()
+        return database_index
+
+    def __repr__(self):
+        return f"< DatabaseIndex - {self.index_type} - {self.encoding} - #live: {len(self)} - #tombstones: {len(self.__tombstones)} >"
+
+
+def read_coordinates(image_paths : List[Path]) -> Tuple[np.ndarray, np.ndarray]:
+    utm = np.empty((len(image_paths), 2), dtype=np.float64)
+    lonlat = np.empty((len(image_paths), 2), dtype=np.float64)
+    for row, image_path in enumerate(image_paths):
+        datas = read_datas(image_path)
+        utm[row] = datas["UTM_east"], datas["UTM_north"]
+        lonlat[row] = datas["GPS_longitude"], datas["GPS_latitude"]
+    return utm, lonlat
+
+def default_index_folder(database_folder : Path) -> Path:
+    return database_folder.with_name(f"{database_folder.name}.index")
+
+def index_params_from_args(args : dict) -> dict:
+    """Keyword arguments of DatabaseIndex, after fc_output_dim, given by the index arguments."""
+    return {
+        "index_type" : args["index_type"],
+        "nlist" : args["nlist"],
+        "nprobe" : args["nprobe"],
+        "hnsw_m" : args["hnsw_m"],
+        "ef_search" : args["ef_search"],
+        "train_sample" : args["train_sample"],
+        "encoding" : args["index_encoding"],
+        "pq_m" : args["pq_m"],
+        "pca_dim" : args["pca_dim"],
+        "rerank_k" : args["rerank_k"],
+        "rerank_file" : args["rerank_file"],
+    }
+
+def database_index_from_args(args : dict) -> DatabaseIndex:
+    return DatabaseIndex(args["fc_output_dim"], **index_params_from_args(args))
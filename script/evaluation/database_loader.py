@@ -1,13 +1,26 @@
+import torch
+import numpy as np
 import torch.utils.data as data
 from pathlib import Path
-from evaluation.utils import get_normalized_image
+from typing import List, Tuple
+from evaluation.utils import get_normalized_image, get_uint8_image_path
+from evaluation.decoded_cache import DecodedImageCache
+from util.catalog import find_catalog
 
 class DatabaseLoaderPIL(data.Dataset):
-    def __init__(self, database_folder : Path = Path("processed")):
+    def __init__(self, database_folder : Path = Path("processed"), use_catalog : bool = True):
         super().__init__()
         self.database_folder = database_folder
         self.__verify_args()
-        self.database_paths = sorted( self.database_folder.rglob("*.jpg") )
+        # (utm, lonlat) arrays aligned with database_paths when they come from the catalog
+        self.coordinates = None
+        catalog = find_catalog(self.database_folder) if use_catalog else None
+        if ( catalog is None ):
+            self.database_paths = sorted( self.database_folder.rglob("*.jpg") )
+            return
+        self.database_paths, datas = catalog.load_images(self.database_folder, ["utm_east", "utm_north", "longitude", "latitude"])
+        self.coordinates = (np.stack((datas["utm_east"], datas["utm_north"]), axis=1).astype(np.float64).reshape(-1, 2),
+                            np.stack((datas["longitude"], datas["latitude"]), axis=1).astype(np.float64).reshape(-1, 2))
 
     def __verify_args(self):
         if ( not self.database_folder.exists() ):
@@ -32,3 +45,44 @@ class DatabaseLoaderPaths(DatabaseLoaderPIL):
     
     def __getitem__(self, index):
         return self.database_paths[index], index
+
+
+class ImageListLoaderPIL(DatabaseLoaderPIL):
+    def __init__(self, image_paths : List[Path]):
+        data.Dataset.__init__(self)
+        self.database_folder = None
+        self.database_paths = list(image_paths)
+        self.coordinates = None
+    
+    def __repr__(self):
+        return f"< image list - #db: {len(self.database_paths)} >"
+
+
+class DatabaseLoaderUInt8(DatabaseLoaderPIL):
+    def __init__(self, database_folder : Path = Path("processed"), draft_size : Tuple[int, int] = None, use_catalog : bool = True):
+        """Same images as DatabaseLoaderPIL as uint8 CHW tensors, a quarter of the float32 bytes sent by the workers.
+
+        The model must normalize the batches, see UInt8Normalization (done by the Evaluator).
+        """
+        super().__init__(database_folder, use_catalog)
+        self.draft_size = draft_size
+    
+    def __getitem__(self, index):
+        image_path = self.database_paths[index]
+        return get_uint8_image_path(image_path, self.draft_size), index
+
+
+class DatabaseLoaderDecodedCache(DatabaseLoaderPIL):
+    def __init__(self, database_folder : Path = Path("processed"), cache_folder : Path = None, num_workers : int = 8, use_catalog : bool = True):
+        """Same images as DatabaseLoaderUInt8, read from a DecodedImageCache by memory-mapped slicing instead of decoded.
+
+        The cache is brought up to date with the folder when the dataset is created, only new or modified
+        images are decoded. The model must normalize the batches, see UInt8Normalization (done by the Evaluator).
+        """
+        super().__init__(database_folder, use_catalog)
+        self.decoded_cache = DecodedImageCache(database_folder, cache_folder, num_workers=num_workers)
+        decoded = self.decoded_cache.update(self.database_paths)
+        print(f"Decoded {decoded} images into {self.decoded_cache}, {len(self.database_paths) - decoded} reused")
+    
+    def __getitem__(self, index):
+        return torch.from_numpy(np.array(self.decoded_cache[index])), index
@@ -0,0 +1,129 @@
+import json
+import shutil
+import numpy as np
+from pathlib import Path
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from evaluation.utils import get_uint8_image_path
+from evaluation.descriptor_store import image_signature
+
+CACHE_VERSION = 1
+DEFAULT_SHARD_BYTES = 1 << 30 # 1 GiB, about 1365 processed 512x512 images per shard
+DECODE_CHUNK = 256
+
+def default_cache_folder(database_folder : Path) -> Path:
+    return database_folder.with_name(f"{database_folder.name}.decoded")
+
+def decoded_shard_path(folder : Path, shard_index : int) -> Path:
+    return folder.joinpath(f"decoded_{shard_index:05d}.u8")
+
+
+class DecodedImageCache():
+    def __init__(self, database_folder : Path, cache_folder : Path = None, shard_bytes : int = DEFAULT_SHARD_BYTES, num_workers : int = 8):
+        """On-disk cache of the decoded uint8 CHW images of a processed folder, in large contiguous shard files.
+
+        Each image is keyed by its path relative to database_folder, its size and its mtime, and stored
+        as one contiguous slice of a shard, read back by memory-mapped slicing without any JPEG decode.
+
+        Args:
+            database_folder (Path): folder of the processed database images.
+            cache_folder (Path): where to save the cache, if None use default_cache_folder(database_folder).
+            shard_bytes (int): maximum size of a shard file, an image is never split across shards.
+            num_workers (int): threads decoding the missing images.
+        """
+        self.__database_folder = database_folder
+        self.cache_folder = cache_folder if cache_folder is not None else default_cache_folder(database_folder)
+        self.__staging_folder = self.cache_folder.with_name(f"{self.cache_folder.name}.staging")
+        self.__metadata_path = self.cache_folder.joinpath("metadata.json")
+        self.__shard_bytes = shard_bytes
+        self.__num_workers = num_workers
+        self.entries = None
+        self.__shards = None
+
+    def __relative_key(self, image_path : Path) -> str:
+        return image_path.relative_to(self.__database_folder).as_posix()
+
+    def __read_metadata(self) -> dict:
+        if ( not self.__metadata_path.exists() ):
+            return None
+        with open(self.__metadata_path, 'r') as metadata_file:
+            metadata = json.load(metadata_file)
+        if ( metadata.get("version") != CACHE_VERSION ):
+            return None
+        return metadata
+
+    def update(self, image_paths : List[Path]) -> int:
+        """Make the cache hold exactly image_paths, in this order, return the number of decoded images.
+
+        Images whose size and mtime did not change are copied from the previous shards instead of decoded.
+        """
+        metadata = self.__read_metadata()
+        stored = dict()
+        if ( metadata is not None ):
+            stored = {entry[0] : entry for entry in metadata["images"]}
+        signatures = [image_signature(image_path) for image_path in image_paths]
+        keys = [self.__relative_key(image_path) for image_path in image_paths]
+        is_valid = [key in stored and tuple(stored[key][1:3]) == signature for key, signature in zip(keys, signatures)]
+        if ( metadata is not None and all(is_valid) and [entry[0] for entry in metadata["images"]] == keys ):
+            self.entries = metadata["images"]
+            return 0
+        shutil.rmtree(self.__staging_folder, ignore_errors=True)
+        self.__staging_folder.mkdir(parents=True)
+        previous_shards = self.__open_shards(self.cache_folder, metadata["images"]) if metadata is not None else []
+        entries = []
+        shard_index, offset = 0, 0
+        shard_file = open(decoded_shard_path(self.__staging_folder, shard_index), 'wb')
+        decoded = 0
+        with ThreadPoolExecutor(max_workers=max(1, self.__num_workers)) as executor:
+            def image_bytes(row : int) -> np.ndarray:
+                if ( is_valid[row] ):
+                    _, _, _, previous_shard, previous_offset, channels, height, width = stored[keys[row]]
+                    return np.asarray(previous_shards[previous_shard][previous_offset:previous_offset + channels * height * width]).reshape(channels, height, width)
+                return get_uint8_image_path(image_paths[row]).numpy()
+            # Decoded by chunks, so at most DECODE_CHUNK images are held in memory
+            for chunk_start in range(0, len(image_paths), DECODE_CHUNK):
+                rows = range(chunk_start, min(chunk_start + DECODE_CHUNK, len(image_paths)))
+                for row, image in zip(rows, executor.map(image_bytes, rows)):
+                    decoded += not is_valid[row]
+                    if ( offset > 0 and offset + image.nbytes > self.__shard_bytes ):
+                        shard_file.close()
+                        shard_index, offset = shard_index + 1, 0
+                        shard_file = open(decoded_shard_path(self.__staging_folder, shard_index), 'wb')
+                    shard_file.write(np.ascontiguousarray(image).tobytes())
+                    entries.append([keys[row], *signatures[row], shard_index, offset, *image.shape])
+                    offset += image.nbytes
+        shard_file.close()
+        previous_shards.clear()
+        # Metadata is removed first so an interrupted update leaves an invalid cache, never a mismatched one
+        self.__metadata_path.unlink(missing_ok=True)
+        shutil.rmtree(self.cache_folder, ignore_errors=True)
+        self.__staging_folder.rename(self.cache_folder)
+        with open(self.__metadata_path, 'w') as metadata_file:
+            json.dump({"version" : CACHE_VERSION, "images" : entries}, metadata_file)
+        self.entries = entries
+        self.__shards = None
+        return decoded
+
+    @staticmethod
+    def __open_shards(folder : Path, entries : list) -> List[np.memmap]:
+        number_of_shards = max((entry[3] for entry in entries), default=-1) + 1
+        return [np.memmap(decoded_shard_path(folder, shard_index), dtype=np.uint8, mode='r') for shard_index in range(number_of_shards)]
+
+    def __len__(self):
+        return len(self.entries) if self.entries is not None else 0
+
+    def __getitem__(self, row : int) -> np.ndarray:
+        """uint8 CHW image of row, a read-only view of the memory-mapped shard."""
+        if ( self.__shards is None ):
+            # Opened lazily, so DataLoader workers map the shards themselves instead of receiving them
+            self.__shards = self.__open_shards(self.cache_folder, self.entries)
+        _, _, _, shard_index, offset, channels, height, width = self.entries[row]
+        return self.__shards[shard_index][offset:offset + channels * height * width].reshape(channels, height, width)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_DecodedImageCache__shards"] = None
+        return state
+
+    def __repr__(self):
+        return f"< DecodedImageCache - {self.cache_folder} - #images: {len(self)} >"
@@ -0,0 +1,251 @@
+import json
+import shutil
+import hashlib
+import torch
+import numpy as np
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+STORE_VERSION = 2
+DEFAULT_SHARD_SIZE = 16384 # 128 MiB shards for 2048-d float32 descriptors
+CHECKPOINT_FILE = "checkpoint.json"
+COMPLETED_FILE = "completed.npy"
+
+def model_fingerprint(model : torch.nn.Module, backbone : str, fc_output_dim : int, backend : str = "eager", precision : str = "fp32") -> str:
+    """Hash of the model weights and of the arguments used to build it, used as the store key.
+
+    Artifacts of main_model_export.py and reduced precisions only match the eager fp32 descriptors within
+    a tolerance, so the backend and the precision are part of the key.
+    """
+    digest = hashlib.sha1(f"{STORE_VERSION}@{backbone}@{fc_output_dim}".encode())
+    if ( backend != "eager" ):
+        digest.update(backend.encode())
+    if ( precision != "fp32" ):
+        digest.update(precision.encode())
+    for name, tensor in model.state_dict().items():
+        tensor = tensor.detach().cpu()
+        if ( tensor.is_floating_point() ):
+            tensor = tensor.float()
+        digest.update(name.encode())
+        digest.update(tensor.contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+def default_store_folder(database_folder : Path) -> Path:
+    return database_folder.with_name(f"{database_folder.name}.descriptors")
+
+def image_signature(image_path : Path) -> Tuple[int, int]:
+    stat = image_path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+def shard_path(folder : Path, shard_index : int) -> Path:
+    return folder.joinpath(f"descriptors_{shard_index:05d}.npy")
+
+
+class ShardedDescriptors():
+    def __init__(self, shards : List[np.ndarray], shard_size : int, fc_output_dim : int):
+        """Descriptors matrix split in fixed-size .npy shards opened with np.memmap.
+
+        Rows are indexed globally, row r lives in shard r // shard_size, so the matrix can be
+        larger than the memory: only the accessed rows are paged in.
+        """
+        self.shards = shards
+        self.shard_size = shard_size
+        self.fc_output_dim = fc_output_dim
+        self.__length = sum(len(shard) for shard in shards)
+
+    @staticmethod
+    def create(folder : Path, number_of_descriptors : int, fc_output_dim : int, shard_size : int = DEFAULT_SHARD_SIZE) -> "ShardedDescriptors":
+        folder.mkdir(parents=True, exist_ok=True)
+        shards = []
+        for shard_index, start in enumerate(range(0, number_of_descriptors, shard_size)):
+            rows = min(shard_size, number_of_descriptors - start)
+            shards.append(np.lib.format.open_memmap(shard_path(folder, shard_index), mode='w+', dtype="float32", shape=(rows, fc_output_dim)))
+        return ShardedDescriptors(shards, shard_size, fc_output_dim)
+
+    @staticmethod
+    def open(folder : Path, shard_size : int, fc_output_dim : int, mode : str = 'r') -> "ShardedDescriptors":
+        shards = [np.load(path, mmap_mode=mode) for path in sorted(folder.glob("descriptors_*.npy"))]
+        return ShardedDescriptors(shards, shard_size, fc_output_dim)
+
+    def __len__(self):
+        return self.__length
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (self.__length, self.fc_output_dim)
+
+    def __rows(self, rows) -> np.ndarray:
+        if ( isinstance(rows, slice) ):
+            return np.arange(*rows.indices(self.__length))
+        return np.asarray(rows, dtype=np.int64)
+
+    def __getitem__(self, rows) -> np.ndarray:
+        rows = self.__rows(rows)
+        descriptors = np.empty(rows.shape + (self.fc_output_dim,), dtype="float32")
+        shard_of_rows = rows // self.shard_size
+        for shard_index in np.unique(shard_of_rows):
+            is_in_shard = shard_of_rows == shard_index
+            descriptors[is_in_shard] = self.shards[shard_index][rows[is_in_shard] % self.shard_size]
+        return descriptors
+
+    def __setitem__(self, rows, descriptors : np.ndarray):
+        rows = self.__rows(rows)
+        descriptors = np.asarray(descriptors, dtype="float32")
+        shard_of_rows = rows // self.shard_size
+        for shard_index in np.unique(shard_of_rows):
+            is_in_shard = shard_of_rows == shard_index
+            self.shards[shard_index][rows[is_in_shard] % self.shard_size] = descriptors[is_in_shard]
+
+    def iter_shards(self) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yield (first row, shard) pairs, one shard at a time."""
+        for shard_index, shard in enumerate(self.shards):
+            yield shard_index * self.shard_size, shard
+
+    def flush(self):
+        for shard in self.shards:
+            if ( isinstance(shard, np.memmap) ):
+                shard.flush()
+
+    def close(self):
+        self.flush()
+        self.shards = []
+
+
+class DescriptorStore():
+    def __init__(self, database_folder : Path, model_key : str, fc_output_dim : int, store_folder : Path = None, shard_size : int = DEFAULT_SHARD_SIZE):
+        """On-disk cache of the database descriptors, saved next to the database folder as memory-mapped shards.
+
+        Args:
+            database_folder (Path): folder of the processed database images, image keys are relative to it.
+            model_key (str): fingerprint of the model, see model_fingerprint.
+            fc_output_dim (int): dimension of the descriptors.
+            store_folder (Path): where to save the store, if None use default_store_folder(database_folder).
+            shard_size (int): number of descriptors per shard.
+        """
+        self.__database_folder = database_folder
+        self.__model_key = model_key
+        self.__fc_output_dim = fc_output_dim
+        self.__shard_size = shard_size
+        self.store_folder = store_folder if store_folder is not None else default_store_folder(database_folder)
+        self.__staging_folder = self.store_folder.with_name(f"{self.store_folder.name}.staging")
+        self.__metadata_path = self.store_folder.joinpath("metadata.json")
+        self.__completed = None
+        self.is_stale = True
+
+    def __relative_key(self, image_path : Path) -> str:
+        return image_path.relative_to(self.__database_folder).as_posix()
+
+    def __read_metadata(self) -> dict:
+        if ( not self.__metadata_path.exists() ):
+            return None
+        with open(self.__metadata_path, 'r') as metadata_file:
+            metadata = json.load(metadata_file)
+        if ( metadata.get("version") != STORE_VERSION or metadata.get("model_key") != self.__model_key or metadata.get("fc_output_dim") != self.__fc_output_dim ):
+            return None
+        return metadata
+
+    def __checkpoint_key(self, images : List[list]) -> dict:
+        return {
+            "version": STORE_VERSION,
+            "model_key": self.__model_key,
+            "fc_output_dim": self.__fc_output_dim,
+            "shard_size": self.__shard_size,
+            "images_digest": hashlib.sha1(json.dumps(images).encode()).hexdigest(),
+        }
+
+    def __resume(self, checkpoint_key : dict) -> ShardedDescriptors:
+        """Staged shards of an interrupted extraction of the same images with the same model, None if there is none."""
+        checkpoint_path = self.__staging_folder.joinpath(CHECKPOINT_FILE)
+        if ( not checkpoint_path.exists() ):
+            return None
+        with open(checkpoint_path, 'r') as checkpoint_file:
+            if ( json.load(checkpoint_file) != checkpoint_key ):
+                return None
+        self.__completed = np.load(self.__staging_folder.joinpath(COMPLETED_FILE), mmap_mode='r+')
+        return ShardedDescriptors.open(self.__staging_folder, self.__shard_size, self.__fc_output_dim, mode='r+')
+
+    def lookup(self, image_paths : List[Path]) -> Tuple[ShardedDescriptors, np.ndarray]:
+        """Return the sharded descriptors of image_paths, filled where the store is still valid, and the valid mask.
+
+        When the store is up to date its shards are returned read-only, otherwise new writable shards are
+        staged next to the store, the valid descriptors are copied shard by shard and save must be called.
+        The staged rows written since are recorded with checkpoint, so a staging left by an interrupted
+        extraction of the same images with the same model is resumed instead of restarted.
+        """
+        metadata = self.__read_metadata()
+        images = [[self.__relative_key(image_path), *image_signature(image_path)] for image_path in image_paths]
+        source_rows = np.full(len(image_paths), -1, dtype=np.int64)
+        if ( metadata is not None ):
+            stored_rows = {key : (row, size, mtime) for row, (key, size, mtime) in enumerate(metadata["images"])}
+            for index, (key, size, mtime) in enumerate(images):
+                stored = stored_rows.get(key)
+                if ( stored is not None and stored[1:] == (size, mtime) ):
+                    source_rows[index] = stored[0]
+        is_valid = source_rows >= 0
+        self.is_stale = metadata is None or not ( is_valid.all() and len(metadata["images"]) == len(image_paths) and (source_rows == np.arange(len(image_paths))).all() )
+        if ( not self.is_stale ):
+            return ShardedDescriptors.open(self.store_folder, metadata["shard_size"], self.__fc_output_dim), is_valid
+        checkpoint_key = self.__checkpoint_key(images)
+        descriptors = self.__resume(checkpoint_key)
+        if ( descriptors is not None ):
+            print(f"Resuming the interrupted extraction staged in {self.__staging_folder}")
+            return descriptors, np.array(self.__completed)
+        shutil.rmtree(self.__staging_folder, ignore_errors=True)
+        descriptors = ShardedDescriptors.create(self.__staging_folder, len(image_paths), self.__fc_output_dim, self.__shard_size)
+        if ( is_valid.any() ):
+            stored_descriptors = ShardedDescriptors.open(self.store_folder, metadata["shard_size"], self.__fc_output_dim)
+            for start, shard in descriptors.iter_shards():
+                is_valid_in_shard = is_valid[start:start + len(shard)]
+                shard[is_valid_in_shard] = stored_descriptors[source_rows[start:start + len(shard)][is_valid_in_shard]]
+            stored_descriptors.close()
+        descriptors.flush()
+        self.__completed = np.lib.format.open_memmap(self.__staging_folder.joinpath(COMPLETED_FILE), mode='w+', dtype=bool, shape=(len(image_paths),))
+        self.__completed[:] = is_valid
+        self.__completed.flush()
+        # Written last, a staging without checkpoint is never resumed
+        with open(self.__staging_folder.joinpath(CHECKPOINT_FILE), 'w') as checkpoint_file:
+            json.dump(checkpoint_key, checkpoint_file)
+        return descriptors, is_valid
+
+    def checkpoint(self, descriptors : ShardedDescriptors, rows : np.ndarray):
+        """Record that rows of the staged descriptors are written, they are flushed first."""
+        if ( self.__completed is None ):
+            return
+        descriptors.flush()
+        self.__completed[rows] = True
+        self.__completed.flush()
+
+    def save(self, image_paths : List[Path], descriptors : ShardedDescriptors) -> ShardedDescriptors:
+        """Replace the store with the staged descriptors returned by lookup, return them read-only."""
+        if ( not self.is_stale ):
+            return descriptors
+        descriptors.close()
+        self.__completed = None
+        self.__staging_folder.joinpath(CHECKPOINT_FILE).unlink(missing_ok=True)
+        self.__staging_folder.joinpath(COMPLETED_FILE).unlink(missing_ok=True)
+        # Metadata is removed first so an interrupted save leaves an invalid store, never a mismatched one
+        self.__metadata_path.unlink(missing_ok=True)
+        shutil.rmtree(self.store_folder, ignore_errors=True)
+        self.__staging_folder.rename(self.store_folder)
+        metadata = {
+            "version": STORE_VERSION,
+            "model_key": self.__model_key,
+            "fc_output_dim": self.__fc_output_dim,
+            "shard_size": self.__shard_size,
+            "images": [[self.__relative_key(image_path), *image_signature(image_path)] for image_path in image_paths],
+        }
+        with open(self.__metadata_path, 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+        self.is_stale = False
+        return ShardedDescriptors.open(self.store_folder, self.__shard_size, self.__fc_output_dim)
+
+    def __repr__(self):
+        return f"< DescriptorStore - {self.store_folder} >"
+
+
+def read_store(store_folder : Path) -> Tuple[List[Path], ShardedDescriptors]:
+    """Image paths (relative to the database folder) and memory-mapped descriptors of a saved store."""
+    with open(store_folder.joinpath("metadata.json"), 'r') as metadata_file:
+        metadata = json.load(metadata_file)
+    image_paths = [Path(key) for key, _, _ in metadata["images"]]
+    return image_paths, ShardedDescriptors.open(store_folder, metadata["shard_size"], metadata["fc_output_dim"])
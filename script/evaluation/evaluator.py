@@ -1,13 +1,24 @@
-import faiss
+import time
 import torch
+import threading
+import base64
+import shutil
+import tempfile
 import numpy as np
 from tqdm import tqdm
-from typing import List, Dict
-from torch.utils.data import DataLoader
+from typing import Callable, List, Dict, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import DataLoader, Subset
 from pathlib import Path
-from evaluation.database_loader import DatabaseLoaderPIL, DatabaseLoaderPaths
-from util.image_manager import read_datas
-from evaluation.utils import get_normalized_image
+from evaluation.database_loader import DatabaseLoaderPIL, ImageListLoaderPIL
+from evaluation.database_index import DatabaseIndex
+from evaluation.partitioned_index import PartitionedIndex, GPSPrior
+from evaluation.utils import open_image_path, open_image_bytes, base_transform, UInt8Normalization
+from evaluation.descriptor_store import DescriptorStore, ShardedDescriptors
+from evaluation.result_cache import ResultCache, image_digest, search_options
+from evaluation.parallel_extraction import ParallelExtractor, display_throughput
+from evaluation.streaming_indexer import StreamingIndexer, DEFAULT_CHUNK_SIZE
+from evaluation.stage_metrics import StageMetrics
 from shapely.geometry import Point
 
 RECALL_VALUES = [1, 5, 10, 20]
@@ -19,59 +30,308 @@ class Evaluator():
                     infer_batch_size    : int = 32, 
                     num_workers         : int = 8, 
                     device              : str = "cuda", 
-                    fc_output_dim       : int = 2048
+                    fc_output_dim       : int = 2048,
+                    descriptor_store    : DescriptorStore = None,
+                    database_index      : Union[DatabaseIndex, PartitionedIndex] = None,
+                    result_cache        : ResultCache = None,
+                    model_key           : str = None,
+                    extraction_processes: int = 1,
+                    threads_per_process : int = None,
+                    chunk_size          : int = DEFAULT_CHUNK_SIZE,
+                    stream_index        : bool = False,
+                    background_extraction : bool = False,
+                    metrics             : StageMetrics = None
                 ):
         
-        self.model = model.eval()
+        # Per-stage latency histograms and counters, disabled by default, see StageMetrics
+        self.metrics = metrics if metrics is not None else StageMetrics(enabled=False)
+        # result_cache is invalidated when model_key (by default the identity of model) or the index version changes
+        self.result_cache = result_cache
+        self.model_key = model_key if model_key is not None else str(id(model))
+        # Batches of DatabaseLoaderUInt8 are normalized on the device, once per batch
+        self.model = UInt8Normalization(model).eval()
         self.eval_ds = eval_ds
         self.device = device
-        database_descriptors = self.__load_database_descriptors(num_workers, infer_batch_size, fc_output_dim)
-        self.faiss_index = faiss.IndexFlatL2(fc_output_dim)
-        self.faiss_index.add(database_descriptors)
-        del database_descriptors
-        self.eval_ds.__class__ = DatabaseLoaderPaths
+        self.num_workers = num_workers
+        self.infer_batch_size = infer_batch_size
+        self.database_index = database_index if database_index is not None else DatabaseIndex(fc_output_dim)
+        # With extraction_processes > 1 the database is embedded by several CPU processes, see ParallelExtractor
+        self.parallel_extractor = None
+        if ( extraction_processes > 1 ):
+            if ( device != "cpu" ):
+                raise ValueError(f"extraction_processes : {extraction_processes} needs the cpu device, not {device}")
+            self.parallel_extractor = ParallelExtractor(self.model, extraction_processes, threads_per_process, infer_batch_size)
+        # Set once the database is extracted and indexed, see wait_for_extraction
+        self.extraction_done = threading.Event()
+        self.extraction_error = None
+        self.__extraction_thread = None
+        if ( eval_ds is None ):
+            # database_index is already filled, e.g. loaded with DatabaseIndex.load and shared between workers
+            if ( database_index is None or len(database_index) == 0 ):
+                raise ValueError("Evaluator without eval_ds needs a filled database_index")
+            self.extraction_done.set()
+            return
+        if ( background_extraction and not stream_index ):
+            raise ValueError("background_extraction needs stream_index, otherwise the index is only filled once the extraction is over")
+        database_args = (num_workers, infer_batch_size, fc_output_dim, descriptor_store, chunk_size, stream_index)
+        if ( background_extraction ):
+            # The constructor returns at once, queries search the chunks already indexed while the extraction goes on
+            self.__extraction_thread = threading.Thread(target=self.__build_database_in_background, args=database_args, name="Evaluator-extraction", daemon=True)
+            self.__extraction_thread.start()
+            return
+        self.__build_database(*database_args)
+        self.extraction_done.set()
+    
+    def __build_database_in_background(self, *database_args):
+        try:
+            self.__build_database(*database_args)
+        except BaseException as error:
+            self.extraction_error = error
+        finally:
+            self.extraction_done.set()
+    
+    def wait_for_extraction(self, timeout : float = None) -> bool:
+        """Wait for the database extraction, False if it is still running after timeout seconds, raise if it failed."""
+        is_done = self.extraction_done.wait(timeout)
+        if ( self.extraction_error is not None ):
+            raise RuntimeError("Database extraction failed") from self.extraction_error
+        return is_done
+    
+    def __build_database(self, num_workers : int, infer_batch_size : int, fc_output_dim : int, descriptor_store : DescriptorStore, chunk_size : int, stream_index : bool):
+        staging_folder = None if descriptor_store is not None else Path(tempfile.mkdtemp(prefix="database_descriptors_"))
+        # Every chunk_size extracted descriptors are checkpointed in descriptor_store and, with stream_index, added to the index
+        database_descriptors = self.__load_database_descriptors(num_workers, infer_batch_size, fc_output_dim, descriptor_store, staging_folder, chunk_size, stream_index)
+        if ( not stream_index ):
+            # The index is filled shard by shard from the memory-mapped descriptors, never from a full in-memory copy
+            with self.metrics.stage("database_indexing"):
+                self.database_index.train(database_descriptors)
+                for start, shard in database_descriptors.iter_shards():
+                    coordinates = None
+                    if ( getattr(self.eval_ds, "coordinates", None) is not None ):
+                        coordinates = tuple(column[start:start + len(shard)] for column in self.eval_ds.coordinates)
+                    self.database_index.add(self.eval_ds.database_paths[start:start + len(shard)], shard, coordinates)
+        database_descriptors.close()
+        if ( staging_folder is not None ):
+            shutil.rmtree(staging_folder, ignore_errors=True)
         
-    def __load_database_descriptors(self, num_workers : int, infer_batch_size : int, fc_output_dim : int):
+    def __extract_descriptors(self, dataset : DatabaseLoaderPIL, indices_to_extract : List[int], output_descriptors : np.ndarray, num_workers : int, infer_batch_size : int, desc : str,
+                              on_chunk : Callable[[np.ndarray], None] = None, chunk_size : int = DEFAULT_CHUNK_SIZE):
+        written_rows = []
         with torch.no_grad():
-            database_dataloader = DataLoader(dataset=self.eval_ds, num_workers=num_workers,
-                                            batch_size=infer_batch_size, pin_memory=(self.device == "cuda"))
-            database_descriptors = np.empty((len(self.eval_ds), fc_output_dim), dtype="float32")
-            for images, indices in tqdm(database_dataloader, ncols=100, desc="Extracting database descriptors", total=len(database_dataloader), miniters=1, unit="descriptor"):
-                descriptors = self.model(images.to(self.device))
-                descriptors = descriptors.cpu().numpy()
-                database_descriptors[indices.numpy(), :] = descriptors
+            dataloader = DataLoader(dataset=Subset(dataset, indices_to_extract), num_workers=num_workers,
+                                    batch_size=infer_batch_size, pin_memory=(self.device == "cuda"))
+            batch_start = time.perf_counter()
+            for images, indices in tqdm(dataloader, ncols=100, desc=desc, total=len(dataloader), miniters=1, unit="descriptor"):
+                # Time spent waiting for the DataLoader to decode the batch
+                self.metrics.observe("database_decode", time.perf_counter() - batch_start)
+                with self.metrics.stage("database_forward"):
+                    descriptors = self.model(images.to(self.device))
+                    descriptors = descriptors.cpu().numpy()
+                output_descriptors[indices.numpy()] = descriptors
+                self.metrics.count("database_images_extracted", len(indices))
+                written_rows.extend(indices.tolist())
+                if ( on_chunk is not None and len(written_rows) >= chunk_size ):
+                    on_chunk(np.array(written_rows, dtype=np.int64))
+                    written_rows = []
+                batch_start = time.perf_counter()
+        if ( on_chunk is not None and len(written_rows) > 0 ):
+            on_chunk(np.array(written_rows, dtype=np.int64))
+        
+    def __load_database_descriptors(self, num_workers : int, infer_batch_size : int, fc_output_dim : int, descriptor_store : DescriptorStore = None, staging_folder : Path = None,
+                                    chunk_size : int = DEFAULT_CHUNK_SIZE, stream_index : bool = False) -> ShardedDescriptors:
+        if ( descriptor_store is None ):
+            database_descriptors = ShardedDescriptors.create(staging_folder, len(self.eval_ds), fc_output_dim)
+            is_valid = np.zeros(len(self.eval_ds), dtype=bool)
+        else:
+            with self.metrics.stage("database_lookup"):
+                database_descriptors, is_valid = descriptor_store.lookup(self.eval_ds.database_paths)
+            self.metrics.count("database_images_reused", int(is_valid.sum()))
+            print(f"Reusing {int(is_valid.sum())} descriptors from {descriptor_store}, {int((~is_valid).sum())} to extract")
+        indices_to_extract = np.flatnonzero(~is_valid).tolist()
+        streaming_indexer = None
+        if ( stream_index ):
+            streaming_indexer = StreamingIndexer(self.database_index, self.eval_ds.database_paths, database_descriptors, getattr(self.eval_ds, "coordinates", None), chunk_size)
+            streaming_indexer.completed(np.flatnonzero(is_valid))
+
+        def on_chunk(rows : np.ndarray):
+            if ( descriptor_store is not None ):
+                descriptor_store.checkpoint(database_descriptors, rows)
+            if ( streaming_indexer is not None ):
+                streaming_indexer.completed(rows)
+
+        with self.metrics.stage("database_extraction"):
+            if ( len(indices_to_extract) > 0 and self.parallel_extractor is not None ):
+                print(f"Extracting with {self.parallel_extractor}")
+                display_throughput(self.parallel_extractor.extract(self.eval_ds, indices_to_extract, database_descriptors, "Extracting database descriptors", on_chunk, chunk_size))
+                self.metrics.count("database_images_extracted", len(indices_to_extract))
+            elif ( len(indices_to_extract) > 0 ):
+                self.__extract_descriptors(self.eval_ds, indices_to_extract, database_descriptors, num_workers, infer_batch_size, "Extracting database descriptors", on_chunk, chunk_size)
+        if ( streaming_indexer is not None ):
+            with self.metrics.stage("database_indexing"):
+                streaming_indexer.finish()
+        if ( descriptor_store is not None ):
+            with self.metrics.stage("database_store_save"):
+                database_descriptors = descriptor_store.save(self.eval_ds.database_paths, database_descriptors)
         return database_descriptors
         
+    def normalized_image(self, input_image : Union[Path, str, bytes], is_base64 : bool = False) -> torch.Tensor:
+        """Same as get_normalized_image, timing the base64 decode, the image decode and the normalization stages."""
+        image_bytes = None
+        if ( isinstance(input_image, (bytes, bytearray)) ):
+            image_bytes = input_image
+        elif ( is_base64 ):
+            with self.metrics.stage("base64_decode"):
+                image_bytes = base64.b64decode(input_image)
+        with self.metrics.stage("image_decode"):
+            pil_img = open_image_bytes(image_bytes) if image_bytes is not None else open_image_path(input_image)
+        with self.metrics.stage("normalize"):
+            return base_transform()(pil_img)
+
     def __input_image_descriptors(self, input_image : Path, is_base64 : bool):
-        normalized_img = get_normalized_image(input_image, is_base64).unsqueeze(0)
-        with torch.no_grad():
+        normalized_img = self.normalized_image(input_image, is_base64).unsqueeze(0)
+        with torch.no_grad(), self.metrics.stage("forward"):
             descriptors = self.model(normalized_img.to(self.device))
             descriptors = descriptors.cpu().numpy()
         return descriptors
     
-    def __geoloc_prediction(self, indexes : List[int] ) -> Dict[str, Point]:
+    def __geoloc_prediction(self, indexes : np.ndarray) -> Dict[str, np.ndarray]:
+        """Average coordinates of the neighbours, indexes has shape (#queries, recall)."""
+        utm, lonlat = self.database_index.coordinates_of(indexes)
         GPS_prediction = dict()
-        GPS_prediction["GPS_lonlat"] = list()
-        GPS_prediction["GPS_utm"] = list()
-        for index in indexes:
-            datas = read_datas(self.eval_ds[index][0])
-            GPS_prediction["GPS_lonlat"].append(Point(datas["GPS_longitude"], datas["GPS_latitude"]))
-            GPS_prediction["GPS_utm"].append(Point(datas["UTM_east"], datas["UTM_north"]))
-            
-        GPS_prediction["GPS_lonlat"] = Point(
-            sum(p.x for p in GPS_prediction["GPS_lonlat"]) / len(GPS_prediction["GPS_lonlat"]),
-            sum(p.y for p in GPS_prediction["GPS_lonlat"]) / len(GPS_prediction["GPS_lonlat"])
-        )
-        GPS_prediction["GPS_utm"] = Point(
-            sum(p.x for p in GPS_prediction["GPS_utm"]) / len(GPS_prediction["GPS_utm"]),
-            sum(p.y for p in GPS_prediction["GPS_utm"]) / len(GPS_prediction["GPS_utm"])
-        )
+        GPS_prediction["GPS_utm"] = np.nanmean(utm, axis=1)
+        GPS_prediction["GPS_lonlat"] = np.nanmean(lonlat, axis=1)
         return GPS_prediction
     
-    def evaluate(self, input_image : Path, is_base64 : bool = False) -> Dict[str, Point]:
+    def __search(self, descriptors : np.ndarray, recall : int, priors : List[GPSPrior] = None, headings : List[float] = None) -> np.ndarray:
+        """Ids of the recall nearest database images, only a PartitionedIndex restricts the search to the GPS priors and the headings."""
+        with self.metrics.stage("search"):
+            if ( ( priors is not None or headings is not None ) and isinstance(self.database_index, PartitionedIndex) ):
+                return self.database_index.search(descriptors, recall, priors, headings)[1]
+            return self.database_index.search(descriptors, recall)[1]
+    
+    def evaluate(self, input_image : Path, is_base64 : bool = False, prior : GPSPrior = None, heading : float = None) -> Dict[str, Point]:
+        """Predicted position of input_image.
+
+        prior is an optional (lon/lat Point, radius in meters) approximate position of the query, heading its optional compass direction in degrees.
+        """
+        start = time.perf_counter()
+        recall = RECALL_VALUES[0]
+        options = search_options(prior, heading)
+        digest, descriptors, prediction = None, None, None
+        if ( self.result_cache is not None ):
+            with self.metrics.stage("digest"):
+                digest = image_digest(input_image, is_base64)
+            self.__sync_cache()
+            descriptors, prediction = self.result_cache.get(digest, options)
+        if ( prediction is None ):
+            if ( descriptors is None ):
+                descriptors = self.__input_image_descriptors(input_image, is_base64)
+            index_prediction_matrix = self.__search(descriptors, recall, [prior] if prior is not None else None, [heading] if heading is not None else None)
+            with self.metrics.stage("metadata"):
+                prediction = {key : coordinates[0] for key, coordinates in self.__geoloc_prediction(index_prediction_matrix[:, :recall]).items()}
+            if ( self.result_cache is not None ):
+                self.result_cache.put(digest, options, descriptors, prediction)
+        self.metrics.count("queries")
+        self.metrics.observe("evaluate", time.perf_counter() - start)
+        return {key : Point(*coordinates) for key, coordinates in prediction.items()}
+    
+    def __sync_cache(self):
+        self.result_cache.sync(self.model_key, (id(self.database_index), self.database_index.version))
+    
+    def cached_prediction(self, input_image : Union[Path, str, bytes], is_base64 : bool = False) -> Tuple[str, Dict[str, np.ndarray]]:
+        """Digest of input_image and its prediction without search options if the result cache holds it, (None, None) without result cache."""
+        if ( self.result_cache is None ):
+            return None, None
+        digest = image_digest(input_image, is_base64)
+        self.__sync_cache()
+        return digest, self.result_cache.get(digest)[1]
+    
+    def cache_prediction(self, digest : str, prediction : Dict[str, np.ndarray]):
+        """Store the prediction of the image of digest (see cached_prediction), e.g. computed by evaluate_normalized."""
+        if ( self.result_cache is not None and digest is not None ):
+            self.result_cache.put(digest, prediction={key : np.asarray(coordinates) for key, coordinates in prediction.items()})
+    
+    def __forward(self, normalized_images : List[torch.Tensor], batch_size : int) -> np.ndarray:
+        """Descriptors of already normalized images, images of the same size are stacked in forward passes of batch_size."""
+        descriptors = np.empty((len(normalized_images), self.database_index.fc_output_dim), dtype="float32")
+        rows_of_shape = dict()
+        for row, normalized_img in enumerate(normalized_images):
+            rows_of_shape.setdefault(tuple(normalized_img.shape), []).append(row)
+        with torch.no_grad(), self.metrics.stage("forward"):
+            for rows in rows_of_shape.values():
+                for start in range(0, len(rows), batch_size):
+                    batch_rows = rows[start:start + batch_size]
+                    normalized_imgs = torch.stack([normalized_images[row] for row in batch_rows])
+                    descriptors[batch_rows] = self.model(normalized_imgs.to(self.device)).cpu().numpy()
+        return descriptors
+    
+    def __input_images_descriptors(self, input_images : List[Union[Path, str, bytes]], is_base64 : bool, batch_size : int, num_decode_workers : int) -> np.ndarray:
+        descriptors = np.empty((len(input_images), self.database_index.fc_output_dim), dtype="float32")
+        with ThreadPoolExecutor(max_workers=max(1, num_decode_workers)) as executor:
+            for start in range(0, len(input_images), batch_size):
+                batch = input_images[start:start + batch_size]
+                normalized_imgs = list(executor.map(lambda input_image : self.normalized_image(input_image, is_base64), batch))
+                descriptors[start:start + len(batch)] = self.__forward(normalized_imgs, batch_size)
+        return descriptors
+    
+    def evaluate_normalized(self, normalized_images : List[torch.Tensor], batch_size : int = None, priors : List[GPSPrior] = None, headings : List[float] = None) -> Dict[str, np.ndarray]:
+        """Evaluate images already decoded by get_normalized_image, with stacked forward passes and a single FAISS search.
+
+        priors and headings hold an optional GPS prior and heading per image, see evaluate.
+
+        Returns:
+            dict: "GPS_utm" and "GPS_lonlat" arrays of shape (len(normalized_images), 2).
+        """
         recall = RECALL_VALUES[0]
-        descriptors = self.__input_image_descriptors(input_image, is_base64)
-        _, index_prediction_matrix = self.faiss_index.search(descriptors, recall)
-        closest_geoloc = self.__geoloc_prediction(index_prediction_matrix[0][:recall])
-        return closest_geoloc
+        batch_size = batch_size if batch_size is not None else self.infer_batch_size
+        if ( len(normalized_images) == 0 ):
+            return {"GPS_utm" : np.empty((0, 2)), "GPS_lonlat" : np.empty((0, 2))}
+        descriptors = self.__forward(list(normalized_images), batch_size)
+        index_prediction_matrix = self.__search(descriptors, recall, priors, headings)
+        self.metrics.count("queries", len(normalized_images))
+        with self.metrics.stage("metadata"):
+            return self.__geoloc_prediction(index_prediction_matrix[:, :recall])
+    
+    def evaluate_batch(self, input_images : List[Union[Path, str, bytes]], is_base64 : bool = False, batch_size : int = None, num_decode_workers : int = None, priors : List[GPSPrior] = None, headings : List[float] = None) -> Dict[str, np.ndarray]:
+        """Evaluate many images with stacked forward passes and a single FAISS search.
+
+        Args:
+            input_images (list): paths, base64 strings (with is_base64) or raw image bytes.
+            batch_size (int): images per forward pass, if None use the infer_batch_size of the Evaluator.
+            num_decode_workers (int): threads decoding the images, if None use the num_workers of the Evaluator.
+            priors (list): optional GPS prior (or None) of each image, see evaluate.
+            headings (list): optional heading in degrees (or None) of each image.
+
+        Returns:
+            dict: "GPS_utm" and "GPS_lonlat" arrays of shape (len(input_images), 2).
+        """
+        recall = RECALL_VALUES[0]
+        batch_size = batch_size if batch_size is not None else self.infer_batch_size
+        num_decode_workers = num_decode_workers if num_decode_workers is not None else self.num_workers
+        if ( len(input_images) == 0 ):
+            return {"GPS_utm" : np.empty((0, 2)), "GPS_lonlat" : np.empty((0, 2))}
+        descriptors = self.__input_images_descriptors(list(input_images), is_base64, batch_size, num_decode_workers)
+        index_prediction_matrix = self.__search(descriptors, recall, priors, headings)
+        self.metrics.count("queries", len(input_images))
+        with self.metrics.stage("metadata"):
+            return self.__geoloc_prediction(index_prediction_matrix[:, :recall])
+    
+    def add_images(self, image_paths : List[Path]) -> int:
+        """Embed image_paths and add them to the database index, already indexed images are replaced."""
+        images_ds = ImageListLoaderPIL([Path(image_path) for image_path in image_paths])
+        descriptors = np.empty((len(images_ds), self.database_index.fc_output_dim), dtype="float32")
+        self.__extract_descriptors(images_ds, list(range(len(images_ds))), descriptors, min(self.num_workers, len(images_ds)), self.infer_batch_size, "Extracting new descriptors")
+        self.database_index.add(images_ds.database_paths, descriptors)
+        return len(images_ds)
+    
+    def remove_images(self, image_paths : List[Union[Path, str]]) -> int:
+        """Tombstone image_paths, they are compacted out of the database index in the background.
+
+        Nothing is removed and ValueError is raised if one of image_paths is not in the database index.
+        """
+        image_paths = [Path(image_path) for image_path in image_paths]
+        unknown_paths = [image_path for image_path in image_paths if image_path not in self.database_index]
+        if ( len(unknown_paths) > 0 ):
+            raise ValueError(f"{len(unknown_paths)} images are not in the database index, e.g. {unknown_paths[0]}")
+        return self.database_index.remove(image_paths)
         
\ No newline at end of file
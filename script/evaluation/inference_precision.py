@@ -0,0 +1,89 @@
+import copy
+import time
+import torch
+import warnings
+from typing import Dict
+from evaluation.model_options import INFERENCE_PRECISIONS
+
+class AutocastModel(torch.nn.Module):
+    def __init__(self, model : torch.nn.Module, device : str = "cpu", dtype : torch.dtype = torch.bfloat16):
+        """Run model under autocast, descriptors are returned as float32."""
+        super().__init__()
+        self.model = model
+        self.device_type = "cuda" if str(device).startswith("cuda") else "cpu"
+        self.dtype = dtype
+    
+    def forward(self, images : torch.Tensor) -> torch.Tensor:
+        with torch.autocast(device_type=self.device_type, dtype=self.dtype):
+            descriptors = self.model(images)
+        return descriptors.float()
+
+
+def quantize_backbone_int8(model : torch.nn.Module, calibration_images : torch.Tensor, batch_size : int = 16) -> torch.nn.Module:
+    """Copy of model with a post-training static int8 backbone (FX graph mode), calibrated on calibration_images.
+
+    Only the convolutional backbone is quantized, the GeM/L2Norm aggregation and the fc layer stay in float32
+    because the GeM power is sensitive to the quantization error. int8 kernels run on CPU only.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    quantized_model = copy.deepcopy(model).cpu().eval()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        prepared_backbone = prepare_fx(quantized_model.backbone, get_default_qconfig_mapping(torch.backends.quantized.engine), (calibration_images[:1],))
+        with torch.no_grad():
+            for start in range(0, len(calibration_images), batch_size):
+                prepared_backbone(calibration_images[start:start + batch_size])
+        quantized_model.backbone = convert_fx(prepared_backbone)
+    return quantized_model
+
+def precision_model(model : torch.nn.Module, precision : str, device : str = "cpu", calibration_images : torch.Tensor = None) -> torch.nn.Module:
+    """model run with the inference precision, calibration_images are needed by int8."""
+    if ( precision not in INFERENCE_PRECISIONS ):
+        raise ValueError(f"Inference precision : {precision} is not one of {INFERENCE_PRECISIONS}")
+    if ( precision == "fp32" ):
+        return model
+    if ( precision == "bf16" ):
+        return AutocastModel(model, device, torch.bfloat16).eval()
+    if ( str(device) != "cpu" ):
+        raise ValueError("Inference precision : int8 is only supported with --device cpu")
+    if ( calibration_images is None or len(calibration_images) == 0 ):
+        raise ValueError("Inference precision : int8 needs calibration images")
+    if ( not isinstance(model, torch.nn.Module) or not hasattr(model, "backbone") ):
+        raise ValueError("Inference precision : int8 needs the eager GeoLocalizationNet, not an exported artifact")
+    return quantize_backbone_int8(model, calibration_images)
+
+def precision_report(reference_model : torch.nn.Module, model : torch.nn.Module, images : torch.Tensor, batch_size : int = 16, device : str = "cpu") -> Dict[str, float]:
+    """Drift of the descriptors of model against reference_model (fp32) on images.
+
+    Returns the mean and minimum cosine similarity of the descriptors, the top-1 retrieval agreement
+    (each image queries the other images, same nearest neighbour with both models) and the images per second.
+    """
+    descriptors = dict()
+    seconds = 0
+    for name, current_model in [("reference", reference_model), ("model", model)]:
+        outputs = []
+        with torch.no_grad():
+            current_model(images[:1].to(device))
+            start = time.perf_counter()
+            for batch_start in range(0, len(images), batch_size):
+                outputs.append(current_model(images[batch_start:batch_start + batch_size].to(device)).float().cpu())
+            seconds = time.perf_counter() - start
+        descriptors[name] = torch.cat(outputs)
+    cosine = torch.nn.functional.cosine_similarity(descriptors["reference"], descriptors["model"])
+    top1 = dict()
+    for name, current_descriptors in descriptors.items():
+        similarities = current_descriptors @ current_descriptors.T
+        similarities.fill_diagonal_(-float("inf"))
+        top1[name] = similarities.argmax(dim=1)
+    return {
+        "cosine_mean" : float(cosine.mean()),
+        "cosine_min" : float(cosine.min()),
+        "top1_agreement" : float((top1["reference"] == top1["model"]).float().mean()),
+        "images_per_s" : len(images) / seconds,
+    }
+
+def display_precision_reports(reports : Dict[str, Dict[str, float]]):
+    print(f"{'precision':<10}{'cosine mean':>13}{'cosine min':>12}{'top-1 agreement':>17}{'images/s':>10}")
+    for precision, report in reports.items():
+        print(f"{precision:<10}{report['cosine_mean']:>13.5f}{report['cosine_min']:>12.5f}{report['top1_agreement']:>17.3f}{report['images_per_s']:>10.2f}")
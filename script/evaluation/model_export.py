@@ -0,0 +1,134 @@
+import time
+import torch
+import warnings
+import numpy as np
+from pathlib import Path
+from typing import Dict, List
+from evaluation.utils import get_normalized_image
+from evaluation.model_options import MODEL_BACKENDS, ARTIFACT_SUFFIXES
+
+def sample_paths(image_paths : List[Path], number_of_images : int, seed : int = 0) -> List[Path]:
+    """Random distinct paths of image_paths."""
+    rows = np.random.default_rng(seed).permutation(len(image_paths))[:number_of_images]
+    return [image_paths[row] for row in rows]
+
+def sample_images(image_paths : List[Path], number_of_images : int, seed : int = 0) -> torch.Tensor:
+    """Random normalized images of image_paths stacked in one tensor, images of another size than the first one are skipped."""
+    if ( len(image_paths) == 0 ):
+        raise ValueError("No image to sample")
+    normalized_imgs = [get_normalized_image(image_path) for image_path in sample_paths(image_paths, number_of_images, seed)]
+    return torch.stack([normalized_img for normalized_img in normalized_imgs if normalized_img.shape == normalized_imgs[0].shape])
+
+def export_torchscript(model : torch.nn.Module, artifact_path : Path, example_images : torch.Tensor) -> Path:
+    """Trace the whole model (backbone, GeM and L2Norm aggregation) and freeze it, the traced sizes stay dynamic."""
+    with torch.no_grad(), warnings.catch_warnings():
+        # Flatten asserts on the pooled shape, which is always 1x1 after GeM
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        traced_model = torch.jit.trace(model.eval(), example_images, check_trace=False)
+    frozen_model = torch.jit.freeze(traced_model)
+    frozen_model.save(str(artifact_path))
+    return artifact_path
+
+def export_onnx(model : torch.nn.Module, artifact_path : Path, example_images : torch.Tensor) -> Path:
+    """Export the whole model to ONNX with dynamic batch, height and width."""
+    with torch.no_grad():
+        torch.onnx.export(model.eval(), example_images, str(artifact_path),
+                          input_names=["images"],
+                          output_names=["descriptors"],
+                          dynamic_axes={"images" : {0 : "batch", 2 : "height", 3 : "width"}, "descriptors" : {0 : "batch"}},
+                          opset_version=17,
+                          dynamo=False)
+    return artifact_path
+
+def export_model(model : torch.nn.Module, backend : str, output_folder : Path, example_images : torch.Tensor, name : str = "model") -> Path:
+    if ( backend not in ARTIFACT_SUFFIXES ):
+        raise ValueError(f"Model backend : {backend} cannot be exported, use one of {list(ARTIFACT_SUFFIXES.keys())}")
+    output_folder.mkdir(parents=True, exist_ok=True)
+    artifact_path = output_folder.joinpath(f"{name}{ARTIFACT_SUFFIXES[backend]}")
+    model = model.cpu()
+    example_images = example_images.cpu()
+    if ( backend == "torchscript" ):
+        return export_torchscript(model, artifact_path, example_images)
+    return export_onnx(model, artifact_path, example_images)
+
+
+class OnnxModel(torch.nn.Module):
+    def __init__(self, artifact_path : Path, device : str = "cpu"):
+        """ONNX Runtime session behaving like the eager model: images tensor in, descriptors tensor out.
+
+        The session cannot be pickled, an unpickled OnnxModel (e.g. in a ParallelExtractor process) opens artifact_path again.
+        """
+        super().__init__()
+        self.artifact_path = artifact_path
+        self.providers = ["CUDAExecutionProvider", "CPUExecutionProvider"] if device == "cuda" else ["CPUExecutionProvider"]
+        self.__open_session()
+
+    def __open_session(self):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx model backend needs onnxruntime, pip install onnxruntime")
+        self.__session = onnxruntime.InferenceSession(str(self.artifact_path), providers=self.providers)
+        self.__input_name = self.__session.get_inputs()[0].name
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_OnnxModel__session"], state["_OnnxModel__input_name"]
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.__open_session()
+    
+    def forward(self, images : torch.Tensor) -> torch.Tensor:
+        images = images.detach().cpu().numpy().astype(np.float32, copy=False)
+        descriptors = self.__session.run(None, {self.__input_name : images})[0]
+        return torch.from_numpy(descriptors)
+    
+    def __repr__(self):
+        return f"< OnnxModel - {self.artifact_path} >"
+
+
+def load_model_backend(backend : str, artifact_path : Path, device : str = "cpu") -> torch.nn.Module:
+    if ( backend not in ARTIFACT_SUFFIXES ):
+        raise ValueError(f"Model backend : {backend} has no artifact, use one of {list(ARTIFACT_SUFFIXES.keys())}")
+    if ( artifact_path is None or not artifact_path.exists() ):
+        raise FileNotFoundError(f"Model artifact : {artifact_path} does not exists, see main_model_export.py")
+    if ( backend == "torchscript" ):
+        return torch.jit.load(str(artifact_path), map_location=device).eval()
+    return OnnxModel(artifact_path, device)
+
+def descriptors_difference(reference_model : torch.nn.Module, model : torch.nn.Module, images : torch.Tensor, device : str = "cpu") -> float:
+    """Largest absolute difference between the descriptors of the two models on images."""
+    with torch.no_grad():
+        reference = reference_model(images.to(device)).cpu()
+        descriptors = model(images.to(device)).cpu()
+    return float((reference - descriptors).abs().max())
+
+def check_model_backend(reference_model : torch.nn.Module, model : torch.nn.Module, images : torch.Tensor, tolerance : float = 1e-4, device : str = "cpu") -> float:
+    """Raise a ValueError if model does not reproduce the descriptors of reference_model within tolerance."""
+    difference = descriptors_difference(reference_model, model, images, device)
+    if ( difference > tolerance ):
+        raise ValueError(f"Model backend : descriptors differ from the eager model by {difference:.2e} > tolerance {tolerance:.2e}")
+    return difference
+
+def benchmark_models(models : Dict[str, torch.nn.Module], images : torch.Tensor, batch_size : int = 16, runs : int = 3, device : str = "cpu") -> List[Dict[str, float]]:
+    """Images per second of each model, after one warm-up batch."""
+    results = []
+    batches = [images[start:start + batch_size].to(device) for start in range(0, len(images), batch_size)]
+    for name, model in models.items():
+        with torch.no_grad():
+            model(batches[0])
+            start = time.perf_counter()
+            for _ in range(runs):
+                for batch in batches:
+                    model(batch)
+            seconds = time.perf_counter() - start
+        results.append({"backend" : name, "images_per_s" : runs * len(images) / seconds})
+    return results
+
+def display_benchmark(results : List[Dict[str, float]]):
+    reference = results[0]["images_per_s"]
+    print(f"{'backend':<14}{'images/s':>10}{'speedup':>10}")
+    for result in results:
+        print(f"{result['backend']:<14}{result['images_per_s']:>10.2f}{result['images_per_s'] / reference:>9.2f}x")
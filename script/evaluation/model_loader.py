@@ -0,0 +1,121 @@
+import torch
+from pathlib import Path
+from typing import Dict, List
+from evaluation.CosPlace_src import network
+from evaluation.model_registry import ModelRegistry
+from evaluation.database_loader import DatabaseLoaderPIL, DatabaseLoaderUInt8, DatabaseLoaderDecodedCache
+from evaluation.evaluator import Evaluator
+from evaluation.descriptor_store import DescriptorStore, model_fingerprint
+from evaluation.result_cache import ResultCache
+from evaluation.stage_metrics import StageMetrics
+from evaluation.database_index import database_index_from_args
+from evaluation.partitioned_index import partitioned_index_from_args
+from evaluation.model_export import load_model_backend, check_model_backend, sample_images, sample_paths
+from evaluation.inference_precision import precision_model, precision_report
+
+def load_model(args : Dict[str, any], strict : bool = True) -> torch.nn.Module:
+    """CosPlace model of the --model_registry (downloaded from the hub once if missing, unless --offline),
+    or GeoLocalizationNet with the weights of --resume_model, moved to --device."""
+    if ( args['resume_model'] == None ):
+        registry = ModelRegistry(args["model_registry"])
+        if ( (args["backbone"], args["fc_output_dim"]) not in registry ):
+            if ( args["offline"] ):
+                raise FileNotFoundError(f"Model registry : {args['model_registry']} has no {args['backbone']} -- {args['fc_output_dim']} model and --offline is set, see main_model_registry.py")
+            registry.fetch(args["backbone"], args["fc_output_dim"])
+        print(f"Using registry model : {args['backbone']} -- {args['fc_output_dim']}{' -- fp16 weights' if args['registry_fp16'] else ''}")
+        model = registry.load_model(args["backbone"], args["fc_output_dim"], args["device"], half=args["registry_fp16"])
+    else:
+        print(f"Using local model : {args['resume_model']} -- {args['backbone']} -- {args['fc_output_dim']}")
+        # With strict every weight comes from --resume_model, the ImageNet weights are not downloaded
+        model = network.GeoLocalizationNet(args["backbone"], args["fc_output_dim"], pretrained=not strict)
+        model_state_dict = torch.load(args["resume_model"], map_location=str(args["device"]))
+        model.load_state_dict(model_state_dict, strict=strict)
+    model = model.to(args["device"])
+    print("Model is loaded")
+    return model
+
+def calibration_paths_from_args(args : Dict[str, any], image_paths : List[Path]) -> List[Path]:
+    """The --calibration_images images of image_paths int8 is calibrated on, none for the other precisions."""
+    if ( args["inference_precision"] != "int8" ):
+        return []
+    if ( image_paths is None or len(image_paths) == 0 ):
+        raise ValueError("Inference precision : int8 needs database images to calibrate")
+    return sample_paths(image_paths, args["calibration_images"])
+
+def apply_inference_precision(args : Dict[str, any], model : torch.nn.Module, image_paths : List[Path] = None, report : bool = True, calibration_paths : List[Path] = None) -> torch.nn.Module:
+    """model run with --inference_precision, int8 is calibrated on calibration_paths (default: --calibration_images images of image_paths)."""
+    if ( args["inference_precision"] == "fp32" ):
+        return model
+    print(f"Using {args['inference_precision']} inference precision")
+    if ( calibration_paths is None ):
+        calibration_paths = calibration_paths_from_args(args, image_paths)
+    calibration_images = None
+    if ( args["inference_precision"] == "int8" ):
+        if ( len(calibration_paths) == 0 ):
+            raise ValueError("Inference precision : int8 needs database images to calibrate")
+        calibration_images = sample_images(calibration_paths, len(calibration_paths))
+    inference_model = precision_model(model.eval(), args["inference_precision"], args["device"], calibration_images)
+    # The report is measured on images held out of the calibration sample
+    calibration_set = set(calibration_paths)
+    held_out_paths = [image_path for image_path in image_paths if image_path not in calibration_set] if image_paths is not None else []
+    if ( report and len(held_out_paths) > 1 ):
+        report = precision_report(model, inference_model, sample_images(held_out_paths, 32, seed=1), args["infer_batch_size"], args["device"])
+        print(f"Descriptors drift against fp32 : cosine mean {report['cosine_mean']:.5f}, min {report['cosine_min']:.5f}, top-1 agreement {report['top1_agreement']:.3f}")
+    return inference_model
+
+def load_inference_model(args : Dict[str, any], model : torch.nn.Module, image_paths : List[Path] = None) -> torch.nn.Module:
+    """The eager model, or the --model_artifact of --model_backend checked against it on a sample of image_paths,
+    run with --inference_precision."""
+    if ( args["model_backend"] == "eager" ):
+        return apply_inference_precision(args, model, image_paths)
+    print(f"Using {args['model_backend']} model backend : {args['model_artifact']}")
+    inference_model = load_model_backend(args["model_backend"], args["model_artifact"], args["device"])
+    if ( image_paths is not None and len(image_paths) > 0 ):
+        difference = check_model_backend(model.eval(), inference_model, sample_images(image_paths, 4), args["backend_tolerance"], args["device"])
+        print(f"Model backend matches the eager model, max descriptor difference : {difference:.2e}")
+    return apply_inference_precision(args, inference_model, image_paths)
+
+def database_loader_from_args(args : Dict[str, any]) -> DatabaseLoaderPIL:
+    use_catalog = not args["no_catalog"]
+    if ( args["loader_mode"] == "uint8" ):
+        return DatabaseLoaderUInt8(args["input_database_folder"], use_catalog=use_catalog)
+    if ( args["loader_mode"] == "cached" ):
+        return DatabaseLoaderDecodedCache(args["input_database_folder"], args["decoded_cache"], args["num_workers"], use_catalog=use_catalog)
+    return DatabaseLoaderPIL(args["input_database_folder"], use_catalog=use_catalog)
+
+def result_cache_from_args(args : Dict[str, any]) -> ResultCache:
+    if ( args["result_cache_size"] <= 0 ):
+        return None
+    return ResultCache(args["result_cache_size"], args["result_cache_ttl"])
+
+def stage_metrics_from_args(args : Dict[str, any]) -> StageMetrics:
+    return StageMetrics(enabled=args["stage_metrics"])
+
+def evaluator_from_args(args : Dict[str, any], model : torch.nn.Module) -> Evaluator:
+    """Evaluator over --input_database_folder with the descriptor store and the database index of the arguments."""
+    print(f"Creating Dataset from database folder : {args['input_database_folder']}")
+    database = database_loader_from_args(args)
+    model_key = None
+    if ( not args["no_descriptors_store"] or args["result_cache_size"] > 0 ):
+        model_key = model_fingerprint(model, args["backbone"], args["fc_output_dim"], args["model_backend"], args["inference_precision"])
+    descriptor_store = None
+    if ( not args["no_descriptors_store"] ):
+        descriptor_store = DescriptorStore(args["input_database_folder"], model_key, args["fc_output_dim"], args["descriptors_store"])
+    inference_model = load_inference_model(args, model, database.database_paths)
+    print(f"Creating Evaluator from previous Dataset")
+    return Evaluator(database, inference_model,
+                     num_workers=args['num_workers'],
+                     infer_batch_size=args['infer_batch_size'],
+                     device=args['device'],
+                     fc_output_dim=args['fc_output_dim'],
+                     descriptor_store=descriptor_store,
+                     database_index=database_index_from_args(args) if args["partition_polygon"] is None and args["heading_sectors"] == 1 else partitioned_index_from_args(args),
+                     result_cache=result_cache_from_args(args),
+                     model_key=model_key,
+                     extraction_processes=args["extraction_processes"],
+                     threads_per_process=args["threads_per_process"],
+                     chunk_size=args["chunk_size"],
+                     stream_index=args["stream_index"],
+                     background_extraction=args["background_extraction"],
+                     metrics=stage_metrics_from_args(args)
+                     )
@@ -0,0 +1,4 @@
+# Choices of the model arguments, kept apart from torch so that the argument parsers import at once
+MODEL_BACKENDS = ["eager", "torchscript", "onnx"]
+ARTIFACT_SUFFIXES = {"torchscript" : ".pt", "onnx" : ".onnx"}
+INFERENCE_PRECISIONS = ["fp32", "bf16", "int8"]
@@ -0,0 +1,79 @@
+import torch
+from pathlib import Path
+from typing import Dict, List, Tuple
+from evaluation.CosPlace_src import network
+
+DEFAULT_REGISTRY_FOLDER = Path("./models/registry")
+HUB_REPOSITORY = "gmberton/cosplace"
+
+class ModelRegistry():
+    def __init__(self, registry_folder : Path = DEFAULT_REGISTRY_FOLDER):
+        """Local store of GeoLocalizationNet weights, one entry per (backbone, fc_output_dim).
+
+        Each entry is written once, by fetch from the torch hub or by register from a state dict,
+        as <backbone>_<fc_output_dim>.pth (float32) and <backbone>_<fc_output_dim>.fp16.pth (float16).
+        load_model then memory-maps the weights of the entry, no network access is needed anymore.
+        """
+        self.registry_folder = registry_folder
+
+    def path(self, backbone : str, fc_output_dim : int, half : bool = False) -> Path:
+        suffix = ".fp16.pth" if half else ".pth"
+        return self.registry_folder.joinpath(f"{backbone}_{fc_output_dim}{suffix}")
+
+    def __contains__(self, key : Tuple[str, int]):
+        backbone, fc_output_dim = key
+        return self.path(backbone, fc_output_dim).exists() and self.path(backbone, fc_output_dim, half=True).exists()
+
+    def entries(self) -> List[Tuple[str, int]]:
+        keys = []
+        for weights_path in sorted(self.registry_folder.glob("*.pth")):
+            if ( weights_path.name.endswith(".fp16.pth") ):
+                continue
+            backbone, fc_output_dim = weights_path.stem.rsplit("_", 1)
+            keys.append((backbone, int(fc_output_dim)))
+        return keys
+
+    def register(self, backbone : str, fc_output_dim : int, state_dict : Dict[str, torch.Tensor]) -> Path:
+        """Write the float32 and float16 copies of state_dict, each one aside and then renamed, so a reader never sees a partial file."""
+        self.registry_folder.mkdir(parents=True, exist_ok=True)
+        state_dict = {name : tensor.detach().cpu().contiguous() for name, tensor in state_dict.items()}
+        half_state_dict = {name : tensor.half() if tensor.is_floating_point() else tensor for name, tensor in state_dict.items()}
+        for half, tensors in [(False, state_dict), (True, half_state_dict)]:
+            weights_path = self.path(backbone, fc_output_dim, half)
+            staging_path = weights_path.with_name(f"{weights_path.name}.staging")
+            torch.save(tensors, staging_path)
+            staging_path.replace(weights_path)
+        return self.path(backbone, fc_output_dim)
+
+    def fetch(self, backbone : str, fc_output_dim : int) -> Path:
+        """Download the trained CosPlace model from the torch hub, once, and register its weights."""
+        print(f"Using hub to download model : {backbone} -- {fc_output_dim}")
+        model = torch.hub.load(HUB_REPOSITORY, "get_trained_model", backbone=backbone, fc_output_dim=fc_output_dim, trust_repo=True)
+        return self.register(backbone, fc_output_dim, model.state_dict())
+
+    def load_state_dict(self, backbone : str, fc_output_dim : int, half : bool = False) -> Dict[str, torch.Tensor]:
+        """Memory-mapped state dict of the entry, with half the float16 copy cast back to float32."""
+        weights_path = self.path(backbone, fc_output_dim, half)
+        if ( not weights_path.exists() ):
+            raise FileNotFoundError(f"Model registry : {weights_path} does not exist, see main_model_registry.py")
+        state_dict = torch.load(weights_path, map_location="cpu", mmap=True, weights_only=True)
+        if ( half ):
+            state_dict = {name : tensor.float() if tensor.is_floating_point() else tensor for name, tensor in state_dict.items()}
+        return state_dict
+
+    def load_model(self, backbone : str, fc_output_dim : int, device : str = "cpu", half : bool = False) -> torch.nn.Module:
+        """GeoLocalizationNet with the weights of the entry, moved to device.
+
+        The model is built on the meta device and the tensors of the state dict become its parameters (assign),
+        so nothing is initialized, and on cpu the float32 weights stay memory-mapped: the processes loading
+        the same entry share its pages. With half the file read is half the size, the descriptors then differ
+        from the float32 ones by the rounding of the weights.
+        """
+        state_dict = self.load_state_dict(backbone, fc_output_dim, half)
+        with torch.device("meta"):
+            model = network.GeoLocalizationNet(backbone, fc_output_dim, pretrained=False)
+        model.load_state_dict(state_dict, assign=True)
+        return model.to(device)
+
+    def __repr__(self):
+        return f"< ModelRegistry - {self.registry_folder} - #entries: {len(self.entries())} >"
@@ -0,0 +1,115 @@
+import io
+import os
+import time
+import queue
+import torch
+import numpy as np
+import torch.multiprocessing as multiprocessing
+from tqdm import tqdm
+from multiprocessing.reduction import ForkingPickler
+from pathlib import Path
+from typing import Callable, Dict, List
+from torch.utils.data import DataLoader, Dataset, Subset
+from evaluation.descriptor_store import ShardedDescriptors
+
+def load_script_module(archive : bytes) -> torch.jit.ScriptModule:
+    return torch.jit.load(io.BytesIO(archive))
+
+def reduce_script_module(module : torch.jit.ScriptModule):
+    # TorchScript modules cannot be pickled, they are sent to the spawned processes as their serialized archive
+    archive = io.BytesIO()
+    torch.jit.save(module, archive)
+    return load_script_module, (archive.getvalue(),)
+
+ForkingPickler.register(torch.jit.RecursiveScriptModule, reduce_script_module)
+
+def extraction_worker(rank : int, dataset : Dataset, indices : List[int], model : torch.nn.Module, shard_paths : List[Path], shard_size : int, fc_output_dim : int,
+                      batch_size : int, torch_threads : int, progress_queue : multiprocessing.Queue):
+    """Entry point of an extraction process: decode and embed indices of dataset, write the rows of the shared shards."""
+    torch.set_num_threads(torch_threads)
+    descriptors = ShardedDescriptors([np.load(shard_path, mmap_mode='r+') for shard_path in shard_paths], shard_size, fc_output_dim)
+    start = time.perf_counter()
+    with torch.no_grad():
+        # Images are decoded in this process, each process is a full decode + forward pipeline
+        dataloader = DataLoader(dataset=Subset(dataset, indices), num_workers=0, batch_size=batch_size)
+        for images, rows in dataloader:
+            descriptors[rows.numpy()] = model(images).numpy()
+            progress_queue.put((rank, rows.tolist(), None))
+    descriptors.flush()
+    progress_queue.put((rank, [], time.perf_counter() - start))
+
+
+class ParallelExtractor():
+    def __init__(self, model : torch.nn.Module, number_of_processes : int, threads_per_process : int = None, batch_size : int = 16):
+        """Data-parallel descriptor extraction on CPU: the indices are split in contiguous ranges over number_of_processes processes.
+
+        Each process holds a replica of the model (its parameters are shared memory, not copied; a TorchScript module is sent
+        as its archive and an OnnxModel opens its artifact again), runs with threads_per_process
+        intra-op threads (by default the cores divided by the processes) and writes its descriptors straight into the shards
+        of the output ShardedDescriptors, which are memory-mapped by every process.
+        Processes are spawned, not forked, so they never inherit the threads of the parent.
+        """
+        self.model = model.eval()
+        self.number_of_processes = number_of_processes
+        self.threads_per_process = threads_per_process if threads_per_process is not None else max(1, (os.cpu_count() or 1) // number_of_processes)
+        self.batch_size = batch_size
+
+    def extract(self, dataset : Dataset, indices : List[int], output_descriptors : ShardedDescriptors, desc : str = "Extracting descriptors",
+                on_chunk : Callable[[np.ndarray], None] = None, chunk_size : int = 4096) -> List[Dict[str, float]]:
+        """Fill the rows indices of output_descriptors, return the images, seconds and images/s of each process.
+
+        on_chunk is called in this process with the rows written by the processes, by chunks of about chunk_size rows.
+        """
+        output_descriptors.flush()
+        shard_paths = [Path(shard.filename) for shard in output_descriptors.shards]
+        context = multiprocessing.get_context("spawn")
+        progress_queue = context.Queue()
+        processes = []
+        for rank, process_indices in enumerate(np.array_split(np.asarray(indices, dtype=np.int64), self.number_of_processes)):
+            if ( len(process_indices) == 0 ):
+                continue
+            process = context.Process(target=extraction_worker, name=f"extraction-worker-{rank}",
+                                      args=(rank, dataset, process_indices.tolist(), self.model, shard_paths, output_descriptors.shard_size, output_descriptors.fc_output_dim,
+                                            self.batch_size, self.threads_per_process, progress_queue))
+            process.start()
+            processes.append((rank, process))
+        statistics = {rank : {"rank" : rank, "images" : 0, "seconds" : None} for rank, _ in processes}
+        written_rows = []
+        with tqdm(total=len(indices), ncols=100, desc=desc, miniters=1, unit="descriptor") as progress_bar:
+            while ( any(statistic["seconds"] is None for statistic in statistics.values()) ):
+                try:
+                    rank, rows, seconds = progress_queue.get(timeout=1.0)
+                except queue.Empty:
+                    failed = [process.name for _, process in processes if process.exitcode not in (None, 0)]
+                    if ( len(failed) > 0 ):
+                        for _, process in processes:
+                            process.terminate()
+                        raise RuntimeError(f"Extraction processes {failed} stopped before the end")
+                    continue
+                statistics[rank]["images"] += len(rows)
+                if ( seconds is not None ):
+                    statistics[rank]["seconds"] = seconds
+                progress_bar.update(len(rows))
+                written_rows.extend(rows)
+                if ( on_chunk is not None and len(written_rows) >= chunk_size ):
+                    on_chunk(np.array(written_rows, dtype=np.int64))
+                    written_rows = []
+        for _, process in processes:
+            process.join()
+        if ( on_chunk is not None and len(written_rows) > 0 ):
+            on_chunk(np.array(written_rows, dtype=np.int64))
+        for statistic in statistics.values():
+            statistic["images_per_second"] = statistic["images"] / statistic["seconds"] if statistic["seconds"] > 0 else 0.0
+        return list(statistics.values())
+
+    def __repr__(self):
+        return f"< ParallelExtractor - {self.number_of_processes} processes - {self.threads_per_process} threads each >"
+
+
+def display_throughput(statistics : List[Dict[str, float]]):
+    print(f"{'process':<10}{'images':>10}{'seconds':>10}{'images/s':>10}")
+    for statistic in statistics:
+        print(f"{statistic['rank']:<10}{statistic['images']:>10}{statistic['seconds']:>10.2f}{statistic['images_per_second']:>10.1f}")
+    total_seconds = max(statistic["seconds"] for statistic in statistics)
+    total_images = sum(statistic["images"] for statistic in statistics)
+    print(f"{'total':<10}{total_images:>10}{total_seconds:>10.2f}{total_images / total_seconds if total_seconds > 0 else 0.0:>10.1f}")
@@ -0,0 +1,329 @@
+import json
+import utm
+import exifread
+import shutil
+import shapely
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Tuple
+from shapely.geometry import Point, Polygon, box
+from evaluation.database_index import DatabaseIndex, build_faiss_index, read_coordinates, index_params_from_args
+from util.polygon_manager import read_polygon_csv, list_to_polygon, section_polygon_grid
+from util.image_manager import extract_geo_datas, extract_heading_datas, read_datas
+
+PARTITIONS_FILE = "partitions.json"
+PARTITION_BITS = 40 # global id = partition slot in the high bits, id in the partition in the low bits
+LOCAL_ID_MASK = (1 << PARTITION_BITS) - 1
+
+GPSPrior = Tuple[Point, float] # approximate lon/lat of the query and radius in meters
+
+def prior_area(prior : GPSPrior) -> Polygon:
+    """UTM disk of a GPS prior."""
+    lonlat, radius = prior
+    east, north = utm.from_latlon(lonlat.y, lonlat.x)[:2]
+    return Point(east, north).buffer(radius)
+
+def exif_gps_prior(image_path : Path, radius : float) -> GPSPrior:
+    """GPS prior at the EXIF position of image_path, None when the image has no GPS tags."""
+    with open(image_path, 'rb') as img:
+        tags = exifread.process_file(img, details=False)
+    if ( "GPS GPSLatitude" not in tags or "GPS GPSLongitude" not in tags ):
+        return None
+    return extract_geo_datas(tags), radius
+
+def exif_heading(image_path : Path) -> int:
+    """Compass heading of the EXIF GPSImgDirection of image_path, None when the image has none."""
+    with open(image_path, 'rb') as img:
+        tags = exifread.process_file(img, details=False)
+    if ( "GPS GPSImgDirection" not in tags ):
+        return None
+    return extract_heading_datas(tags)
+
+def read_headings(image_paths : List[Path]) -> np.ndarray:
+    """GPS_heading of the processed image names, -1 for the images without heading."""
+    return np.array([read_datas(image_path)["GPS_heading"] for image_path in image_paths], dtype=np.int64)
+
+def partition_folder(index_folder : Path, slot : int) -> Path:
+    return index_folder.joinpath(f"partition_{slot:05d}")
+
+
+class PartitionedIndex():
+    def __init__(self, fc_output_dim : int, cells : List[Polygon], heading_sectors : int = 1, **index_params):
+        """DatabaseIndex split in one sub-index per UTM cell (see section_polygon_grid) and per heading sector.
+
+        The images outside every cell share a last cell. With heading_sectors > 1 each cell is split in heading_sectors
+        compass sectors centered on the north, plus one sector for the images without heading (GPS_heading -1).
+        A search with a GPS prior only visits the cells intersecting the prior disk, a search with a heading only visits
+        the sector of the heading, its two neighbours and the sector without heading. The results of the visited
+        sub-indexes are merged; without prior nor heading (or when they meet no indexed sub-index) every sub-index
+        is visited, so the flat results match the full index.
+        The sub-indexes are empty clones of one index trained on the whole database (see train), index_params are the
+        DatabaseIndex arguments, the exact descriptors of the re-ranking of each sub-index are kept in a temporary file.
+        Ids are global: the slot of the sub-index (cell * sectors per cell + sector) is stored in the high bits, see PARTITION_BITS.
+        add may run in an extraction thread while requests search: it replaces partitions instead of inserting in it, so readers
+        iterate a dictionary that never changes size, and the writers hold a lock.
+        """
+        self.fc_output_dim = fc_output_dim
+        self.cells = cells
+        self.heading_sectors = heading_sectors
+        self.index_params = {key : value for key, value in index_params.items() if key != "rerank_file"}
+        self.partitions : Dict[int, DatabaseIndex] = dict()
+        self.outside_cell = len(cells)
+        self.outside_bounds = None
+        self.__sectors_per_cell = heading_sectors + 1 if heading_sectors > 1 else 1
+        self.read_only = False
+        self.version = 0 # incremented when images are added or removed, see ResultCache.sync
+        self.__template = None
+        self.__cells_tree = shapely.STRtree(cells)
+        self.__lock = threading.RLock()
+
+    def train(self, descriptors : np.ndarray, seed : int = 0):
+        """Train the index cloned by every sub-index on a sample of all the database descriptors."""
+        with self.__lock:
+            self.__template = DatabaseIndex(self.fc_output_dim, **self.index_params)
+            self.__template.train(descriptors, seed)
+
+    def set_search_parameters(self, nprobe : int = None, ef_search : int = None):
+        for database_index in [self.__template, *self.partitions.values()]:
+            if ( database_index is not None ):
+                database_index.set_search_parameters(nprobe, ef_search)
+
+    @property
+    def is_similarity(self) -> bool:
+        return self.index_params.get("encoding", "float32") != "float32" or self.index_params.get("rerank_k", 0) > 0
+
+    @property
+    def needs_training(self) -> bool:
+        params = {key : value for key, value in self.index_params.items() if key in ["index_type", "nlist", "hnsw_m", "encoding", "pq_m"]}
+        pca_dim = self.index_params.get("pca_dim", 0)
+        return pca_dim > 0 or not build_faiss_index(pca_dim or self.fc_output_dim, **params).is_trained
+
+    @property
+    def train_sample(self) -> int:
+        return self.index_params.get("train_sample", 65536)
+
+    @property
+    def paths(self) -> List[Path]:
+        partitions = self.partitions
+        return [image_path for slot in sorted(partitions) for image_path in partitions[slot].paths]
+
+    def __len__(self):
+        return sum(len(database_index) for database_index in self.partitions.values())
+
+    def __contains__(self, image_path : Path):
+        return any(image_path in database_index for database_index in self.partitions.values())
+
+    def cells_of(self, utm_coordinates : np.ndarray) -> np.ndarray:
+        """Cell of each UTM east/north row, outside_cell for the points outside every cell."""
+        cells = np.full(len(utm_coordinates), self.outside_cell, dtype=np.int64)
+        point_rows, cell_rows = self.__cells_tree.query(shapely.points(utm_coordinates), predicate="intersects")
+        # A point on the border of two cells goes to one of them only
+        point_rows, first_matches = np.unique(point_rows, return_index=True)
+        cells[point_rows] = cell_rows[first_matches]
+        return cells
+
+    def sectors_of(self, headings : np.ndarray) -> np.ndarray:
+        """Heading sector of each heading in degrees, heading_sectors for the unknown (negative) headings."""
+        headings = np.asarray(headings, dtype=np.float64)
+        if ( self.heading_sectors == 1 ):
+            return np.zeros(len(headings), dtype=np.int64)
+        width = 360.0 / self.heading_sectors
+        sectors = (((headings + width / 2) % 360.0) // width).astype(np.int64)
+        sectors[headings < 0] = self.heading_sectors
+        return sectors
+
+    def __cells_near(self, prior : GPSPrior) -> set:
+        area = prior_area(prior)
+        cells = set(self.__cells_tree.query(area, predicate="intersects").tolist())
+        if ( self.outside_bounds is not None and box(*self.outside_bounds).intersects(area) ):
+            cells.add(self.outside_cell)
+        return cells
+
+    def __sectors_near(self, heading : float) -> set:
+        sector = int(self.sectors_of([heading])[0])
+        if ( sector == self.heading_sectors ):
+            return set(range(self.__sectors_per_cell))
+        return {(sector - 1) % self.heading_sectors, sector, (sector + 1) % self.heading_sectors, self.heading_sectors}
+
+    def slots_near(self, prior : GPSPrior = None, heading : float = None) -> List[int]:
+        """Slots of the filled sub-indexes near the prior disk and the heading.
+
+        The heading, then the prior, are dropped when no filled sub-index matches them.
+        """
+        slots = sorted(self.partitions)
+        cells = self.__cells_near(prior) if prior is not None else None
+        sectors = self.__sectors_near(heading) if heading is not None and self.heading_sectors > 1 else None
+        for near_cells, near_sectors in [(cells, sectors), (cells, None)]:
+            near_slots = [slot for slot in slots if ( near_cells is None or slot // self.__sectors_per_cell in near_cells ) and ( near_sectors is None or slot % self.__sectors_per_cell in near_sectors )]
+            if ( len(near_slots) > 0 ):
+                return near_slots
+        return slots
+
+    def __partition(self, slot : int, descriptors : np.ndarray) -> DatabaseIndex:
+        if ( slot not in self.partitions ):
+            if ( self.__template is None ):
+                self.train(descriptors)
+            # A new dictionary, see __init__
+            self.partitions = {**self.partitions, slot : self.__template.empty_clone()}
+        return self.partitions[slot]
+
+    def add(self, image_paths : List[Path], descriptors : np.ndarray, coordinates : Tuple[np.ndarray, np.ndarray] = None, headings : np.ndarray = None) -> np.ndarray:
+        """Add the descriptors of image_paths to the sub-index of their cell and heading sector, already indexed paths are replaced. Returns the global ids.
+
+        coordinates and headings are read from the image names when they are None.
+        """
+        if ( self.read_only ):
+            raise PermissionError("PartitionedIndex loaded with PartitionedIndex.load is read-only")
+        with self.__lock:
+            utm_coordinates, lonlat = coordinates if coordinates is not None else read_coordinates(image_paths)
+            if ( headings is None ):
+                headings = read_headings(image_paths) if self.heading_sectors > 1 else np.zeros(len(image_paths))
+            # An image may change of cell, it is removed from every sub-index
+            self.remove([image_path for image_path in image_paths if image_path in self], compact=False)
+            cells = self.cells_of(utm_coordinates)
+            slots = cells * self.__sectors_per_cell + self.sectors_of(headings)
+            new_ids = np.empty(len(image_paths), dtype=np.int64)
+            for slot in np.unique(slots).tolist():
+                rows = np.flatnonzero(slots == slot)
+                local_ids = self.__partition(slot, descriptors).add([image_paths[row] for row in rows], descriptors[rows], (utm_coordinates[rows], lonlat[rows]))
+                new_ids[rows] = (slot << PARTITION_BITS) | local_ids
+            is_outside = cells == self.outside_cell
+            if ( is_outside.any() ):
+                bounds = [*utm_coordinates[is_outside].min(axis=0), *utm_coordinates[is_outside].max(axis=0)]
+                if ( self.outside_bounds is not None ):
+                    bounds = [*np.minimum(bounds[:2], self.outside_bounds[:2]), *np.maximum(bounds[2:], self.outside_bounds[2:])]
+                self.outside_bounds = [float(bound) for bound in bounds]
+            self.version += 1
+            return new_ids
+
+    def remove(self, image_paths : List[Path], compact : bool = True) -> int:
+        """Tombstone image_paths in their sub-index, return the number of removed images."""
+        if ( self.read_only ):
+            raise PermissionError("PartitionedIndex loaded with PartitionedIndex.load is read-only")
+        removed = sum(database_index.remove(image_paths, compact) for database_index in self.partitions.values())
+        if ( removed > 0 ):
+            with self.__lock:
+                self.version += 1
+        return removed
+
+    def compact(self):
+        for database_index in self.partitions.values():
+            database_index.compact()
+
+    def search(self, descriptors : np.ndarray, k : int, priors : List[GPSPrior] = None, headings : List[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the distances and the global ids of the k nearest live images, -1 where there is none.
+
+        priors and headings hold one GPS prior and one heading in degrees (or None) per query,
+        each query only searches the sub-indexes of slots_near(prior, heading).
+        """
+        descriptors = np.ascontiguousarray(descriptors, dtype="float32")
+        priors = priors if priors is not None else [None] * len(descriptors)
+        headings = headings if headings is not None else [None] * len(descriptors)
+        partitions = self.partitions
+        slots = sorted(partitions)
+        column_of_slot = {slot : column for column, slot in enumerate(slots)}
+        queries_of_slot = {slot : [] for slot in slots}
+        for query, (prior, heading) in enumerate(zip(priors, headings)):
+            for slot in self.slots_near(prior, heading):
+                # A sub-index created by a concurrent add (streaming extraction) after slots was taken is searched next time
+                if ( slot in queries_of_slot ):
+                    queries_of_slot[slot].append(query)
+        # Each sub-index searches its queries at once, its results fill its own block of k columns
+        distances = np.full((len(descriptors), max(1, len(slots)) * k), np.inf, dtype="float32")
+        found_ids = np.full((len(descriptors), max(1, len(slots)) * k), -1, dtype=np.int64)
+        for slot, queries in queries_of_slot.items():
+            if ( len(queries) == 0 ):
+                continue
+            columns = slice(column_of_slot[slot] * k, (column_of_slot[slot] + 1) * k)
+            slot_distances, slot_ids = partitions[slot].search(descriptors[queries], k)
+            distances[queries, columns] = slot_distances
+            found_ids[queries, columns] = np.where(slot_ids >= 0, (slot << PARTITION_BITS) | np.maximum(slot_ids, 0), -1)
+        keys = -distances if self.is_similarity else distances
+        keys[found_ids < 0] = np.inf
+        order = np.argsort(keys, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(found_ids, order, axis=1)
+
+    def __split_ids(self, ids : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        ids = np.asarray(ids, dtype=np.int64)
+        return np.where(ids >= 0, ids >> PARTITION_BITS, -1), np.where(ids >= 0, ids & LOCAL_ID_MASK, -1)
+
+    def paths_of(self, ids : np.ndarray) -> List[Path]:
+        slots, local_ids = self.__split_ids(ids)
+        paths = [None] * slots.size
+        partitions = self.partitions
+        for slot in np.unique(slots).tolist():
+            if ( slot not in partitions ):
+                continue
+            rows = np.flatnonzero(slots.ravel() == slot)
+            for row, image_path in zip(rows, partitions[slot].paths_of(local_ids.ravel()[rows])):
+                paths[row] = image_path
+        return paths
+
+    def coordinates_of(self, ids : np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """UTM east/north and lon/lat of the global ids, shape ids.shape + (2,), NaN for unknown ids."""
+        slots, local_ids = self.__split_ids(ids)
+        utm_coordinates = np.full(slots.shape + (2,), np.nan)
+        lonlat = np.full(slots.shape + (2,), np.nan)
+        partitions = self.partitions
+        for slot in np.unique(slots).tolist():
+            if ( slot not in partitions ):
+                continue
+            is_in_slot = slots == slot
+            utm_coordinates[is_in_slot], lonlat[is_in_slot] = partitions[slot].coordinates_of(local_ids[is_in_slot])
+        return utm_coordinates, lonlat
+
+    def save(self, index_folder : Path):
+        """Write every sub-index in its own folder (see DatabaseIndex.save) and the cells, read back with PartitionedIndex.load."""
+        partitions = self.partitions
+        if ( len(partitions) == 0 ):
+            raise ValueError("PartitionedIndex is empty, nothing to save")
+        staging_folder = index_folder.with_name(f"{index_folder.name}.staging")
+        shutil.rmtree(staging_folder, ignore_errors=True)
+        staging_folder.mkdir(parents=True)
+        for slot, database_index in partitions.items():
+            database_index.save(partition_folder(staging_folder, slot))
+        metadata = {
+            "fc_output_dim" : self.fc_output_dim,
+            "cells" : [cell.wkt for cell in self.cells],
+            "heading_sectors" : self.heading_sectors,
+            "slots" : sorted(partitions),
+            "outside_bounds" : self.outside_bounds,
+            "index_params" : self.index_params,
+        }
+        with open(staging_folder.joinpath(PARTITIONS_FILE), 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+        shutil.rmtree(index_folder, ignore_errors=True)
+        staging_folder.rename(index_folder)
+
+    @staticmethod
+    def load(index_folder : Path, mmap : bool = True) -> "PartitionedIndex":
+        """Open an index written by PartitionedIndex.save, read-only, every sub-index is opened with DatabaseIndex.load."""
+        if ( not index_folder.joinpath(PARTITIONS_FILE).exists() ):
+            raise FileNotFoundError(f"Folder : {index_folder} is not a saved PartitionedIndex")
+        with open(index_folder.joinpath(PARTITIONS_FILE), 'r') as metadata_file:
+            metadata = json.load(metadata_file)
+        partitioned_index = PartitionedIndex(metadata["fc_output_dim"], [shapely.from_wkt(cell) for cell in metadata["cells"]], metadata["heading_sectors"], **metadata["index_params"])
+        partitioned_index.partitions = {slot : DatabaseIndex.load(partition_folder(index_folder, slot), mmap) for slot in metadata["slots"]}
+        partitioned_index.outside_bounds = metadata["outside_bounds"]
+        partitioned_index.read_only = True
+        return partitioned_index
+
+    def __repr__(self):
+        return f"< PartitionedIndex - {len(self.cells)} cells - {self.heading_sectors} heading sectors - {len(self.partitions)} partitions - #live: {len(self)} >"
+
+
+def load_database_index(index_folder : Path, mmap : bool = True):
+    """DatabaseIndex or PartitionedIndex saved in index_folder."""
+    if ( index_folder.joinpath(PARTITIONS_FILE).exists() ):
+        return PartitionedIndex.load(index_folder, mmap)
+    return DatabaseIndex.load(index_folder, mmap)
+
+def partitioned_index_from_args(args : dict) -> PartitionedIndex:
+    """PartitionedIndex over the section_polygon_grid cells of --partition_polygon (a single cell if None) and --heading_sectors."""
+    cells = []
+    if ( args["partition_polygon"] is not None ):
+        polygon = list_to_polygon(read_polygon_csv(args["partition_polygon"]))
+        cells = section_polygon_grid(polygon, args["partition_grid_size"])
+    print(f"Partitioning the database index in {len(cells)} cells of {args['partition_grid_size']} m and {args['heading_sectors']} heading sectors")
+    return PartitionedIndex(args["fc_output_dim"], cells, args["heading_sectors"], **index_params_from_args(args))
@@ -0,0 +1,119 @@
+import time
+import base64
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, Tuple, Union
+
+def image_digest(input_image : Union[Path, str, bytes], is_base64 : bool = False) -> str:
+    """sha256 of the image bytes, the same photo given as a path, a base64 string or raw bytes has the same digest."""
+    if ( isinstance(input_image, (bytes, bytearray)) ):
+        image_bytes = bytes(input_image)
+    elif ( is_base64 ):
+        image_bytes = base64.b64decode(input_image)
+    else:
+        image_bytes = Path(input_image).read_bytes()
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class ResultCache():
+    def __init__(self, max_entries : int = 1024, ttl_seconds : float = 3600.0):
+        """In-process LRU cache of the query descriptors and predictions, keyed by image_digest.
+
+        An entry holds the descriptor of the image and its predictions ("GPS_utm" and "GPS_lonlat" arrays of shape (2,))
+        for each set of search options (GPS prior, heading). Entries expire ttl_seconds after they were created,
+        the least recently used entry is evicted beyond max_entries. See sync for the invalidation.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.descriptor_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.__entries = OrderedDict()
+        self.__model_version = None
+        self.__index_version = None
+        self.__lock = threading.Lock()
+
+    def sync(self, model_version : object, index_version : object):
+        """Drop the entries computed with another model, and only the predictions when the index changed."""
+        with self.__lock:
+            if ( model_version != self.__model_version ):
+                if ( len(self.__entries) > 0 ):
+                    self.invalidations += 1
+                self.__entries.clear()
+            elif ( index_version != self.__index_version ):
+                if ( len(self.__entries) > 0 ):
+                    self.invalidations += 1
+                for entry in self.__entries.values():
+                    entry["predictions"].clear()
+            self.__model_version = model_version
+            self.__index_version = index_version
+
+    def get(self, digest : str, options : tuple = (None, None)) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Cached descriptor and prediction for options of digest, None for the missing ones."""
+        with self.__lock:
+            entry = self.__entries.get(digest)
+            if ( entry is not None and time.monotonic() - entry["created"] > self.ttl_seconds ):
+                del self.__entries[digest]
+                self.expirations += 1
+                entry = None
+            if ( entry is None ):
+                self.misses += 1
+                return None, None
+            self.__entries.move_to_end(digest)
+            prediction = entry["predictions"].get(options)
+            if ( prediction is not None ):
+                self.hits += 1
+            elif ( entry["descriptor"] is not None ):
+                self.descriptor_hits += 1
+            else:
+                self.misses += 1
+            return entry["descriptor"], prediction
+
+    def put(self, digest : str, options : tuple = (None, None), descriptor : np.ndarray = None, prediction : Dict[str, np.ndarray] = None):
+        if ( self.max_entries <= 0 ):
+            return
+        with self.__lock:
+            entry = self.__entries.get(digest)
+            if ( entry is None ):
+                entry = {"descriptor" : None, "predictions" : dict(), "created" : time.monotonic()}
+                self.__entries[digest] = entry
+            self.__entries.move_to_end(digest)
+            if ( descriptor is not None ):
+                entry["descriptor"] = descriptor
+            if ( prediction is not None ):
+                entry["predictions"][options] = prediction
+            while ( len(self.__entries) > self.max_entries ):
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries" : len(self),
+            "hits" : self.hits,
+            "descriptor_hits" : self.descriptor_hits,
+            "misses" : self.misses,
+            "evictions" : self.evictions,
+            "expirations" : self.expirations,
+            "invalidations" : self.invalidations,
+        }
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __repr__(self):
+        return f"< ResultCache - {len(self)}/{self.max_entries} entries - #hits: {self.hits} - #misses: {self.misses} >"
+
+
+def search_options(prior : tuple = None, heading : float = None) -> tuple:
+    """Hashable cache key of the search options of Evaluator.evaluate."""
+    return (None if prior is None else (prior[0].x, prior[0].y, float(prior[1])), heading)
@@ -0,0 +1,79 @@
+import json
+import time
+import torch
+import atexit
+import shutil
+import zipfile
+import tempfile
+from pathlib import Path
+from typing import Dict, Union
+from evaluation.evaluator import Evaluator
+from evaluation.database_index import DatabaseIndex
+from evaluation.partitioned_index import PartitionedIndex, load_database_index
+from evaluation.model_export import export_torchscript
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_METADATA_FILE = "snapshot.json"
+SNAPSHOT_MODEL_FILE = "model.pt"
+SNAPSHOT_INDEX_FOLDER = "index"
+
+def save_snapshot(snapshot_path : Path, model : torch.nn.Module, database_index : Union[DatabaseIndex, PartitionedIndex], example_images : torch.Tensor, metadata : Dict[str, any] = dict()) -> Path:
+    """Pack the TorchScript model and the saved database index (FAISS index, paths and coordinates) in one zip, read back with load_snapshot.
+
+    model is traced on example_images, unless it is already a TorchScript module. The members are stored uncompressed,
+    FAISS codes and float descriptors do not compress, so loading is a plain copy.
+    """
+    if ( len(database_index) == 0 ):
+        raise ValueError("Database index is empty, nothing to snapshot")
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    staging_folder = Path(tempfile.mkdtemp(prefix="snapshot_"))
+    try:
+        if ( isinstance(model, torch.jit.ScriptModule) ):
+            model.save(str(staging_folder.joinpath(SNAPSHOT_MODEL_FILE)))
+        else:
+            export_torchscript(model.cpu(), staging_folder.joinpath(SNAPSHOT_MODEL_FILE), example_images.cpu())
+        database_index.save(staging_folder.joinpath(SNAPSHOT_INDEX_FOLDER))
+        metadata = {
+            "version" : SNAPSHOT_VERSION,
+            "fc_output_dim" : database_index.fc_output_dim,
+            "images" : len(database_index),
+            **metadata,
+        }
+        with open(staging_folder.joinpath(SNAPSHOT_METADATA_FILE), 'w') as metadata_file:
+            json.dump(metadata, metadata_file, indent=4)
+        with zipfile.ZipFile(snapshot_path, 'w', compression=zipfile.ZIP_STORED) as snapshot_file:
+            for member in sorted(staging_folder.rglob("*")):
+                if ( member.is_file() ):
+                    snapshot_file.write(member, member.relative_to(staging_folder).as_posix())
+    finally:
+        shutil.rmtree(staging_folder, ignore_errors=True)
+    return snapshot_path
+
+def read_snapshot_metadata(snapshot_path : Path) -> Dict[str, any]:
+    if ( not snapshot_path.exists() ):
+        raise FileNotFoundError(f"Snapshot : {snapshot_path} does not exist, see main_snapshot.py")
+    with zipfile.ZipFile(snapshot_path, 'r') as snapshot_file:
+        if ( SNAPSHOT_METADATA_FILE not in snapshot_file.namelist() ):
+            raise ValueError(f"Snapshot : {snapshot_path} has no {SNAPSHOT_METADATA_FILE}, it is not a snapshot")
+        metadata = json.loads(snapshot_file.read(SNAPSHOT_METADATA_FILE))
+    if ( metadata["version"] != SNAPSHOT_VERSION ):
+        raise ValueError(f"Snapshot : {snapshot_path} has version {metadata['version']}, expected {SNAPSHOT_VERSION}, snapshot it again")
+    return metadata
+
+def load_snapshot(snapshot_path : Path, device : str = "cpu") -> Evaluator:
+    """Evaluator over the model and the database index of a snapshot written by save_snapshot, nothing is extracted nor indexed.
+
+    The snapshot is unpacked in a temporary folder, removed at exit, the index is memory-mapped from there.
+    The Evaluator has no database loader, its images cannot be updated.
+    """
+    start = time.perf_counter()
+    metadata = read_snapshot_metadata(snapshot_path)
+    snapshot_folder = Path(tempfile.mkdtemp(prefix="snapshot_"))
+    atexit.register(shutil.rmtree, snapshot_folder, ignore_errors=True)
+    with zipfile.ZipFile(snapshot_path, 'r') as snapshot_file:
+        snapshot_file.extractall(snapshot_folder)
+    database_index = load_database_index(snapshot_folder.joinpath(SNAPSHOT_INDEX_FOLDER))
+    model = torch.jit.load(str(snapshot_folder.joinpath(SNAPSHOT_MODEL_FILE)), map_location=str(device))
+    evaluator = Evaluator(None, model, device=device, fc_output_dim=metadata["fc_output_dim"], database_index=database_index)
+    print(f"Snapshot : {snapshot_path} loaded in {time.perf_counter() - start:.2f} s, {metadata['images']} images")
+    return evaluator
@@ -0,0 +1,127 @@
+import time
+import bisect
+import threading
+import contextlib
+from typing import Dict, List
+
+# Upper bounds in seconds of the latency buckets, from the metadata lookup (~0.1 ms) to a cold database batch
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+NO_STAGE = contextlib.nullcontext()
+
+
+class Histogram():
+    def __init__(self, buckets : tuple = DEFAULT_BUCKETS):
+        """Count of observations per bucket (not cumulative), with their sum; the last count is above the last bound."""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value : float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q : float) -> float:
+        """Upper bound of the bucket holding the q quantile, inf above the last bound."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if ( seen >= rank and count > 0 ):
+                return bound
+        return float("nan")
+
+
+class StageTimer():
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics : "StageMetrics", stage : str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class StageMetrics():
+    def __init__(self, enabled : bool = True, buckets : tuple = DEFAULT_BUCKETS):
+        """Latency histograms of the stages of Evaluator and counters, thread safe.
+
+        with metrics.stage("forward"): times its block into the histogram of the stage, count adds to a counter.
+        Disabled, stage returns a shared no-op context and count returns at once, nothing is measured nor locked.
+        Read them with snapshot, or as Prometheus text with prometheus.
+        """
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.__histograms : Dict[str, Histogram] = dict()
+        self.__counters : Dict[str, float] = dict()
+        self.__lock = threading.Lock()
+
+    def stage(self, name : str):
+        if ( not self.enabled ):
+            return NO_STAGE
+        return StageTimer(self, name)
+
+    def observe(self, name : str, seconds : float):
+        if ( not self.enabled ):
+            return
+        with self.__lock:
+            histogram = self.__histograms.get(name)
+            if ( histogram is None ):
+                histogram = self.__histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def count(self, name : str, value : float = 1):
+        if ( not self.enabled ):
+            return
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def reset(self):
+        with self.__lock:
+            self.__histograms.clear()
+            self.__counters.clear()
+
+    def snapshot(self) -> Dict[str, dict]:
+        """{"stages": {stage: count, sum_s, mean_ms, p50_ms, p95_ms, p99_ms, buckets}, "counters": {counter: value}}, quantiles are bucket bounds."""
+        with self.__lock:
+            stages = dict()
+            for name, histogram in self.__histograms.items():
+                stages[name] = {
+                    "count" : histogram.count,
+                    "sum_s" : histogram.sum,
+                    "mean_ms" : 1000 * histogram.sum / histogram.count,
+                    "p50_ms" : 1000 * histogram.quantile(0.50),
+                    "p95_ms" : 1000 * histogram.quantile(0.95),
+                    "p99_ms" : 1000 * histogram.quantile(0.99),
+                    "buckets" : dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], histogram.counts)),
+                }
+            return {"stages" : stages, "counters" : dict(self.__counters)}
+
+    def prometheus(self, namespace : str = "evaluator") -> str:
+        """Prometheus text exposition format: one histogram <namespace>_stage_seconds labelled by stage, one <namespace>_<counter>_total per counter."""
+        lines : List[str] = []
+        with self.__lock:
+            if ( len(self.__histograms) > 0 ):
+                lines.append(f"# HELP {namespace}_stage_seconds Latency of the {namespace} stages in seconds.")
+                lines.append(f"# TYPE {namespace}_stage_seconds histogram")
+            for name, histogram in sorted(self.__histograms.items()):
+                cumulative = 0
+                for bound, count in zip([repr(bound) for bound in self.buckets] + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{namespace}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{namespace}_stage_seconds_sum{{stage="{name}"}} {histogram.sum!r}')
+                lines.append(f'{namespace}_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+            for name, value in sorted(self.__counters.items()):
+                lines.append(f"# TYPE {namespace}_{name}_total counter")
+                lines.append(f"{namespace}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self):
+        return f"< StageMetrics - {'enabled' if self.enabled else 'disabled'} - #stages: {len(self.__histograms)} - #counters: {len(self.__counters)} >"
@@ -0,0 +1,69 @@
+import numpy as np
+from pathlib import Path
+from typing import List, Tuple, Union
+from evaluation.database_index import DatabaseIndex
+from evaluation.partitioned_index import PartitionedIndex
+from evaluation.descriptor_store import ShardedDescriptors
+
+DEFAULT_CHUNK_SIZE = 4096
+
+
+class StreamingIndexer():
+    def __init__(self, database_index : Union[DatabaseIndex, PartitionedIndex], image_paths : List[Path], descriptors : ShardedDescriptors,
+                 coordinates : Tuple[np.ndarray, np.ndarray] = None, chunk_size : int = DEFAULT_CHUNK_SIZE, seed : int = 0):
+        """Fill database_index while the rows of descriptors are being extracted.
+
+        completed is called with the rows as soon as they are written, they are added to the index by chunks of chunk_size rows,
+        so the index grows during the extraction and only one chunk of descriptors is read in memory at a time.
+        An index that needs training (see DatabaseIndex.needs_training) is trained on a random sample of the completed rows
+        once train_sample rows (or all of them) are completed, the rows completed before are added then.
+        """
+        self.database_index = database_index
+        self.chunk_size = chunk_size
+        self.added = 0
+        self.__image_paths = image_paths
+        self.__descriptors = descriptors
+        self.__coordinates = coordinates
+        self.__seed = seed
+        self.__is_completed = np.zeros(len(image_paths), dtype=bool)
+        self.__pending = np.empty(0, dtype=np.int64)
+        self.__is_trained = not database_index.needs_training
+
+    def __train(self):
+        completed_rows = np.flatnonzero(self.__is_completed)
+        if ( len(completed_rows) > self.database_index.train_sample ):
+            completed_rows = np.sort(np.random.default_rng(self.__seed).choice(completed_rows, self.database_index.train_sample, replace=False))
+        self.database_index.train(self.__descriptors[completed_rows], self.__seed)
+        self.__is_trained = True
+
+    def __add(self, rows : np.ndarray):
+        rows = np.sort(rows)
+        coordinates = None
+        if ( self.__coordinates is not None ):
+            coordinates = tuple(column[rows] for column in self.__coordinates)
+        self.database_index.add([self.__image_paths[row] for row in rows], self.__descriptors[rows], coordinates)
+        self.added += len(rows)
+
+    def completed(self, rows : np.ndarray):
+        """Queue rows of descriptors, written by the extraction, and add the full chunks to the index."""
+        rows = np.asarray(rows, dtype=np.int64)
+        self.__is_completed[rows] = True
+        self.__pending = np.concatenate((self.__pending, rows))
+        if ( not self.__is_trained ):
+            if ( self.__is_completed.sum() < min(self.database_index.train_sample, len(self.__is_completed)) ):
+                return
+            self.__train()
+        while ( len(self.__pending) >= self.chunk_size ):
+            self.__add(self.__pending[:self.chunk_size])
+            self.__pending = self.__pending[self.chunk_size:]
+
+    def finish(self):
+        """Add the last partial chunk, training the index first if it was never trained."""
+        if ( not self.__is_trained and self.__is_completed.any() ):
+            self.__train()
+        if ( len(self.__pending) > 0 ):
+            self.__add(self.__pending)
+            self.__pending = np.empty(0, dtype=np.int64)
+
+    def __repr__(self):
+        return f"< StreamingIndexer - {self.added}/{len(self.__is_completed)} added - chunks of {self.chunk_size} >"
@@ -1,15 +1,29 @@
-import torchvision.transforms as transforms
+import torch
+import numpy as np
 import base64
 from io import BytesIO
 from PIL import Image
 from pathlib import Path
-from typing import Union
+from typing import Tuple, Union
+from functools import lru_cache
 
-def base_transform() -> transforms.Compose:
-    return transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ])
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+class PILNormalization():
+    def __init__(self):
+        """Same as transforms.Compose([ToTensor(), Normalize(IMAGENET_MEAN, IMAGENET_STD)]) on RGB images,
+        without importing torchvision (about two seconds at start, for its models and ops)."""
+        self.mean = torch.tensor(IMAGENET_MEAN).view(-1, 1, 1)
+        self.std = torch.tensor(IMAGENET_STD).view(-1, 1, 1)
+    
+    def __call__(self, pil_img : Image) -> torch.Tensor:
+        img = torch.from_numpy(np.array(pil_img, dtype=np.uint8)).permute(2, 0, 1).contiguous()
+        return img.to(torch.float32).div(255).sub_(self.mean).div_(self.std)
+
+@lru_cache(maxsize=1)
+def base_transform() -> PILNormalization:
+    return PILNormalization()
     
 def path_to_base64(input_image : Path):
     with open(input_image, 'rb') as img:
@@ -33,7 +47,42 @@ def get_normalized_image_base64( input_image : str ):
     normalized_img = base_transform()(pil_img)
     return normalized_img
 
-def get_normalized_image(input_image : Union[Path, str], is_base64 : bool = False):
+def get_normalized_image_bytes( img_bytes : bytes ):
+    pil_img = open_image_bytes(img_bytes)
+    normalized_img = base_transform()(pil_img)
+    return normalized_img
+
+def get_normalized_image(input_image : Union[Path, str, bytes], is_base64 : bool = False):
+    if ( isinstance(input_image, (bytes, bytearray)) ):
+        return get_normalized_image_bytes(input_image)
     if (is_base64):
         return get_normalized_image_base64(input_image)
-    return get_normalized_image_path(input_image)
\ No newline at end of file
+    return get_normalized_image_path(input_image)
+
+def get_uint8_image_path(input_image : Path, draft_size : Tuple[int, int] = None) -> torch.Tensor:
+    """Decode input_image to an uint8 CHW tensor, normalized later by UInt8Normalization.
+
+    Image.draft lets the JPEG decoder output RGB directly and, with a draft_size smaller than the image,
+    decode at a reduced scale (1/2, 1/4 or 1/8) instead of resizing afterwards.
+    """
+    pil_img = Image.open(input_image)
+    pil_img.draft("RGB", draft_size if draft_size is not None else pil_img.size)
+    pil_img = pil_img.convert("RGB")
+    return torch.from_numpy(np.array(pil_img)).permute(2, 0, 1).contiguous()
+
+
+class UInt8Normalization(torch.nn.Module):
+    def __init__(self, model : torch.nn.Module):
+        """Wrap model so that uint8 batches are normalized once per batch, like base_transform, on the model device.
+
+        Float batches (already normalized by get_normalized_image) are passed through unchanged.
+        """
+        super().__init__()
+        self.model = model
+        self.register_buffer("mean", torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1), persistent=False)
+        self.register_buffer("std", torch.tensor(IMAGENET_STD).view(1, 3, 1, 1), persistent=False)
+    
+    def forward(self, images : torch.Tensor) -> torch.Tensor:
+        if ( images.dtype == torch.uint8 ):
+            images = (images.float().div(255) - self.mean.to(images.device)) / self.std.to(images.device)
+        return self.model(images)
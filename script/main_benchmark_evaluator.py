@@ -0,0 +1,40 @@
+from benchmark import args_parser as ap
+from benchmark.synthetic_dataset import generate_synthetic_images
+from benchmark.evaluator_benchmark import EvaluatorBenchmark, display_results, compare_with_baseline, display_comparison
+from evaluation.CosPlace_src import network
+from util.polygon_manager import read_polygon_csv, list_to_polygon
+from pathlib import Path
+import tempfile
+import shutil
+import torch
+import json
+import sys
+
+if __name__ == "__main__":
+    args = ap.evaluator_args_parser()
+    print(f"Arguments: {args}")
+    if ( args["baseline_json"] is not None and not args["baseline_json"].exists() ):
+        raise FileNotFoundError(f"Baseline : {args['baseline_json']} does not exist")
+    polygon = list_to_polygon(read_polygon_csv(args["csv_polygon"]))
+    work_folder = args["work_folder"] if args["work_folder"] is not None else Path(tempfile.mkdtemp(prefix="evaluator_benchmark_"))
+    for folder in ["database", "queries", "database.descriptors"]:
+        shutil.rmtree(work_folder.joinpath(folder), ignore_errors=True)
+    generate_synthetic_images(work_folder.joinpath("database"), polygon, args["num_images"], args["width"], args["height"], args["seed"])
+    query_paths = generate_synthetic_images(work_folder.joinpath("queries"), polygon, args["num_queries"], args["width"], args["height"], args["seed"] + 1)
+    torch.manual_seed(args["seed"])
+    model = network.GeoLocalizationNet(args["backbone"], args["fc_output_dim"], pretrained=False).to(args["device"])
+    benchmark = EvaluatorBenchmark(work_folder.joinpath("database"), query_paths, model, args["fc_output_dim"], args["device"], args["infer_batch_size"], args["num_workers"], args["seed"])
+    results = benchmark.run(work_folder.joinpath("database.descriptors"), args["database_sizes"], args["num_queries"])
+    display_results(results)
+    if ( args["work_folder"] is None ):
+        shutil.rmtree(work_folder, ignore_errors=True)
+    if ( args["output_json"] is not None ):
+        with open(args["output_json"], 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+        print(f"Results saved to {args['output_json']}")
+    if ( args["baseline_json"] is not None ):
+        with open(args["baseline_json"], 'r') as baseline_file:
+            comparison = compare_with_baseline(results, json.load(baseline_file), args["tolerance"])
+        display_comparison(comparison)
+        if ( any(entry["regression"] for entry in comparison) ):
+            sys.exit(1)
@@ -0,0 +1,23 @@
+from benchmark import args_parser as ap
+from benchmark.index_benchmark import IndexBenchmark, display_results
+from evaluation.descriptor_store import read_store, default_store_folder
+import json
+
+if __name__ == "__main__":
+    args = ap.index_args_parser()
+    print(f"Arguments: {args}")
+    store_folder = args["descriptors_store"] if args["descriptors_store"] is not None else default_store_folder(args["input_database_folder"])
+    print(f"Reading descriptors from {store_folder}")
+    image_paths, descriptors = read_store(store_folder)
+    benchmark = IndexBenchmark(image_paths, descriptors, num_queries=args["num_queries"])
+    results = benchmark.run(nlists=args["nlist"],
+                            nprobes=args["nprobe"],
+                            hnsw_ms=args["hnsw_m"],
+                            ef_searches=args["ef_search"],
+                            train_sample=args["train_sample"],
+                            pca_dims=args["pca_dim"])
+    display_results(results)
+    if ( args["output_json"] is not None ):
+        with open(args["output_json"], 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+        print(f"Results saved to {args['output_json']}")
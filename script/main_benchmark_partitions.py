@@ -0,0 +1,22 @@
+from benchmark import args_parser as ap
+from benchmark.partition_benchmark import PartitionBenchmark, display_results
+from evaluation.descriptor_store import read_store, default_store_folder
+from util.polygon_manager import read_polygon_csv, list_to_polygon, section_polygon_grid
+import json
+
+if __name__ == "__main__":
+    args = ap.partition_args_parser()
+    print(f"Arguments: {args}")
+    store_folder = args["descriptors_store"] if args["descriptors_store"] is not None else default_store_folder(args["input_database_folder"])
+    print(f"Reading descriptors from {store_folder}")
+    image_paths, descriptors = read_store(store_folder)
+    cells = []
+    if ( args["partition_polygon"] is not None ):
+        cells = section_polygon_grid(list_to_polygon(read_polygon_csv(args["partition_polygon"])), args["partition_grid_size"])
+    benchmark = PartitionBenchmark(image_paths, descriptors, cells, num_queries=args["num_queries"])
+    results = benchmark.run(heading_sectors=args["heading_sectors"], prior_radius=args["prior_radius"])
+    display_results(results)
+    if ( args["output_json"] is not None ):
+        with open(args["output_json"], 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+        print(f"Results saved to {args['output_json']}")
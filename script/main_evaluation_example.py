@@ -1,50 +1,58 @@
-from evaluation.database_loader import DatabaseLoaderPIL
-from evaluation.evaluator import Evaluator
-from evaluation.utils import path_to_base64
-from util.image_manager import read_datas
 import evaluation.args_parser as args_parser
 
-import torch
 import random
-from evaluation.CosPlace_src import network
 from pathlib import Path
 
-torch.backends.cudnn.benchmark = True  # Provides a speedup
-
 if __name__ == "__main__":
     args = args_parser.args_parser()
     print(f"Arguments: {args}")
-    if ( args['resume_model'] == None ):
-        print(f"Using hub to download model : {args['backbone']} -- {args['fc_output_dim']}")
-        model = torch.hub.load("gmberton/cosplace", "get_trained_model", backbone=args["backbone"], fc_output_dim=args["fc_output_dim"], trust_repo=True)
-    else:
-        print(f"Using local model : {args['resume_model']} -- {args['backbone']} -- {args['fc_output_dim']}")
-        model = network.GeoLocalizationNet(args["backbone"], args["fc_output_dim"])
-        model_state_dict = torch.load(args["resume_model"], map_location=str(args["device"]))
-        model.load_state_dict(model_state_dict)
-    model = model.to(args["device"])
-    print("Model is loaded")
     
     if ( args['image_to_evaluate'] is None and args['random_queries_folder'] is None ):
         raise IOError
+    if ( args["snapshot"] is not None and not args["snapshot"].exists() ):
+        raise FileNotFoundError(f"Snapshot : {args['snapshot']} does not exist, see main_snapshot.py")
     if ( args["image_to_evaluate"] is None ):
         print(f"Using a random images from {args['random_queries_folder']}")
         images = [img for img in args['random_queries_folder'].rglob("*.jpg")]
         args["image_to_evaluate"] = images[random.randint(0, len(images) - 1)]
     print(f"Image to evaluate : {args['image_to_evaluate']}")
+    
+    # torch, faiss and the model are imported once the arguments are checked, --help and argument errors return at once
+    import torch
+    from evaluation.utils import path_to_base64
+    from evaluation.partitioned_index import exif_gps_prior, exif_heading
+    from util.image_manager import read_datas
+    torch.backends.cudnn.benchmark = True  # Provides a speedup
+    
     args["image"] = args["image_to_evaluate"]
     if ( args["use_base64"] ):
         print(f"Using base64 to evaluate, simulation of a server request. {args['use_base64']}")
         args["image"] = path_to_base64(args["image_to_evaluate"])
     
-    print(f"Creating Dataset from database folder : {args['input_database_folder']}")
-    database = DatabaseLoaderPIL(args["input_database_folder"])
-    print(f"Creating Evaluator from previous Dataset")
-    evaluator = Evaluator(database, model, num_workers=args['num_workers'], infer_batch_size=args['infer_batch_size'], device=args['device'])
+    prior = None
+    if ( args["prior_radius"] is not None ):
+        prior = exif_gps_prior(args["image_to_evaluate"], args["prior_radius"])
+        print(f"GPS prior : {prior}")
+    heading = None
+    if ( args["heading_sectors"] > 1 ):
+        heading = exif_heading(args["image_to_evaluate"])
+        print(f"Heading : {heading}")
+    
+    if ( args["snapshot"] is not None ):
+        # The model and the database index of the snapshot, the database is neither extracted nor indexed
+        from evaluation.snapshot import load_snapshot
+        evaluator = load_snapshot(args["snapshot"], args["device"])
+    else:
+        from evaluation.model_loader import load_model, evaluator_from_args
+        model = load_model(args)
+        evaluator = evaluator_from_args(args, model)
     
     print(" -- Evaluation -- ")
-    prediction = evaluator.evaluate(args["image"], args["use_base64"])
+    if ( not evaluator.extraction_done.is_set() ):
+        print(f"Database extraction in background, evaluating on the {len(evaluator.database_index)} images indexed so far")
+    prediction = evaluator.evaluate(args["image"], args["use_base64"], prior, heading)
     truth = read_datas(args["image_to_evaluate"])
     print(f"UTM_prediction = {prediction['GPS_utm']}\nUTM_truth = {truth['UTM_east']}, {truth['UTM_north']}\n - Diff UTM_east : {abs(prediction['GPS_utm'].x - truth['UTM_east'])} meters\n - Diff UTM_north : {abs(prediction['GPS_utm'].y - truth['UTM_north'])} meters")
-    
-    
\ No newline at end of file
+    if ( args["snapshot"] is None and args["background_extraction"] ):
+        evaluator.wait_for_extraction()
+        print(f"Database extraction finished, {len(evaluator.database_index)} images indexed")
@@ -0,0 +1,40 @@
+from evaluation.model_loader import load_model, evaluator_from_args, calibration_paths_from_args
+from evaluation.database_index import default_index_folder
+from server.micro_batcher import MicroBatcher
+from server.localization_server import LocalizationServer
+from server.worker_pool import WorkerPool, save_calibration_paths
+import server.args_parser as args_parser
+
+import torch
+import asyncio
+
+torch.backends.cudnn.benchmark = True  # Provides a speedup
+
+if __name__ == "__main__":
+    args = args_parser.args_parser()
+    print(f"Arguments: {args}")
+    model = load_model(args)
+    evaluator = evaluator_from_args(args, model)
+    
+    if ( args["workers"] > 1 ):
+        index_folder = args["index_folder"] if args["index_folder"] is not None else default_index_folder(args["input_database_folder"])
+        # The workers load the saved index, it must hold the whole database
+        evaluator.wait_for_extraction()
+        evaluator.database_index.save(index_folder)
+        save_calibration_paths(index_folder, calibration_paths_from_args(args, evaluator.eval_ds.database_paths))
+        print(f"Index saved to {index_folder}, starting {args['workers']} workers")
+        del evaluator, model
+        pool = WorkerPool(args, index_folder, args["workers"])
+        pool.start()
+        try:
+            pool.join()
+        except KeyboardInterrupt:
+            pool.stop()
+            print(f"Server stopped : {pool}")
+    else:
+        batcher = MicroBatcher(evaluator, max_batch_size=args["max_batch_size"], max_wait_ms=args["max_wait_ms"])
+        server = LocalizationServer(batcher, host=args["host"], port=args["port"], decode_workers=args["decode_workers"], max_body_mb=args["max_body_mb"])
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            print(f"Server stopped : {batcher}")
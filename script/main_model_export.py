@@ -0,0 +1,23 @@
+from evaluation.model_loader import load_model
+from evaluation.model_export import export_model, load_model_backend, check_model_backend, sample_images, benchmark_models, display_benchmark
+import evaluation.args_parser as args_parser
+
+if __name__ == "__main__":
+    args = args_parser.export_args_parser()
+    print(f"Arguments: {args}")
+    model = load_model(args).eval()
+    
+    database_paths = sorted(args["input_database_folder"].rglob("*.jpg"))
+    images = sample_images(database_paths, args["num_images"])
+    print(f"Using {len(images)} images of {args['input_database_folder']} to trace, check and benchmark")
+    
+    models = {"eager" : model}
+    for backend in args["formats"]:
+        artifact_path = export_model(model, backend, args["output_folder"], images[:2], f"{args['backbone']}_{args['fc_output_dim']}")
+        model = model.to(args["device"])
+        models[backend] = load_model_backend(backend, artifact_path, args["device"])
+        difference = check_model_backend(model, models[backend], images[:args["infer_batch_size"]], args["backend_tolerance"], args["device"])
+        print(f"Exported {backend} model to {artifact_path}, max descriptor difference : {difference:.2e}")
+    
+    print(" -- Benchmark -- ")
+    display_benchmark(benchmark_models(models, images, args["infer_batch_size"], device=args["device"]))
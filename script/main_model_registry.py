@@ -0,0 +1,27 @@
+from evaluation.model_registry import ModelRegistry
+from evaluation.CosPlace_src import network
+import evaluation.args_parser as args_parser
+
+import torch
+
+if __name__ == "__main__":
+    args = args_parser.registry_args_parser()
+    print(f"Arguments: {args}")
+    registry = ModelRegistry(args["model_registry"])
+    
+    if ( not args["list"] ):
+        if ( args["resume_model"] is not None ):
+            print(f"Registering local model : {args['resume_model']} -- {args['backbone']} -- {args['fc_output_dim']}")
+            # Every weight must fit GeoLocalizationNet, the registry entries are loaded strictly
+            model = network.GeoLocalizationNet(args["backbone"], args["fc_output_dim"], pretrained=False)
+            model.load_state_dict(torch.load(args["resume_model"], map_location="cpu"), strict=True)
+            registry.register(args["backbone"], args["fc_output_dim"], model.state_dict())
+        elif ( (args["backbone"], args["fc_output_dim"]) in registry ):
+            print(f"Model registry : {args['backbone']} -- {args['fc_output_dim']} is already registered")
+        else:
+            registry.fetch(args["backbone"], args["fc_output_dim"])
+    
+    print(registry)
+    for backbone, fc_output_dim in registry.entries():
+        sizes = [registry.path(backbone, fc_output_dim, half).stat().st_size / 2**20 for half in [False, True]]
+        print(f" - {backbone} -- {fc_output_dim} : {sizes[0]:.1f} MB (fp32), {sizes[1]:.1f} MB (fp16)")
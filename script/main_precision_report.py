@@ -0,0 +1,23 @@
+from evaluation.model_loader import load_model
+from evaluation.model_export import sample_images
+from evaluation.inference_precision import INFERENCE_PRECISIONS, precision_model, precision_report, display_precision_reports
+import evaluation.args_parser as args_parser
+
+if __name__ == "__main__":
+    args = args_parser.precision_args_parser()
+    print(f"Arguments: {args}")
+    model = load_model(args).eval()
+    
+    database_paths = sorted(args["input_database_folder"].rglob("*.jpg"))
+    calibration_images = sample_images(database_paths, args["calibration_images"])
+    images = sample_images(database_paths, args["num_images"], seed=1)
+    print(f"Calibrating on {len(calibration_images)} images, reporting on {len(images)} images of {args['input_database_folder']}")
+    
+    reports = dict()
+    for precision in INFERENCE_PRECISIONS:
+        if ( precision == "int8" and args["device"] != "cpu" ):
+            print("Skipping int8, only supported with --device cpu")
+            continue
+        inference_model = precision_model(model, precision, args["device"], calibration_images)
+        reports[precision] = precision_report(model, inference_model, images, args["infer_batch_size"], args["device"])
+    display_precision_reports(reports)
@@ -0,0 +1,27 @@
+from evaluation.model_loader import load_model, evaluator_from_args
+from evaluation.model_export import sample_images
+from evaluation.snapshot import save_snapshot
+import evaluation.args_parser as args_parser
+
+if __name__ == "__main__":
+    args = args_parser.snapshot_args_parser()
+    print(f"Arguments: {args}")
+    if ( args["model_backend"] == "onnx" ):
+        raise ValueError("Model backend : onnx cannot be snapshot, the snapshot holds a TorchScript model")
+    model = load_model(args)
+    evaluator = evaluator_from_args(args, model)
+    # The snapshot holds the whole database
+    evaluator.wait_for_extraction()
+    
+    # The model the database was extracted with, inside the uint8 normalization of the Evaluator
+    inference_model = evaluator.model.model
+    images = sample_images(evaluator.eval_ds.database_paths, args["num_images"])
+    metadata = {
+        "backbone" : args["backbone"],
+        "model_key" : evaluator.model_key,
+        "model_backend" : args["model_backend"],
+        "inference_precision" : args["inference_precision"],
+        "input_database_folder" : str(args["input_database_folder"]),
+    }
+    snapshot_path = save_snapshot(args["snapshot"], inference_model, evaluator.database_index, images, metadata)
+    print(f"Snapshot of {len(evaluator.database_index)} images saved to {snapshot_path}, {snapshot_path.stat().st_size / 2**20:.1f} MB")
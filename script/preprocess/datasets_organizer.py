@@ -1,6 +1,6 @@
 from pathlib import Path
 from shapely.geometry import Polygon, Point
-from util.image_manager import is_facing_north, read_datas
+from util.catalog import ImageCatalog
 from util.polygon_manager import section_polygon_grid
 from tqdm import tqdm
 from time import time
@@ -34,6 +34,7 @@ class DatasetsOrganizer():
         self.__val_folder = val_sub_folder
         self.__database = "database"
         self.__queries = "queries"
+        self.__catalog = ImageCatalog(self.__input_folder)
         self.__verify_args(recognition_polygon)
         self.__parse_args(recognition_polygon, grid_square_size)
         
@@ -68,8 +69,8 @@ class DatasetsOrganizer():
         self.__input_folder.joinpath(self.__val_folder).joinpath(self.__queries).mkdir(exist_ok=True)
         self.__create_section_directory()
         
-    def __deal_training(self, in_image : Path, p_training : float) -> bool:
-        if ( not is_facing_north(in_image) ):
+    def __deal_training(self, in_image : Path, heading : int, p_training : float) -> bool:
+        if ( heading != 0 ):
             return False
         if ( self.__rand.random() > p_training  ):
             return False
@@ -84,12 +85,10 @@ class DatasetsOrganizer():
             return True
         mv(in_image, self.__input_folder.joinpath(self.__val_folder).joinpath(self.__queries))
         
-    def __deal_test(self, in_image : Path, p_database : float):
+    def __deal_test(self, in_image : Path, utm_loc : Point, p_database : float):
         if ( self.__rand.random() <= p_database ):
             mv(in_image, self.__input_folder.joinpath(self.__test_folder).joinpath(self.__database))
             return True
-        tags = read_datas(in_image)
-        utm_loc = Point(tags["UTM_east"], tags["UTM_north"])
         for index, section in enumerate(self.__grid):
             if ( section.contains(utm_loc) ):
                 mv(in_image, self.__input_folder.joinpath(self.__test_folder).joinpath(self.__queries).joinpath(f"section_id_{index}"))
@@ -99,13 +98,13 @@ class DatasetsOrganizer():
     def __deal_error(self, in_image : Path):
         mv( in_image, self.__input_folder.joinpath(self.__val_folder).joinpath(self.__queries) )
             
-    def __organize_image__(self, in_image : Path, p_training : float, p_val : float, p_database : float):
+    def __organize_image__(self, in_image : Path, heading : int, utm_loc : Point, p_training : float, p_val : float, p_database : float):
         self.__rand = random.Random(time())
-        if ( self.__is_training and self.__deal_training(in_image, p_training) ):
+        if ( self.__is_training and self.__deal_training(in_image, heading, p_training) ):
             return
         if ( self.__deal_val(in_image, p_val, p_database) ):
             return
-        if (self.__deal_test(in_image, p_database)):
+        if (self.__deal_test(in_image, utm_loc, p_database)):
             return
         self.__deal_error(in_image)
         
@@ -129,32 +128,29 @@ class DatasetsOrganizer():
     def organize(self, p_training : int = 0.85, p_val : int = 0.15, p_database : int = 0.8, num_workers : int = mp.cpu_count()):
         self.__clean()
         self.__create_directories()
-        images_to_organize = [img for img in self.__input_folder.rglob("*.jpg")]
+        # Headings and positions come from the catalog in one read, the workers do not parse the image names
+        self.__catalog.refresh()
+        images_to_organize, datas = self.__catalog.load_images(self.__input_folder, ["heading", "utm_east", "utm_north"])
         with ProcessPoolExecutor(max_workers=num_workers) as executor:
-            futures = [executor.submit(self.__organize_image__, img, p_training, p_val, p_database) for img in images_to_organize]
+            futures = [executor.submit(self.__organize_image__, img, int(heading), Point(utm_east, utm_north), p_training, p_val, p_database) for img, heading, utm_east, utm_north in zip(images_to_organize, datas["heading"], datas["utm_east"], datas["utm_north"])]
             for _ in tqdm(as_completed(futures), total=len(futures), miniters=1, desc="Organizing images", unit="image"):
                 pass
         self.__clean()
+        print(f"Catalog {self.__catalog} : {self.__catalog.refresh()}")
         self.__display_results()
     
     def __number_images_from_id_section(self, index : int) -> int:
         None
         
     def __xy_images_from_id_section(self, index : int)->Set:
-        coords = set()
         if ( not self.__input_folder.joinpath(self.__test_folder).joinpath(self.__queries).joinpath(f"section_id_{index}").exists() ):
             return None
-        for img in self.__input_folder.joinpath(self.__test_folder).joinpath(self.__queries).joinpath(f"section_id_{index}").iterdir():
-            tags = read_datas(img)
-            coords.add((tags["UTM_east"], tags["UTM_north"]))
-        return coords
+        datas = self.__catalog.load(split=self.__test_folder.joinpath(self.__queries).as_posix(), section_id=index, columns=["utm_east", "utm_north"])
+        return set(zip(datas["utm_east"].tolist(), datas["utm_north"].tolist()))
     
     def __xy_images_from_training(self)->Set:
-        coords = set()
-        for img in self.__input_folder.joinpath(self.__train_folder).glob("*.jpg"):
-            tags = read_datas(img)
-            coords.add((tags["UTM_east"], tags["UTM_north"]))
-        return coords
+        datas = self.__catalog.load(split=self.__train_folder.as_posix(), columns=["utm_east", "utm_north"])
+        return set(zip(datas["utm_east"].tolist(), datas["utm_north"].tolist()))
     
     def display_section_distribution(self, GPS_polygon : Polygon, grid_quare_size : int):
         plt.figure("Dataset Section Distribution")
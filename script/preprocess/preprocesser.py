@@ -8,7 +8,8 @@ import shutil
 import utm
 import util.image_manager as im
 import preprocess.unprocessable_image as uni
-from typing import Dict, Callable
+from typing import Dict, Callable, Set
+from util.catalog import ImageCatalog
 from preprocess.verify import VerifyRawDataset
 from concurrent.futures import as_completed, ProcessPoolExecutor
 
@@ -46,15 +47,13 @@ class RawPreProcesser():
             raise NotADirectoryError(f"Path : {self.__processed_output_path} is not a Folder")
         
         
-    def __is_already_processed(self, image_to_process : Path) -> bool:
-        return image_to_process.stem in [im.read_datas(image)["IMG_name"][0:-2] for image in self.__processed_output_path.rglob("*.jpg*")]
+    def __is_already_processed(self, image_to_process : Path, processed_images : Set[str]) -> bool:
+        return image_to_process.stem in processed_images
     
     def __call_rezize__(self, input_image : Path, width : int, height : int, unprocessable_method : Callable[[Path], None] = uni.change_suffix) -> None:
         if (self.verifier.is_invalid_images(input_image)):
             unprocessable_method(input_image)
             return None
-        if (self.__is_already_processed(input_image)):
-            return None
         with open(input_image, 'rb') as img:
             tags = exifread.process_file(img, details=False)
         index = 0
@@ -70,12 +69,16 @@ class RawPreProcesser():
        
     def run(self, number_of_workers : int = cpu_count(), unprocessable_method : Callable[[Path], None] = uni.change_suffix, width : int = 512, height : int = 512 ):
         self.verifier.verify(number_of_workers)
-        images_to_crop = [file for file in self.__raw_input_path.iterdir() if file.is_file() and (file.suffix).lower() in im.get_image_ext()]
+        catalog = ImageCatalog(self.__processed_output_path)
+        catalog.refresh()
+        processed_images = catalog.source_images()
+        images_to_crop = [file for file in self.__raw_input_path.iterdir() if file.is_file() and (file.suffix).lower() in im.get_image_ext() and not self.__is_already_processed(file, processed_images)]
         with ProcessPoolExecutor(max_workers=number_of_workers) as executor:
             futures = [executor.submit(self.__call_rezize__, input_image, width=width, height=height, unprocessable_method=unprocessable_method) for input_image in images_to_crop]
             for _ in tqdm(as_completed(futures), total=len(images_to_crop), miniters=1, desc="Cropping", unit="image"):
                 pass
         print(f"==> Number of images generated : {len([img for img in self.__processed_output_path.glob('*.jpg')])}")
+        print(f"==> Catalog {catalog} : {catalog.refresh()}")
         
     def __reset_process(self):
         clear_processed_output_path(self.__processed_output_path)
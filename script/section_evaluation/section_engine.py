@@ -0,0 +1,163 @@
+import json
+import time
+import numpy as np
+from tqdm import tqdm
+from pathlib import Path
+from typing import Dict, List
+from evaluation.evaluator import Evaluator
+
+LATENCY_PERCENTILES = [50, 95, 99]
+DEFAULT_QUERY_BATCH_SIZE = 16
+
+def section_id_of(section : Path) -> str:
+    """Id of a section folder of the queries, named <...>_<id>."""
+    return section.name.split("_")[-1]
+
+def select_sections(test_input_path : Path, all_sections : bool, sections_id : list = []) -> List[Path]:
+    """Section folders of <test_input_path>/queries, every one with all_sections, else the ones of sections_id (duplicates ignored)."""
+    if ( all_sections ):
+        return [section for section in test_input_path.joinpath("queries").iterdir()]
+    unique_sections_id = list(dict.fromkeys(sections_id or []))
+    return [section for section_id in unique_sections_id for section in test_input_path.joinpath("queries").glob("*_" + str(section_id))]
+
+def utm_of_image_name(image_path : Path) -> List[float]:
+    """UTM east and north written in the name of a processed image, @<east>@<north>@..."""
+    coordinates = image_path.stem.split("@")
+    return [float(coordinates[1]), float(coordinates[2])]
+
+
+class SectionResults():
+    def __init__(self, section_ids : List[str], image_paths : List[Path], image_sections : np.ndarray, truths : np.ndarray, predictions : np.ndarray,
+                 batch_sections : np.ndarray, batch_images : np.ndarray, batch_seconds : np.ndarray, error_margin : float):
+        """Predictions of the query images of every section, row i being image_paths[i] of section section_ids[image_sections[i]].
+
+        truths and predictions are UTM (east, north) arrays of shape (N, 2), a prediction is good under error_margin meters.
+        The latency is measured per evaluate_batch call, never per image: batch j evaluated batch_images[j] images
+        of section section_ids[batch_sections[j]] in batch_seconds[j] seconds.
+        """
+        self.section_ids = section_ids
+        self.image_paths = image_paths
+        self.image_sections = image_sections
+        self.truths = truths
+        self.predictions = predictions
+        self.batch_sections = batch_sections
+        self.batch_images = batch_images
+        self.batch_seconds = batch_seconds
+        self.error_margin = error_margin
+        self.distances = np.linalg.norm(predictions - truths, axis=1)
+        self.is_good = self.distances < error_margin
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def section_rows(self, section_id : str) -> np.ndarray:
+        return np.flatnonzero(self.image_sections == self.section_ids.index(section_id))
+
+    def section_batches(self, section_id : str) -> np.ndarray:
+        return np.flatnonzero(self.batch_sections == self.section_ids.index(section_id))
+
+    def __summary_of(self, rows : np.ndarray, batches : np.ndarray) -> Dict[str, float]:
+        if ( len(rows) == 0 ):
+            return {"images" : 0, "good" : 0, "bad" : 0, "batches" : 0}
+        good = int(self.is_good[rows].sum())
+        percentiles = np.percentile(self.batch_seconds[batches], LATENCY_PERCENTILES)
+        return {
+            "images" : len(rows),
+            "good" : good,
+            "bad" : len(rows) - good,
+            "accuracy" : good / len(rows),
+            "mean_distance_m" : float(self.distances[rows].mean()),
+            "median_distance_m" : float(np.median(self.distances[rows])),
+            "batches" : len(batches),
+            # Throughput of the section: time of its batches over its images
+            "ms_per_image" : 1000 * float(self.batch_seconds[batches].sum()) / len(rows),
+            **{f"p{percentile}_batch_ms" : 1000 * float(value) for percentile, value in zip(LATENCY_PERCENTILES, percentiles)},
+        }
+
+    def section_summary(self, section_id : str) -> Dict[str, float]:
+        """Images, good and bad predictions, accuracy, distances in meters, ms per image and batch latency percentiles in ms of a section."""
+        return self.__summary_of(self.section_rows(section_id), self.section_batches(section_id))
+
+    def summary(self) -> Dict[str, dict]:
+        """{"sections": {section_id: section_summary}, "all": the same over every image and batch}."""
+        return {
+            "sections" : {section_id : self.section_summary(section_id) for section_id in self.section_ids},
+            "all" : self.__summary_of(np.arange(len(self)), np.arange(len(self.batch_seconds))),
+        }
+
+    def save(self, json_path : Path):
+        """Write the summary, the prediction of every image and the latency of every batch."""
+        results = {
+            "error_margin" : self.error_margin,
+            **self.summary(),
+            "images" : [
+                {
+                    "path" : str(image_path),
+                    "section" : self.section_ids[section],
+                    "truth" : truth.tolist(),
+                    "prediction" : prediction.tolist(),
+                    "distance_m" : float(distance),
+                }
+                for image_path, section, truth, prediction, distance
+                in zip(self.image_paths, self.image_sections, self.truths, self.predictions, self.distances)
+            ],
+            "batches" : [
+                {"section" : self.section_ids[section], "images" : int(images), "ms" : 1000 * float(seconds)}
+                for section, images, seconds in zip(self.batch_sections, self.batch_images, self.batch_seconds)
+            ],
+        }
+        with open(json_path, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+
+    def __repr__(self):
+        return f"< SectionResults - #sections: {len(self.section_ids)} - #images: {len(self)} - #batches: {len(self.batch_seconds)} - accuracy: {self.is_good.mean() if len(self) > 0 else float('nan'):.3f} >"
+
+
+class SectionEngine():
+    def __init__(self, evaluator : Evaluator, error_margin : float = 10.0, batch_size : int = DEFAULT_QUERY_BATCH_SIZE):
+        """Headless evaluation of the query sections, nothing is drawn (see SectionEvaluator.display for the rendering).
+
+        The images of each section are evaluated with Evaluator.evaluate_batch by batch_size images, each call being
+        a stacked forward pass and a single FAISS search, timed on its own. A batch never mixes two sections,
+        so the batch latencies of a section are its own.
+        """
+        if ( batch_size <= 0 ):
+            raise ValueError(f"batch_size : {batch_size} must be positive")
+        self.evaluator = evaluator
+        self.error_margin = error_margin
+        self.batch_size = batch_size
+
+    def run(self, sections : List[Path]) -> SectionResults:
+        section_ids = [section_id_of(section) for section in sections]
+        image_paths = []
+        image_sections = []
+        for section_index, section in enumerate(sections):
+            section_images = sorted(section.iterdir())
+            image_paths.extend(section_images)
+            image_sections.extend([section_index] * len(section_images))
+        image_sections = np.array(image_sections, dtype=np.int64)
+        truths = np.array([utm_of_image_name(image_path) for image_path in image_paths], dtype=np.float64).reshape(-1, 2)
+        predictions = np.empty((len(image_paths), 2), dtype=np.float64)
+        # (start, end) rows of every batch, cut inside each section
+        section_starts = np.searchsorted(image_sections, np.arange(len(sections) + 1))
+        batches = [(start, min(start + self.batch_size, end)) for begin, end in zip(section_starts[:-1], section_starts[1:]) for start in range(begin, end, self.batch_size)]
+        batch_seconds = np.empty(len(batches), dtype=np.float64)
+        for batch, (start, end) in enumerate(tqdm(batches, desc="Evaluated batches", unit="batch")):
+            batch_start = time.perf_counter()
+            batch_predictions = self.evaluator.evaluate_batch(image_paths[start:end])
+            batch_seconds[batch] = time.perf_counter() - batch_start
+            predictions[start:end] = batch_predictions["GPS_utm"]
+        batch_sections = np.array([image_sections[start] for start, _ in batches], dtype=np.int64)
+        batch_images = np.array([end - start for start, end in batches], dtype=np.int64)
+        return SectionResults(section_ids, image_paths, image_sections, truths, predictions, batch_sections, batch_images, batch_seconds, self.error_margin)
+
+
+def display_section_results(results : SectionResults):
+    summary = results.summary()
+    print(f"{'section':<10}{'images':>8}{'good':>6}{'accuracy':>10}{'mean (m)':>10}{'batches':>9}{'ms/image':>10}{'batch p50 (ms)':>16}{'batch p95 (ms)':>16}{'batch p99 (ms)':>16}")
+    for section_id, section in list(summary["sections"].items()) + [("all", summary["all"])]:
+        if ( section["images"] == 0 ):
+            print(f"{section_id:<10}{0:>8}")
+            continue
+        print(f"{section_id:<10}{section['images']:>8}{section['good']:>6}{section['accuracy']:>10.3f}{section['mean_distance_m']:>10.2f}{section['batches']:>9}"
+              f"{section['ms_per_image']:>10.2f}{section['p50_batch_ms']:>16.2f}{section['p95_batch_ms']:>16.2f}{section['p99_batch_ms']:>16.2f}")
@@ -4,15 +4,13 @@ import matplotlib.colors as mcolors
 import matplotlib.lines as mlines
 from matplotlib.lines import Line2D
 from matplotlib.patches import Patch
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
-import time
 import utm
 import math as m
 from pathlib import Path
 from shapely.geometry import Polygon, Point
 from evaluation.evaluator import Evaluator
+from section_evaluation.section_engine import SectionEngine, SectionResults, select_sections, DEFAULT_QUERY_BATCH_SIZE
 import cartopy.crs as ccrs
 import cartopy.io.img_tiles as cimgt
 from cartopy.feature import ShapelyFeature
@@ -27,7 +25,8 @@ class SectionEvaluator:
                  display_results_only: bool,
                  error_margin: float,
                  all_sections: bool,
-                 sections_id: list = []):
+                 sections_id: list = [],
+                 batch_size: int = DEFAULT_QUERY_BATCH_SIZE):
         plt.rcParams["figure.figsize"] = [32, 32]
         plt.rcParams["figure.autolayout"] = True
         self.__distance_limit = 20
@@ -41,29 +40,9 @@ class SectionEvaluator:
         self.__N = 20
         self.__polygon = polygon
         self.__section_size = section_size
-        
-        if (self.__all_sections):
-            self.__sections = [section for section in test_input_path.joinpath("queries").iterdir()]
-        else:
-            unique_sections_id = self.__remove_duplicates_of_lists( list=sections_id )
-            self.__sections = []
-            for section_id in unique_sections_id:
-                self.__sections.append([section for section in test_input_path.joinpath("queries").glob("*_" + str(section_id))])
-            self.__sections = [section for sublist in self.__sections for section in sublist]
-
-    def __remove_duplicates_of_lists(self,
-                                       list: list) -> list:
-        list_of_unique_elements = []
-        for element in list:
-            if element not in list_of_unique_elements:
-                list_of_unique_elements.append(element)
-        return list_of_unique_elements
+        self.__batch_size = batch_size
+        self.__sections = select_sections(test_input_path, all_sections, sections_id)
     
-    def __get_coordinates_from_image(self,
-                                       image_path: Path) -> list:
-        coordinates = image_path.stem.split("@")
-        return [ float(coordinates[1]), float(coordinates[2]) ]
-         
     def __compute_distance(self,
                              marker_truth,
                              marker_prediction):
@@ -194,17 +173,6 @@ class SectionEvaluator:
         self.__plot_markers(point_truth, point_prediction)
         self.__display_distance_box(point_truth, point_prediction, distance, colors)
     
-    def __compute_average(self,
-                          list):
-        average = 0
-        for value in list:
-            average += value
-        return round(average / len(list), 2)
-    
-    def __get_section_id_from_path(self,
-                                   path: Path) -> str:
-        return path.name.split("_")[-1]
-    
     def __generate_dict_of_sections_positions(self,
                                     polygon: Polygon) -> dict:
         sections_dict = dict()
@@ -238,67 +206,40 @@ class SectionEvaluator:
                           markersize=10, label='Prediction')
         plot.legend(handles=[truth_legend, prediction_legend], prop={'size':40})
     
-    def __evaluate_section(self,
-                           fig,
-                           plot,
-                           proportions_dict,
-                           all_distances_list,
-                           all_times_list,
-                           position_from_id,
-                           section,
-                           good_prediction_counter,
-                           times_for_a_section,
-                           distances):
-        for image in section.iterdir():
-            point_truth = self.__get_coordinates_from_image(image)
-            
-            # Prediction work
-            pre_prediction = time.time()
-            prediction = self.__evaluator.evaluate(image)
-            post_prediction = time.time()
-            point_prediction = [ prediction['GPS_utm'].x, prediction['GPS_utm'].y ]
-            # End of prediction work
-            
-            times_for_a_section.append(post_prediction - pre_prediction)
-            distance = self.__compute_distance(point_truth, point_prediction)
-            distances.append( distance )
-            
-            if ( self.__display_results_only is False ):
-                points_x, points_y, colors = self.__get_distance_line(point_truth, point_prediction)
-                self.__display_markers_and_distance_line(point_truth=point_truth,
-                                                        point_prediction=point_prediction,
-                                                        points_x=points_x,
-                                                        points_y=points_y,
-                                                        distance=distance,
-                                                        colors=colors)
-        for distance in distances:
-            if distance < self.__error_margin:
-                good_prediction_counter = good_prediction_counter + 1
-            all_distances_list.append( distance )
-        average_time = self.__compute_average(list=times_for_a_section)
-        all_times_list.append( average_time )
-        if ( self.__display_results_only ):
-            proportions_dict[self.__get_section_id_from_path(path=section)] = [ good_prediction_counter, len(distances) - good_prediction_counter ]
-            self.__display_time_box(position=position_from_id, 
-                                    time=average_time)
-       
-    def display(self) -> None:
-        sections_paths = [section for section in self.__sections]
+    def evaluate(self) -> SectionResults:
+        """Headless evaluation of the selected sections with batched forward passes and searches, timed per batch, see SectionEngine."""
+        return SectionEngine(self.__evaluator, self.__error_margin, self.__batch_size).run(self.__sections)
+
+    def display(self, results: SectionResults = None) -> None:
+        """Draw results on the map of the polygon, they are computed with evaluate if None, nothing is evaluated while drawing."""
+        if ( results is None ):
+            results = self.evaluate()
         sections_positions_from_id = self.__generate_dict_of_sections_positions(polygon=self.__polygon)
         
         proj_utm = ccrs.UTM(self.__zone_number, southern_hemisphere=(self.__zone_letter < "N"))
         fig, plot = plt.subplots(subplot_kw={'projection': proj_utm})
         
         proportions_dict = dict()
-        all_distances_list = []
-        all_times_list = []
         
         self.__display_polygon(polygon=self.__polygon, map=plot, proj_utm=proj_utm)
         
-        with ThreadPoolExecutor() as executor:
-            tasks = [executor.submit(self.__evaluate_section, fig, plot, proportions_dict, all_distances_list, all_times_list, sections_positions_from_id[self.__get_section_id_from_path(path=section)], section, 0, [], []) for section in sections_paths]
-            for task in tqdm(as_completed(tasks), total=len(tasks), miniters=1, desc="Evaluated sections", unit="sections", leave=True):
-                task.done()
+        for section_id in results.section_ids:
+            section_summary = results.section_summary(section_id)
+            if ( self.__display_results_only is False ):
+                for row in results.section_rows(section_id):
+                    point_truth = results.truths[row].tolist()
+                    point_prediction = results.predictions[row].tolist()
+                    points_x, points_y, colors = self.__get_distance_line(point_truth, point_prediction)
+                    self.__display_markers_and_distance_line(point_truth=point_truth,
+                                                            point_prediction=point_prediction,
+                                                            points_x=points_x,
+                                                            points_y=points_y,
+                                                            distance=results.distances[row],
+                                                            colors=colors)
+            elif ( section_summary["images"] > 0 ):
+                proportions_dict[section_id] = [ section_summary["good"], section_summary["bad"] ]
+                self.__display_time_box(position=sections_positions_from_id[section_id], 
+                                        time=section_summary["ms_per_image"] / 1000)
         for section_id in list(proportions_dict.keys()):
             self.__display_pie_chart(proportions=proportions_dict[section_id],
                             position=sections_positions_from_id[section_id],
@@ -308,6 +249,7 @@ class SectionEvaluator:
         else:
             self.__generate_markers_legends(plot=plot)
         plt.show()
+        all_summary = results.summary()["all"]
         print("")
-        print("Average of all distances:", self.__compute_average( all_distances_list ), "m")
-        print("Average of all times:", self.__compute_average( all_times_list ), "sec")
\ No newline at end of file
+        print("Average of all distances:", round(all_summary.get("mean_distance_m", float("nan")), 2), "m")
+        print("Average of all times:", round(all_summary.get("ms_per_image", float("nan")) / 1000, 3), "sec per image")
\ No newline at end of file
@@ -0,0 +1,60 @@
+import argparse
+from pathlib import Path
+from typing import *
+from evaluation.args_parser import add_evaluator_arguments
+
+def args_parser() -> Dict[str, any]:
+    parser = argparse.ArgumentParser(
+        prog="argparse, args_parser.py",
+        description="Args parser for the localization server",
+    )
+    add_evaluator_arguments(parser)
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address the server listens on"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        help="Port the server listens on"
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=32,
+        help="Maximum number of requests evaluated in a single forward pass and FAISS search"
+    )
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        default=5.0,
+        help="Maximum time a request waits for other requests to fill its batch, in milliseconds"
+    )
+    parser.add_argument(
+        "--decode_workers",
+        type=int,
+        default=4,
+        help="Threads decoding the request images, off the event loop"
+    )
+    parser.add_argument(
+        "--max_body_mb",
+        type=float,
+        default=20.0,
+        help="Maximum size of a request body, in MiB"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of server processes, with more than 1 the index is saved once and memory-mapped by every worker"
+    )
+    parser.add_argument(
+        "--index_folder",
+        type=Path,
+        default=None,
+        help="Where to save the index shared by the workers, if None next to the database folder (<database>.index)"
+    )
+    return vars(parser.parse_args())
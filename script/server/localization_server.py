@@ -0,0 +1,209 @@
+import os
+import json
+import math
+import time
+import asyncio
+import binascii
+from typing import Dict, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from PIL import UnidentifiedImageError
+from server.micro_batcher import MicroBatcher
+
+REASONS = {200 : "OK", 400 : "Bad Request", 404 : "Not Found", 405 : "Method Not Allowed", 411 : "Length Required", 413 : "Payload Too Large", 500 : "Internal Server Error", 501 : "Not Implemented"}
+
+class HTTPError(Exception):
+    def __init__(self, status : int, message : str):
+        super().__init__(message)
+        self.status = status
+
+
+def json_safe(coordinates : list) -> list:
+    """NaN (no neighbour with coordinates) is not valid JSON, it is sent as null."""
+    return [None if math.isnan(value) else value for value in coordinates]
+
+
+class LocalizationServer():
+    def __init__(self, batcher : MicroBatcher, host : str = "127.0.0.1", port : int = 8080, decode_workers : int = 4, max_body_mb : float = 20.0, reuse_port : bool = False):
+        """Minimal HTTP/1.1 server answering localization requests through a MicroBatcher.
+
+        Routes:
+            POST /localize: body is the raw image (image/jpeg, image/png, application/octet-stream),
+                its base64 (text/plain) or a JSON {"image": base64}. Answers {"GPS_utm": [east, north], "GPS_lonlat": [lon, lat]}.
+            GET /health: size of the database, requests (all of them, batched_requests without the result cache hits) and batching counters.
+            GET /metrics: stage latencies and counters of the Evaluator (see StageMetrics) in Prometheus text format.
+
+        Bodies are read with their Content-Length (411 without one, 501 for a Transfer-Encoding), an "Expect: 100-continue"
+        request gets its interim 100 Continue once its headers are accepted.
+        With reuse_port several worker processes listen on the same port and the kernel balances the connections.
+        """
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self.max_body_size = int(max_body_mb * 1024 * 1024)
+        self.reuse_port = reuse_port
+        # Every /localize request, answered from the result cache or by the batcher
+        self.number_of_requests = 0
+        self.__decode_executor = ThreadPoolExecutor(max_workers=max(1, decode_workers), thread_name_prefix="decode")
+        self.__server : asyncio.AbstractServer = None
+    
+    async def start(self):
+        self.batcher.start()
+        self.__server = await asyncio.start_server(self.__handle_connection, self.host, self.port, reuse_port=self.reuse_port or None)
+        self.port = self.__server.sockets[0].getsockname()[1]
+        print(f"Localization server listening on http://{self.host}:{self.port}")
+    
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.__server.serve_forever()
+        finally:
+            await self.stop()
+    
+    async def stop(self):
+        if ( self.__server is not None ):
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+        await self.batcher.stop()
+        self.__decode_executor.shutdown(wait=True)
+    
+    async def __read_request(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter) -> Tuple[str, str, Dict[str, str], bytes]:
+        request_line = await reader.readline()
+        if ( not request_line ):
+            return None
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = dict()
+        while ( True ):
+            line = await reader.readline()
+            if ( line in (b"\r\n", b"\n", b"") ):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if ( headers.get("transfer-encoding", "identity").lower() != "identity" ):
+            raise HTTPError(501, f"Transfer-Encoding : {headers['transfer-encoding']} is not supported, send a Content-Length")
+        if ( method == "POST" and "content-length" not in headers ):
+            raise HTTPError(411, "POST needs a Content-Length")
+        try:
+            content_length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, f"Invalid Content-Length : {headers['content-length']}")
+        if ( content_length < 0 ):
+            raise HTTPError(400, f"Invalid Content-Length : {content_length}")
+        if ( content_length > self.max_body_size ):
+            raise HTTPError(413, f"Body larger than {self.max_body_size} bytes")
+        # Clients like curl wait for it before sending a large body
+        if ( headers.get("expect", "").lower() == "100-continue" and content_length > 0 ):
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+        body = await reader.readexactly(content_length) if content_length > 0 else b""
+        return method, target.split("?", 1)[0], headers, body
+    
+    def __image_of(self, headers : Dict[str, str], body : bytes) -> Tuple[object, bool]:
+        content_type = headers.get("content-type", "application/octet-stream").split(";")[0].strip().lower()
+        if ( content_type == "application/json" ):
+            try:
+                return json.loads(body)["image"], True
+            except (ValueError, KeyError, TypeError):
+                raise HTTPError(400, 'JSON body must be {"image": base64}')
+        if ( content_type.startswith("text/") ):
+            return body.decode("ascii", errors="ignore").strip(), True
+        return body, False
+    
+    async def __localize(self, headers : Dict[str, str], body : bytes) -> dict:
+        self.number_of_requests += 1
+        if ( len(body) == 0 ):
+            raise HTTPError(400, "Empty body")
+        start = time.perf_counter()
+        image, is_base64 = self.__image_of(headers, body)
+        loop = asyncio.get_running_loop()
+        evaluator = self.batcher.evaluator
+        try:
+            # Re-sent images are answered from the result cache, before decoding
+            digest, prediction = await loop.run_in_executor(self.__decode_executor, evaluator.cached_prediction, image, is_base64)
+            if ( prediction is not None ):
+                evaluator.metrics.observe("request", time.perf_counter() - start)
+                return {key : json_safe(coordinates.tolist()) for key, coordinates in prediction.items()}
+            normalized_img = await loop.run_in_executor(self.__decode_executor, evaluator.normalized_image, image, is_base64)
+        except (UnidentifiedImageError, binascii.Error, OSError, ValueError) as error:
+            raise HTTPError(400, f"Cannot decode the image: {error}")
+        prediction = await self.batcher.submit(normalized_img)
+        evaluator.cache_prediction(digest, prediction)
+        evaluator.metrics.observe("request", time.perf_counter() - start)
+        return {key : json_safe(coordinates) for key, coordinates in prediction.items()}
+    
+    def __health(self) -> dict:
+        return {
+            "status" : "ok",
+            "pid" : os.getpid(),
+            "database_size" : len(self.batcher.evaluator.database_index),
+            # False while a background extraction (--background_extraction) is still filling the index
+            "extraction_done" : self.batcher.evaluator.extraction_done.is_set(),
+            "requests" : self.number_of_requests,
+            "batched_requests" : self.batcher.number_of_requests,
+            "batches" : self.batcher.number_of_batches,
+            "result_cache" : self.batcher.evaluator.result_cache.stats() if self.batcher.evaluator.result_cache is not None else None,
+        }
+    
+    def __metrics(self) -> str:
+        metrics = self.batcher.evaluator.metrics.prometheus()
+        metrics += "# TYPE server_requests_total counter\n"
+        metrics += f"server_requests_total {self.number_of_requests}\n"
+        metrics += "# TYPE server_batched_requests_total counter\n"
+        metrics += f"server_batched_requests_total {self.batcher.number_of_requests}\n"
+        metrics += "# TYPE server_batches_total counter\n"
+        metrics += f"server_batches_total {self.batcher.number_of_batches}\n"
+        return metrics
+    
+    async def __route(self, method : str, path : str, headers : Dict[str, str], body : bytes) -> Union[dict, str]:
+        routes = {"/localize" : "POST", "/health" : "GET", "/metrics" : "GET"}
+        if ( path not in routes ):
+            raise HTTPError(404, f"Unknown route {path}")
+        if ( method != routes[path] ):
+            raise HTTPError(405, f"{path} only accepts {routes[path]}")
+        if ( path == "/health" ):
+            return self.__health()
+        if ( path == "/metrics" ):
+            return self.__metrics()
+        return await self.__localize(headers, body)
+    
+    @staticmethod
+    async def __write_response(writer : asyncio.StreamWriter, status : int, content : Union[dict, str], keep_alive : bool):
+        # Text content is the Prometheus exposition of /metrics, everything else is JSON
+        if ( isinstance(content, str) ):
+            body, content_type = content.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(content).encode(), "application/json"
+        head = f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+    
+    async def __handle_connection(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        try:
+            while ( True ):
+                keep_alive = False
+                try:
+                    request = await self.__read_request(reader, writer)
+                    if ( request is None ):
+                        break
+                    method, path, headers, body = request
+                    keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+                    status, content = 200, await self.__route(method, path, headers, body)
+                except HTTPError as error:
+                    status, content = error.status, {"error" : str(error)}
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as error:
+                    status, content = 500, {"error" : f"{type(error).__name__}: {error}"}
+                await self.__write_response(writer, status, content, keep_alive)
+                if ( not keep_alive ):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    def __repr__(self):
+        return f"< LocalizationServer - http://{self.host}:{self.port} - {self.batcher} >"
@@ -0,0 +1,85 @@
+import asyncio
+import torch
+from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from evaluation.evaluator import Evaluator
+
+class MicroBatcher():
+    def __init__(self, evaluator : Evaluator, max_batch_size : int = 32, max_wait_ms : float = 5.0):
+        """Group concurrent requests into batches evaluated with one forward pass and one FAISS search.
+
+        A batch is closed when it holds max_batch_size images or when its first image has waited
+        max_wait_ms, so the latency added to a request is bounded by max_wait_ms plus one batch.
+        The model runs in a single dedicated thread, never on the event loop.
+        """
+        self.evaluator = evaluator
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.number_of_batches = 0
+        self.number_of_requests = 0
+        self.__queue : asyncio.Queue = None
+        self.__task : asyncio.Task = None
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+    
+    def start(self):
+        """Start the batching loop, must be called from the running event loop."""
+        self.__queue = asyncio.Queue()
+        self.__task = asyncio.get_running_loop().create_task(self.__run())
+    
+    async def stop(self):
+        if ( self.__task is not None ):
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+        self.__executor.shutdown(wait=True)
+    
+    async def submit(self, normalized_img : torch.Tensor) -> Dict[str, List[float]]:
+        """Queue an image decoded by get_normalized_image (or Evaluator.normalized_image) and wait for its prediction."""
+        if ( self.__task is None ):
+            raise RuntimeError("MicroBatcher is not started")
+        future = asyncio.get_running_loop().create_future()
+        await self.__queue.put((normalized_img, future))
+        return await future
+    
+    async def __next_batch(self) -> List[Tuple[torch.Tensor, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.__queue.get()]
+        deadline = loop.time() + self.max_wait
+        while ( len(batch) < self.max_batch_size ):
+            if ( not self.__queue.empty() ):
+                batch.append(self.__queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if ( timeout <= 0 ):
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.__queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        while ( True ):
+            batch = await self.__next_batch()
+            batch = [(normalized_img, future) for normalized_img, future in batch if not future.cancelled()]
+            if ( len(batch) == 0 ):
+                continue
+            try:
+                prediction = await loop.run_in_executor(self.__executor, self.evaluator.evaluate_normalized, [normalized_img for normalized_img, _ in batch], len(batch))
+            except Exception as error:
+                for _, future in batch:
+                    if ( not future.done() ):
+                        future.set_exception(error)
+                continue
+            self.number_of_batches += 1
+            self.number_of_requests += len(batch)
+            for row, (_, future) in enumerate(batch):
+                if ( not future.done() ):
+                    future.set_result({key : coordinates[row].tolist() for key, coordinates in prediction.items()})
+    
+    def __repr__(self):
+        return f"< MicroBatcher - {self.number_of_requests} requests in {self.number_of_batches} batches >"
@@ -0,0 +1,82 @@
+import os
+import json
+import torch
+import asyncio
+import multiprocessing
+from pathlib import Path
+from typing import Dict, List
+from evaluation.evaluator import Evaluator
+from evaluation.partitioned_index import load_database_index
+from evaluation.model_loader import load_model, apply_inference_precision, result_cache_from_args, stage_metrics_from_args
+from evaluation.model_export import load_model_backend
+from server.micro_batcher import MicroBatcher
+from server.localization_server import LocalizationServer
+
+CALIBRATION_FILE = "calibration.json"
+
+def save_calibration_paths(index_folder : Path, calibration_paths : List[Path]):
+    """Images the parent process calibrated int8 on, the workers calibrate on the same ones."""
+    index_folder.joinpath(CALIBRATION_FILE).write_text(json.dumps([str(image_path) for image_path in calibration_paths]))
+
+def load_calibration_paths(index_folder : Path) -> List[Path]:
+    calibration_file = index_folder.joinpath(CALIBRATION_FILE)
+    if ( not calibration_file.exists() ):
+        return []
+    return [Path(image_path) for image_path in json.loads(calibration_file.read_text())]
+
+def run_worker(args : Dict[str, any], index_folder : Path, torch_threads : int):
+    """Entry point of a worker process: own model, shared read-only index, own server on the shared port."""
+    torch.set_num_threads(torch_threads)
+    database_index = load_database_index(index_folder, mmap=True)
+    if ( args["model_backend"] == "eager" ):
+        model = load_model(args)
+    else:
+        # The artifact was already checked against the eager model by the parent process
+        model = load_model_backend(args["model_backend"], args["model_artifact"], args["device"])
+    # Calibrated on the images of the parent process, the queries are quantized like the database descriptors
+    model = apply_inference_precision(args, model, report=False, calibration_paths=load_calibration_paths(index_folder))
+    evaluator = Evaluator(None, model, infer_batch_size=args["infer_batch_size"], num_workers=args["num_workers"], device=args["device"], fc_output_dim=args["fc_output_dim"], database_index=database_index, result_cache=result_cache_from_args(args), metrics=stage_metrics_from_args(args))
+    batcher = MicroBatcher(evaluator, max_batch_size=args["max_batch_size"], max_wait_ms=args["max_wait_ms"])
+    server = LocalizationServer(batcher, host=args["host"], port=args["port"], decode_workers=args["decode_workers"], max_body_mb=args["max_body_mb"], reuse_port=True)
+    print(f"Worker {os.getpid()} : {database_index}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerPool():
+    def __init__(self, args : Dict[str, any], index_folder : Path, number_of_workers : int):
+        """Server processes sharing one DatabaseIndex saved in index_folder.
+
+        Each worker runs its own model inference, the FAISS index and the metadata columns are memory-mapped
+        read-only, so the database costs its size once in the page cache and not once per worker.
+        Workers are spawned, not forked, so they never inherit the threads of the parent.
+        """
+        if ( args["port"] == 0 ):
+            raise ValueError("Workers need a fixed --port to share it")
+        self.__args = args
+        self.__index_folder = index_folder
+        self.number_of_workers = number_of_workers
+        self.__processes : List[multiprocessing.Process] = []
+    
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        torch_threads = max(1, (os.cpu_count() or 1) // self.number_of_workers)
+        for worker in range(self.number_of_workers):
+            process = context.Process(target=run_worker, args=(self.__args, self.__index_folder, torch_threads), name=f"localization-worker-{worker}", daemon=True)
+            process.start()
+            self.__processes.append(process)
+    
+    def join(self):
+        for process in self.__processes:
+            process.join()
+    
+    def stop(self):
+        for process in self.__processes:
+            process.terminate()
+        self.join()
+        self.__processes = []
+    
+    def __repr__(self):
+        return f"< WorkerPool - {self.number_of_workers} workers - {self.__index_folder} >"
@@ -0,0 +1,63 @@
+import sys
+import shutil
+from PIL import Image
+from pathlib import Path
+
+# The scripts import their packages relative to script/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from util.catalog import ImageCatalog, find_catalog
+from evaluation.database_loader import DatabaseLoaderPIL
+
+def save_processed_image(folder : Path, index : int) -> Path:
+    folder.mkdir(parents=True, exist_ok=True)
+    image_path = folder.joinpath(f"@{500000 + index}.0@{5000000 + index}.0@10@S@-0.36@49.18@IMG_{index:04d}_0@@{index % 4 * 90}@@@@@@.jpg")
+    Image.new("RGB", (8, 8)).save(image_path)
+    return image_path
+
+def make_dataset(root : Path) -> Path:
+    for index in range(6):
+        save_processed_image(root, index)
+    catalog = ImageCatalog(root)
+    assert catalog.refresh() == {"added" : 6, "moved" : 0, "removed" : 0}
+    return catalog
+
+def test_refresh_updates_moved_images_without_parsing_them(tmp_path):
+    catalog = make_dataset(tmp_path)
+    database_folder = tmp_path.joinpath("test", "database")
+    database_folder.mkdir(parents=True)
+    for image_path in sorted(tmp_path.glob("*.jpg"))[:4]:
+        shutil.move(image_path, database_folder.joinpath(image_path.name))
+    sorted(tmp_path.glob("*.jpg"))[0].unlink()
+    assert catalog.refresh() == {"added" : 0, "moved" : 4, "removed" : 1}
+    datas = catalog.load(split="test/database", columns=["path", "utm_east", "heading"])
+    assert len(datas["path"]) == 4
+    assert sorted(datas["utm_east"].tolist()) == [500000.0, 500001.0, 500002.0, 500003.0]
+    image_paths, _ = catalog.load_images(database_folder)
+    assert image_paths == sorted(database_folder.rglob("*.jpg"))
+
+def test_readers_check_freshness_without_writing(tmp_path):
+    make_dataset(tmp_path)
+    database_folder = tmp_path.joinpath("test", "database")
+    for index in range(6, 9):
+        save_processed_image(database_folder, index)
+    other_folder = tmp_path.joinpath("test", "queries")
+    save_processed_image(other_folder, 9)
+    catalog = ImageCatalog(tmp_path)
+    catalog.refresh()
+    catalog_mtime = catalog.catalog_path.stat().st_mtime_ns
+    assert find_catalog(database_folder) is not None
+    assert DatabaseLoaderPIL(database_folder).coordinates is not None
+    # A change elsewhere under the root does not invalidate the folder
+    save_processed_image(other_folder, 10)
+    assert find_catalog(database_folder) is not None
+    assert find_catalog(tmp_path) is None
+    # An image added under the folder since the last refresh: the loader scans the folder
+    added_path = save_processed_image(database_folder, 11)
+    assert find_catalog(database_folder) is None
+    database = DatabaseLoaderPIL(database_folder)
+    assert database.coordinates is None
+    assert added_path in database.database_paths and len(database) == 4
+    assert catalog.catalog_path.stat().st_mtime_ns == catalog_mtime
+    assert find_catalog(database_folder, refresh=True) is not None
+    assert len(catalog.load(database_folder)["path"]) == 4
@@ -0,0 +1,69 @@
+import sys
+import threading
+import numpy as np
+from pathlib import Path
+
+# The scripts import their packages relative to script/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from evaluation.database_index import DatabaseIndex
+
+def unit_vectors(number : int, dim : int, seed : int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((number, dim)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def test_remove_and_compact_with_pca_and_rerank():
+    descriptors = unit_vectors(500, 128)
+    image_paths = [Path(f"{row}.jpg") for row in range(len(descriptors))]
+    database_index = DatabaseIndex(128, index_type="hnsw", pca_dim=64, rerank_k=10)
+    database_index.train(descriptors)
+    database_index.add(image_paths, descriptors, (np.zeros((len(descriptors), 2)), np.zeros((len(descriptors), 2))))
+    removed_paths = image_paths[:50]
+    assert database_index.remove(removed_paths, compact=False) == 50
+    database_index.compact()
+    assert len(database_index) == 450
+    _, ids = database_index.search(descriptors[50:60], 1)
+    assert [str(image_path) for image_path in database_index.paths_of(ids[:, 0])] == [str(image_path) for image_path in image_paths[50:60]]
+    _, ids = database_index.search(descriptors[:10], 5)
+    assert not set(str(image_path) for image_path in database_index.paths_of(ids.ravel())) & set(str(image_path) for image_path in removed_paths)
+
+def test_hnsw_trains_every_encoding_on_a_small_database():
+    # Fewer descriptors than the 256 centroids of an 8 bits product quantizer
+    descriptors = unit_vectors(60, 128)
+    image_paths = [Path(f"{row}.jpg") for row in range(len(descriptors))]
+    for encoding in ["float32", "fp16", "sq8", "pq"]:
+        database_index = DatabaseIndex(128, index_type="hnsw", encoding=encoding, pq_m=16)
+        database_index.train(descriptors)
+        database_index.add(image_paths, descriptors, (np.zeros((len(descriptors), 2)), np.zeros((len(descriptors), 2))))
+        _, ids = database_index.search(descriptors[:5], 1)
+        assert len(database_index) == 60 and ids.shape == (5, 1)
+
+def test_searches_and_removals_go_on_during_compaction(monkeypatch):
+    descriptors = unit_vectors(500, 128)
+    image_paths = [Path(f"{row}.jpg") for row in range(len(descriptors))]
+    database_index = DatabaseIndex(128, index_type="hnsw", rerank_k=10)
+    database_index.train(descriptors)
+    database_index.add(image_paths, descriptors, (np.zeros((len(descriptors), 2)), np.zeros((len(descriptors), 2))))
+    # The rebuild waits until the test has searched and removed images
+    rebuilding, resume, resumed = threading.Event(), threading.Event(), []
+    rebuild_without = DatabaseIndex._DatabaseIndex__rebuild_without
+    def blocked_rebuild_without(self, *args):
+        rebuilding.set()
+        resumed.append(resume.wait(5))
+        return rebuild_without(self, *args)
+    monkeypatch.setattr(DatabaseIndex, "_DatabaseIndex__rebuild_without", blocked_rebuild_without)
+    database_index.remove(image_paths[:50], compact=False)
+    compaction_thread = database_index.compact_in_background()
+    assert rebuilding.wait(10)
+    _, ids = database_index.search(descriptors[60:61], 1)
+    assert database_index.paths_of(ids[:, 0]) == [image_paths[60]]
+    assert database_index.remove(image_paths[50:60], compact=False) == 10
+    resume.set()
+    compaction_thread.join()
+    assert resumed == [True]
+    assert len(database_index) == 440
+    assert image_paths[55] not in database_index
+    _, ids = database_index.search(descriptors[50:60], 1)
+    assert not set(database_index.paths_of(ids.ravel())) & set(image_paths[:60])
+    database_index.compact()
+    assert len(database_index) == 440 and len(database_index.paths) == 440
@@ -0,0 +1,121 @@
+import os
+import sys
+import torch
+import numpy as np
+from pathlib import Path
+
+# The scripts import their packages relative to script/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from evaluation.descriptor_store import DescriptorStore, ShardedDescriptors, model_fingerprint, read_store, shard_path
+
+def make_images(folder : Path, number : int) -> list:
+    folder.mkdir(parents=True, exist_ok=True)
+    image_paths = []
+    for index in range(number):
+        image_path = folder.joinpath(f"{index:03d}.jpg")
+        image_path.write_bytes(bytes([index]) * 16)
+        image_paths.append(image_path)
+    return image_paths
+
+def extract(store : DescriptorStore, image_paths : list, descriptors : np.ndarray) -> np.ndarray:
+    """What the Evaluator does: fill the invalid rows, save, return the valid mask of the lookup."""
+    stored, is_valid = store.lookup(image_paths)
+    rows = np.flatnonzero(~is_valid)
+    stored[rows] = descriptors[rows]
+    store.save(image_paths, stored)
+    return is_valid
+
+def test_store_is_reused_and_updated_per_image(tmp_path):
+    database_folder = tmp_path.joinpath("database")
+    image_paths = make_images(database_folder, 10)
+    descriptors = np.random.default_rng(0).standard_normal((10, 8)).astype("float32")
+    assert not extract(DescriptorStore(database_folder, "model", 8), image_paths, descriptors).any()
+    store = DescriptorStore(database_folder, "model", 8)
+    stored, is_valid = store.lookup(image_paths)
+    assert is_valid.all() and not store.is_stale
+    np.testing.assert_array_equal(stored[np.arange(10)], descriptors)
+    # A modified image and a new one are extracted again, the other rows are copied from the store
+    image_paths[3].write_bytes(b"modified")
+    os.utime(image_paths[3], ns=(0, 0))
+    image_paths.append(database_folder.joinpath("new.jpg"))
+    image_paths[-1].write_bytes(b"new")
+    descriptors = np.concatenate((descriptors, np.ones((1, 8), dtype="float32")))
+    is_valid = extract(DescriptorStore(database_folder, "model", 8), image_paths, descriptors)
+    assert is_valid.tolist() == [True] * 3 + [False] + [True] * 6 + [False]
+    stored, is_valid = DescriptorStore(database_folder, "model", 8).lookup(image_paths)
+    assert is_valid.all()
+    np.testing.assert_array_equal(stored[np.arange(11)], descriptors)
+
+def test_another_model_invalidates_the_store(tmp_path):
+    database_folder = tmp_path.joinpath("database")
+    image_paths = make_images(database_folder, 5)
+    extract(DescriptorStore(database_folder, "model", 8), image_paths, np.zeros((5, 8), dtype="float32"))
+    assert not DescriptorStore(database_folder, "other model", 8).lookup(image_paths)[1].any()
+    assert not DescriptorStore(database_folder, "model", 16).lookup(image_paths)[1].any()
+
+def test_model_fingerprint():
+    torch.manual_seed(0)
+    model = torch.nn.Linear(4, 2)
+    fingerprint = model_fingerprint(model, "ResNet18", 2)
+    assert fingerprint == model_fingerprint(model, "ResNet18", 2)
+    assert fingerprint != model_fingerprint(model, "ResNet50", 2)
+    assert fingerprint != model_fingerprint(model, "ResNet18", 2, backend="torchscript")
+    assert fingerprint != model_fingerprint(model, "ResNet18", 2, precision="int8")
+    with torch.no_grad():
+        model.weight[0, 0] += 1e-3
+    assert fingerprint != model_fingerprint(model, "ResNet18", 2)
+
+def test_sharded_descriptors_across_shards(tmp_path):
+    descriptors = np.random.default_rng(0).standard_normal((10, 8)).astype("float32")
+    sharded = ShardedDescriptors.create(tmp_path, 10, 8, shard_size=4)
+    assert [len(shard) for shard in sharded.shards] == [4, 4, 2] and sharded.shape == (10, 8)
+    sharded[np.array([9, 0, 5, 3])] = descriptors[[9, 0, 5, 3]]
+    sharded[np.array([1, 2, 4, 6, 7, 8])] = descriptors[[1, 2, 4, 6, 7, 8]]
+    np.testing.assert_array_equal(sharded[2:7], descriptors[2:7])
+    np.testing.assert_array_equal(sharded[np.array([8, 1])], descriptors[[8, 1]])
+    assert [start for start, _ in sharded.iter_shards()] == [0, 4, 8]
+    sharded.close()
+    # Each shard is a plain .npy file, opened again memory-mapped
+    np.testing.assert_array_equal(np.load(shard_path(tmp_path, 1)), descriptors[4:8])
+    reopened = ShardedDescriptors.open(tmp_path, 4, 8)
+    assert all(isinstance(shard, np.memmap) for shard in reopened.shards)
+    np.testing.assert_array_equal(reopened[np.arange(10)], descriptors)
+
+def test_saved_store_is_sharded(tmp_path):
+    database_folder = tmp_path.joinpath("database")
+    image_paths = make_images(database_folder, 10)
+    descriptors = np.random.default_rng(0).standard_normal((10, 8)).astype("float32")
+    store = DescriptorStore(database_folder, "model", 8, shard_size=4)
+    extract(store, image_paths, descriptors)
+    assert len(list(store.store_folder.glob("descriptors_*.npy"))) == 3
+    stored_paths, stored = read_store(store.store_folder)
+    assert stored_paths == [image_path.relative_to(database_folder) for image_path in image_paths]
+    np.testing.assert_array_equal(stored[np.arange(10)], descriptors)
+
+def test_interrupted_extraction_is_resumed(tmp_path):
+    database_folder = tmp_path.joinpath("database")
+    image_paths = make_images(database_folder, 10)
+    descriptors = np.random.default_rng(0).standard_normal((10, 8)).astype("float32")
+    store = DescriptorStore(database_folder, "model", 8, shard_size=4)
+    staged, is_valid = store.lookup(image_paths)
+    assert not is_valid.any()
+    staged[np.arange(6)] = descriptors[:6]
+    store.checkpoint(staged, np.arange(6))
+    staged[6] = descriptors[6] # written but not checkpointed when the process stops
+    # Another model does not resume the staging of this one, it replaces it
+    assert not DescriptorStore(database_folder, "other model", 8, shard_size=4).lookup(image_paths)[1].any()
+    store = DescriptorStore(database_folder, "model", 8, shard_size=4)
+    staged, is_valid = store.lookup(image_paths)
+    assert not is_valid.any()
+    staged[np.arange(6)] = descriptors[:6]
+    store.checkpoint(staged, np.arange(6))
+    store = DescriptorStore(database_folder, "model", 8, shard_size=4)
+    staged, is_valid = store.lookup(image_paths)
+    assert is_valid.tolist() == [True] * 6 + [False] * 4
+    np.testing.assert_array_equal(staged[np.arange(6)], descriptors[:6])
+    staged[np.arange(6, 10)] = descriptors[6:]
+    store.save(image_paths, staged)
+    stored, is_valid = DescriptorStore(database_folder, "model", 8, shard_size=4).lookup(image_paths)
+    assert is_valid.all()
+    np.testing.assert_array_equal(stored[np.arange(10)], descriptors)
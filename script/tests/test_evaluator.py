@@ -0,0 +1,66 @@
+import sys
+import torch
+import pytest
+import numpy as np
+from PIL import Image
+from pathlib import Path
+
+# The scripts import their packages relative to script/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from evaluation.database_loader import DatabaseLoaderPIL
+from evaluation.evaluator import Evaluator
+from evaluation.result_cache import ResultCache
+
+def save_processed_image(folder : Path, index : int) -> Path:
+    """Solid color image named like the preprocessing output, at UTM (500000 + 10 * index, 5000000)."""
+    folder.mkdir(parents=True, exist_ok=True)
+    image_path = folder.joinpath(f"@{500000 + 10 * index}.0@5000000.0@10@S@-0.36@49.18@IMG_{index:04d}_0@@0@@@@@@.jpg")
+    Image.new("RGB", (32, 32), (index * 20, 255 - index * 20, index * 53 % 256)).save(image_path, quality=100)
+    return image_path
+
+def mean_color_model() -> torch.nn.Module:
+    # The descriptor of an image is its mean color, every database image is its own nearest neighbour
+    return torch.nn.Sequential(torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten())
+
+def make_evaluator(database_folder : Path, result_cache : ResultCache = None) -> Evaluator:
+    return Evaluator(DatabaseLoaderPIL(database_folder, use_catalog=False), mean_color_model(), num_workers=0, device="cpu", fc_output_dim=3, descriptor_store=None, result_cache=result_cache)
+
+def test_add_and_remove_images(tmp_path):
+    database_folder = tmp_path.joinpath("database")
+    image_paths = [save_processed_image(database_folder, index) for index in range(8)]
+    evaluator = make_evaluator(database_folder)
+    assert evaluator.evaluate(image_paths[3])["GPS_utm"].x == 500030.0
+    version = evaluator.database_index.version
+    # str paths are accepted, the removed image is no longer predicted
+    assert evaluator.remove_images([str(image_paths[3])]) == 1
+    assert evaluator.database_index.version > version
+    assert image_paths[3] not in evaluator.database_index and len(evaluator.database_index) == 7
+    assert evaluator.evaluate(image_paths[3])["GPS_utm"].x != 500030.0
+    # An unknown path removes nothing
+    with pytest.raises(ValueError):
+        evaluator.remove_images([image_paths[4], tmp_path.joinpath("unknown.jpg")])
+    assert image_paths[4] in evaluator.database_index
+    new_path = save_processed_image(tmp_path.joinpath("new"), 9)
+    assert evaluator.add_images([image_paths[3], new_path]) == 2
+    assert len(evaluator.database_index) == 9
+    assert evaluator.evaluate(image_paths[3])["GPS_utm"].x == 500030.0
+    assert evaluator.evaluate(new_path)["GPS_utm"].x == 500090.0
+    # Compaction keeps the live images and their coordinates
+    evaluator.remove_images(image_paths[:2])
+    evaluator.database_index.compact()
+    assert len(evaluator.database_index) == 7 and len(evaluator.database_index.paths) == 7
+    assert [evaluator.evaluate(image_path)["GPS_utm"].x for image_path in image_paths[2:]] == [500000.0 + 10 * index for index in range(2, 8)]
+
+def test_result_cache_follows_the_database_index(tmp_path):
+    database_folder = tmp_path.joinpath("database")
+    image_paths = [save_processed_image(database_folder, index) for index in range(4)]
+    result_cache = ResultCache()
+    evaluator = make_evaluator(database_folder, result_cache)
+    assert evaluator.evaluate(image_paths[1])["GPS_utm"].x == 500010.0
+    assert evaluator.evaluate(image_paths[1])["GPS_utm"].x == 500010.0
+    assert result_cache.stats()["hits"] == 1
+    # Removing the image changes the index version, the cached prediction is not served
+    evaluator.remove_images([image_paths[1]])
+    assert evaluator.evaluate(image_paths[1])["GPS_utm"].x != 500010.0
+    assert result_cache.stats()["hits"] == 1 and result_cache.stats()["descriptor_hits"] == 1
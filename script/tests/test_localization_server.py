@@ -0,0 +1,104 @@
+import sys
+import asyncio
+import threading
+import numpy as np
+from pathlib import Path
+
+# The scripts import their packages relative to script/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from evaluation.stage_metrics import StageMetrics
+from server.localization_server import LocalizationServer
+
+class FakeEvaluator():
+    """Evaluator stand-in: every image is at the same place, the cache answers the images starting with b"cached"."""
+    def __init__(self):
+        self.database_index = []
+        self.extraction_done = threading.Event()
+        self.result_cache = None
+        self.metrics = StageMetrics(enabled=False)
+
+    def cached_prediction(self, image : bytes, is_base64 : bool):
+        if ( image.startswith(b"cached") ):
+            return b"digest", {"GPS_utm" : np.array([1.0, 2.0]), "GPS_lonlat" : np.array([3.0, 4.0])}
+        return b"digest", None
+
+    def normalized_image(self, image : bytes, is_base64 : bool):
+        if ( not image.startswith(b"image") ):
+            raise ValueError("not an image")
+        return image
+
+    def cache_prediction(self, digest : bytes, prediction : dict):
+        pass
+
+
+class FakeBatcher():
+    def __init__(self):
+        self.evaluator = FakeEvaluator()
+        self.number_of_requests = 0
+        self.number_of_batches = 0
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def submit(self, normalized_img) -> dict:
+        self.number_of_requests += 1
+        self.number_of_batches += 1
+        return {"GPS_utm" : [5.0, 6.0], "GPS_lonlat" : [7.0, float("nan")]}
+
+
+async def exchange(request_head : bytes, body : bytes = b"", wait_continue : bool = False, max_body_mb : float = 1.0) -> list:
+    """Status lines and last body the server sends back to request_head followed by body."""
+    server = LocalizationServer(FakeBatcher(), port=0, decode_workers=1, max_body_mb=max_body_mb)
+    await server.start()
+    try:
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        writer.write(request_head)
+        statuses = []
+        if ( wait_continue ):
+            # The body is only sent after the interim response, like curl does
+            statuses.append((await asyncio.wait_for(reader.readline(), 2)).decode().strip())
+            await reader.readline()
+        writer.write(body)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 2)
+        writer.close()
+    finally:
+        await server.stop()
+    head, _, response_body = response.partition(b"\r\n\r\n")
+    return statuses + [head.split(b"\r\n")[0].decode()], response_body
+
+def post(body : bytes, extra_headers : str = "") -> bytes:
+    return f"POST /localize HTTP/1.1\r\nHost: test\r\nContent-Type: image/jpeg\r\nContent-Length: {len(body)}\r\nConnection: close\r\n{extra_headers}\r\n".encode()
+
+def test_localize_and_cached_requests():
+    statuses, body = asyncio.run(exchange(post(b"image"), b"image"))
+    assert statuses == ["HTTP/1.1 200 OK"] and body == b'{"GPS_utm": [5.0, 6.0], "GPS_lonlat": [7.0, null]}'
+    statuses, body = asyncio.run(exchange(post(b"cached"), b"cached"))
+    assert statuses == ["HTTP/1.1 200 OK"] and body == b'{"GPS_utm": [1.0, 2.0], "GPS_lonlat": [3.0, 4.0]}'
+
+def test_expect_100_continue():
+    statuses, _ = asyncio.run(exchange(post(b"image", "Expect: 100-continue\r\n"), b"image", wait_continue=True))
+    assert statuses == ["HTTP/1.1 100 Continue", "HTTP/1.1 200 OK"]
+
+def test_rejected_requests():
+    cases = [
+        (b"POST /localize HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n", b"5\r\nimage\r\n0\r\n\r\n", "HTTP/1.1 501 Not Implemented"),
+        (b"POST /localize HTTP/1.1\r\nConnection: close\r\n\r\n", b"", "HTTP/1.1 411 Length Required"),
+        (b"POST /localize HTTP/1.1\r\nContent-Length: ten\r\n\r\n", b"", "HTTP/1.1 400 Bad Request"),
+        (b"POST /localize HTTP/1.1\r\nContent-Length: -1\r\n\r\n", b"", "HTTP/1.1 400 Bad Request"),
+        (b"BROKEN\r\n\r\n", b"", "HTTP/1.1 400 Bad Request"),
+        (post(b"text"), b"text", "HTTP/1.1 400 Bad Request"),
+        (post(b"image").replace(b"/localize", b"/nowhere"), b"image", "HTTP/1.1 404 Not Found"),
+        (b"GET /localize HTTP/1.1\r\nConnection: close\r\n\r\n", b"", "HTTP/1.1 405 Method Not Allowed"),
+    ]
+    for request_head, body, status in cases:
+        assert asyncio.run(exchange(request_head, body))[0] == [status], request_head
+
+def test_body_too_large_is_not_read():
+    # No 100 Continue: the client learns the body is too large before sending it
+    statuses, _ = asyncio.run(exchange(post(b"image" * 1024, "Expect: 100-continue\r\n"), max_body_mb=0.001))
+    assert statuses == ["HTTP/1.1 413 Payload Too Large"]
@@ -0,0 +1,83 @@
+import sys
+import utm
+import threading
+import numpy as np
+from pathlib import Path
+from shapely.geometry import Point, box
+
+# The scripts import their packages relative to script/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from evaluation.partitioned_index import PartitionedIndex
+
+def unit_vectors(number : int, dim : int, seed : int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((number, dim)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def grid_cells(size : int = 4, width : float = 100.0) -> list:
+    return [box(east * width, north * width, (east + 1) * width, (north + 1) * width) for east in range(size) for north in range(size)]
+
+def test_searches_during_a_concurrent_add():
+    # Thread switches as often as possible, so the readers meet the add in the middle
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    descriptors = unit_vectors(2000, 32)
+    image_paths = [Path(f"{row}.jpg") for row in range(len(descriptors))]
+    # Every chunk fills sub-indexes that do not exist yet
+    utm_coordinates = np.random.default_rng(1).uniform(-50, 450, (len(descriptors), 2))
+    headings = np.random.default_rng(2).integers(-1, 360, len(descriptors))
+    partitioned_index = PartitionedIndex(32, grid_cells(10, 50.0), heading_sectors=8)
+    partitioned_index.train(descriptors)
+    errors = []
+    def add_chunks():
+        try:
+            for start in range(0, len(descriptors), 2):
+                rows = slice(start, start + 2)
+                partitioned_index.add(image_paths[rows], descriptors[rows], (utm_coordinates[rows], np.zeros((2, 2))), headings[rows])
+        except Exception as error:
+            errors.append(error)
+    extraction_thread = threading.Thread(target=add_chunks)
+    extraction_thread.start()
+    while ( extraction_thread.is_alive() ):
+        try:
+            _, ids = partitioned_index.search(descriptors[:4], 3)
+            partitioned_index.paths_of(ids)
+            len(partitioned_index), image_paths[0] in partitioned_index, partitioned_index.paths
+        except Exception as error:
+            errors.append(error)
+            break
+    extraction_thread.join()
+    sys.setswitchinterval(switch_interval)
+    assert errors == []
+    assert len(partitioned_index) == len(descriptors)
+    _, ids = partitioned_index.search(descriptors[:4], 1)
+    assert partitioned_index.paths_of(ids[:, 0]) == image_paths[:4]
+
+def test_slots_near_falls_back_when_nothing_is_near():
+    # 4 x 4 cells of 100 m, the images are in the first cell and in the last one, all facing north
+    longitude, latitude = -0.36, 49.18
+    east, north, zone_number, zone_letter = utm.from_latlon(latitude, longitude)
+    def prior_at(east_offset : float, north_offset : float) -> tuple:
+        prior_latitude, prior_longitude = utm.to_latlon(east + east_offset, north + north_offset, zone_number, zone_letter)
+        return Point(prior_longitude, prior_latitude), 20.0
+    cells = [box(east + column * 100, north + row * 100, east + (column + 1) * 100, north + (row + 1) * 100) for column in range(4) for row in range(4)]
+    partitioned_index = PartitionedIndex(32, cells, heading_sectors=4)
+    descriptors = unit_vectors(20, 32)
+    image_paths = [Path(f"{row}.jpg") for row in range(len(descriptors))]
+    utm_coordinates = np.array([[east + 50, north + 50]] * 10 + [[east + 350, north + 350]] * 10)
+    partitioned_index.add(image_paths, descriptors, (utm_coordinates, np.zeros((20, 2))), np.zeros(20))
+    first_slot, last_slot = sorted(partitioned_index.partitions)
+    near_first_cell = prior_at(50, 50)
+    assert partitioned_index.slots_near(near_first_cell) == [first_slot]
+    assert partitioned_index.slots_near(near_first_cell, heading=10.0) == [first_slot]
+    # No image faces south near the prior: the heading is dropped, not the prior
+    assert partitioned_index.slots_near(near_first_cell, heading=180.0) == [first_slot]
+    # No image at all near the prior (an empty cell, then outside every cell): every sub-index
+    assert partitioned_index.slots_near(prior_at(250, 50)) == [first_slot, last_slot]
+    assert partitioned_index.slots_near(prior_at(5000, 5000)) == [first_slot, last_slot]
+    assert partitioned_index.slots_near() == [first_slot, last_slot]
+    # A search with the prior only returns images of the first cell
+    _, ids = partitioned_index.search(descriptors[10:12], 5, priors=[near_first_cell] * 2)
+    assert set(partitioned_index.paths_of(ids.ravel())) <= set(image_paths[:10])
+    _, ids = partitioned_index.search(descriptors[10:12], 1)
+    assert partitioned_index.paths_of(ids[:, 0]) == image_paths[10:12]
@@ -0,0 +1,63 @@
+import sys
+import base64
+import numpy as np
+from pathlib import Path
+
+# The scripts import their packages relative to script/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import evaluation.result_cache as result_cache
+from evaluation.result_cache import ResultCache, image_digest
+
+def prediction(east : float) -> dict:
+    return {"GPS_utm" : np.array([east, 0.0]), "GPS_lonlat" : np.array([0.0, 0.0])}
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", descriptor=np.zeros(2), prediction=prediction(1.0))
+    cache.put("b", descriptor=np.zeros(2), prediction=prediction(2.0))
+    assert cache.get("a")[1]["GPS_utm"][0] == 1.0
+    cache.put("c", descriptor=np.zeros(2), prediction=prediction(3.0))
+    assert cache.get("b") == (None, None)
+    assert cache.get("a")[1] is not None and cache.get("c")[1] is not None
+    assert cache.stats()["evictions"] == 1 and len(cache) == 2
+
+def test_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    cache = ResultCache(max_entries=4, ttl_seconds=10.0)
+    cache.put("a", prediction=prediction(1.0))
+    now[0] += 9.0
+    assert cache.get("a")[1] is not None
+    now[0] += 2.0
+    assert cache.get("a") == (None, None)
+    assert cache.stats()["expirations"] == 1 and len(cache) == 0
+
+def test_predictions_depend_on_the_search_options():
+    cache = ResultCache()
+    cache.put("a", (None, None), np.ones(2), prediction(1.0))
+    descriptor, cached_prediction = cache.get("a", (None, 90.0))
+    assert cached_prediction is None and descriptor is not None
+    assert cache.stats()["descriptor_hits"] == 1
+
+def test_sync_invalidation():
+    cache = ResultCache()
+    cache.sync("model", ("index", 0))
+    cache.put("a", descriptor=np.ones(2), prediction=prediction(1.0))
+    cache.sync("model", ("index", 0))
+    assert cache.get("a")[1] is not None
+    # The index changed: the descriptor is still valid, the prediction is not
+    cache.sync("model", ("index", 1))
+    descriptor, cached_prediction = cache.get("a")
+    assert descriptor is not None and cached_prediction is None
+    # Another model: nothing is valid
+    cache.sync("other model", ("index", 1))
+    assert cache.get("a") == (None, None)
+    assert cache.stats()["invalidations"] == 2
+
+def test_image_digest_of_every_input(tmp_path):
+    image_path = tmp_path.joinpath("image.jpg")
+    image_path.write_bytes(b"image bytes")
+    digest = image_digest(image_path)
+    assert digest == image_digest(str(image_path)) == image_digest(b"image bytes") == image_digest(base64.b64encode(b"image bytes").decode(), is_base64=True)
+    assert digest != image_digest(b"other bytes")
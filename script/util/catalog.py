@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import numpy as np
+from PIL import Image
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Set, Tuple
+from util.image_manager import read_datas
+
+CATALOG_FILE = "catalog.sqlite"
+COLUMNS = ["path", "split", "section_id", "utm_east", "utm_north", "longitude", "latitude", "heading", "image_name", "source_image", "width", "height", "file_size", "mtime_ns"]
+SECTION_PREFIX = "section_id_"
+
+def split_of(relative_path : str) -> Tuple[str, int]:
+    """Split folder (e.g. "test/queries") and section id (-1 outside test/queries/section_id_<n>) of a catalog path."""
+    parents = PurePosixPath(relative_path).parent.parts
+    section_id = -1
+    if ( len(parents) > 0 and parents[-1].startswith(SECTION_PREFIX) ):
+        section_id = int(parents[-1][len(SECTION_PREFIX):])
+        parents = parents[:-1]
+    return "/".join(parents), section_id
+
+def catalog_row(root_folder : Path, image_path : Path) -> tuple:
+    relative_path = image_path.relative_to(root_folder).as_posix()
+    split, section_id = split_of(relative_path)
+    datas = read_datas(image_path)
+    with Image.open(image_path) as img: # only the header is read
+        width, height = img.size
+    stat = image_path.stat()
+    return (relative_path, split, section_id, datas["UTM_east"], datas["UTM_north"], datas["GPS_longitude"], datas["GPS_latitude"], datas["GPS_heading"],
+            datas["IMG_name"], datas["IMG_name"][0:-2], width, height, stat.st_size, stat.st_mtime_ns)
+
+
+class ImageCatalog():
+    def __init__(self, root_folder : Path, catalog_path : Path = None):
+        """SQLite catalog of the processed images of root_folder, one row per image.
+
+        Rows hold the metadata of the @-delimited file names (UTM, lon/lat, heading, source image), the split
+        and section id given by the folders of the organized dataset, the image size and the file signature.
+        The preprocessing pipeline keeps it up to date with refresh, readers load the columns as NumPy arrays
+        in one query instead of walking the tree and parsing the names.
+        """
+        self.root_folder = root_folder
+        self.catalog_path = catalog_path if catalog_path is not None else root_folder.joinpath(CATALOG_FILE)
+
+    def __connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.catalog_path)
+        connection.execute("""CREATE TABLE IF NOT EXISTS images (
+            path TEXT PRIMARY KEY, split TEXT, section_id INTEGER,
+            utm_east REAL, utm_north REAL, longitude REAL, latitude REAL, heading INTEGER,
+            image_name TEXT, source_image TEXT, width INTEGER, height INTEGER, file_size INTEGER, mtime_ns INTEGER)""")
+        connection.execute("CREATE INDEX IF NOT EXISTS images_split ON images (split, section_id)")
+        # mtime of the sub-folders at the last refresh, the root is left out: the catalog's own writes change it
+        connection.execute("CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, mtime_ns INTEGER)")
+        return connection
+
+    def exists(self) -> bool:
+        return self.catalog_path.exists()
+
+    def refresh(self) -> Dict[str, int]:
+        """Synchronize the catalog with the images of root_folder.
+
+        New or modified images are parsed, images moved by DatasetsOrganizer (same name, size and mtime)
+        only get their path, split and section updated, vanished images are deleted. The mtime of every
+        sub-folder is recorded for is_fresh.
+        """
+        on_disk, folders = {}, []
+        for directory, _, file_names in os.walk(self.root_folder):
+            directory = Path(directory)
+            relative_directory = directory.relative_to(self.root_folder).as_posix()
+            if ( relative_directory != "." ):
+                folders.append((relative_directory, directory.stat().st_mtime_ns))
+            for file_name in file_names:
+                if ( file_name.endswith(".jpg") ):
+                    on_disk[f"{relative_directory}/{file_name}".removeprefix("./")] = directory.joinpath(file_name)
+        connection = self.__connect()
+        with connection:
+            stored = {path : (size, mtime) for path, size, mtime in connection.execute("SELECT path, file_size, mtime_ns FROM images")}
+            to_add = []
+            for relative_path, image_path in on_disk.items():
+                stat = image_path.stat()
+                if ( stored.get(relative_path) != (stat.st_size, stat.st_mtime_ns) ):
+                    to_add.append((relative_path, (PurePosixPath(relative_path).name, stat.st_size, stat.st_mtime_ns)))
+            vanished = {(PurePosixPath(path).name, *signature) : path for path, signature in stored.items() if path not in on_disk}
+            moved, added = [], []
+            for relative_path, signature in to_add:
+                previous_path = vanished.pop(signature, None)
+                if ( previous_path is not None ):
+                    moved.append((relative_path, *split_of(relative_path), previous_path))
+                    continue
+                try:
+                    added.append(catalog_row(self.root_folder, on_disk[relative_path]))
+                except (ValueError, IndexError):
+                    continue # not a processed image name
+            connection.executemany("UPDATE images SET path = ?, split = ?, section_id = ? WHERE path = ?", moved)
+            connection.executemany(f"INSERT OR REPLACE INTO images ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", added)
+            connection.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in vanished.values()])
+            connection.execute("DELETE FROM folders")
+            connection.executemany("INSERT INTO folders (path, mtime_ns) VALUES (?, ?)", folders)
+        connection.close()
+        return {"added" : len(added), "moved" : len(moved), "removed" : len(vanished)}
+
+    def __prefix(self, folder : Path) -> str:
+        if ( folder is None ):
+            return ""
+        relative_folder = folder.resolve().relative_to(self.root_folder.resolve()).as_posix()
+        return "" if relative_folder == "." else relative_folder + "/"
+
+    @staticmethod
+    def __range(prefix : str) -> Tuple[str, list]:
+        # Range on the primary key instead of LIKE, '_' of the folder names is a LIKE wildcard
+        return "path >= ? AND path < ?", [prefix, prefix[:-1] + chr(ord("/") + 1)]
+
+    def is_fresh(self, folder : Path = None) -> bool:
+        """Whether the catalog still lists the images under folder, without reading the image files.
+
+        An image added, deleted or moved changes the mtime of its folder: the check only stats the sub-folders
+        of folder recorded by the last refresh. The root folder, whose mtime also changes with the catalog's
+        writes, is compared by listing its own entries.
+        """
+        prefix = self.__prefix(folder)
+        connection = self.__connect()
+        condition, parameters = self.__range(prefix) if prefix != "" else ("1", [])
+        folders = dict(connection.execute(f"SELECT path, mtime_ns FROM folders WHERE path = ? OR ({condition})", [prefix[:-1], *parameters]).fetchall())
+        if ( prefix == "" ):
+            root_images = connection.execute("SELECT COUNT(*) FROM images WHERE instr(path, '/') = 0").fetchone()[0]
+        connection.close()
+        if ( prefix != "" and prefix[:-1] not in folders ):
+            return False
+        for relative_folder, mtime_ns in folders.items():
+            try:
+                if ( self.root_folder.joinpath(relative_folder).stat().st_mtime_ns != mtime_ns ):
+                    return False
+            except FileNotFoundError:
+                return False
+        if ( prefix == "" ):
+            entries = list(os.scandir(self.root_folder))
+            sub_folders = {entry.name for entry in entries if entry.is_dir()}
+            if ( sub_folders != {path for path in folders if "/" not in path} ):
+                return False
+            return root_images == len([entry for entry in entries if entry.is_file() and entry.name.endswith(".jpg")])
+        return True
+
+    def load(self, folder : Path = None, split : str = None, section_id : int = None, columns : List[str] = COLUMNS) -> Dict[str, np.ndarray]:
+        """Columns of the images under folder (default: every image), of split and of section_id, sorted by path."""
+        conditions, parameters = [], []
+        prefix = self.__prefix(folder)
+        if ( prefix != "" ):
+            condition, range_parameters = self.__range(prefix)
+            conditions.append(condition)
+            parameters += range_parameters
+        if ( split is not None ):
+            conditions.append("split = ?")
+            parameters.append(split)
+        if ( section_id is not None ):
+            conditions.append("section_id = ?")
+            parameters.append(section_id)
+        query = f"SELECT {', '.join(columns)} FROM images" + (f" WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else "") + " ORDER BY path"
+        connection = self.__connect()
+        rows = connection.execute(query, parameters).fetchall()
+        connection.close()
+        values = list(zip(*rows)) if len(rows) > 0 else [[] for _ in columns]
+        return {column : np.array(column_values) for column, column_values in zip(columns, values)}
+
+    def load_images(self, folder : Path = None, columns : List[str] = []) -> Tuple[List[Path], Dict[str, np.ndarray]]:
+        """Paths of the images under folder, joined to folder and sorted like sorted(folder.rglob("*.jpg")), and their columns in the same order."""
+        folder = folder if folder is not None else self.root_folder
+        prefix_length = len(self.__prefix(folder))
+        datas = self.load(folder, columns=["path", *columns])
+        image_paths = [folder.joinpath(path[prefix_length:]) for path in datas.pop("path")]
+        order = sorted(range(len(image_paths)), key=image_paths.__getitem__)
+        return [image_paths[row] for row in order], {column : values[order] for column, values in datas.items()}
+
+    def source_images(self) -> Set[str]:
+        """Stems of the raw images that already have processed crops."""
+        return set(self.load(columns=["source_image"])["source_image"].tolist())
+
+    def __len__(self):
+        connection = self.__connect()
+        number_of_images = connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        connection.close()
+        return number_of_images
+
+    def __repr__(self):
+        return f"< ImageCatalog - {self.catalog_path} >"
+
+
+def find_catalog(folder : Path, refresh : bool = False) -> ImageCatalog:
+    """Catalog of folder or of its closest parent, None if there is none or if it is stale for folder.
+
+    Readers do not write the catalog, the preprocessing keeps it up to date: they only check that nothing
+    changed under folder since the last refresh (see ImageCatalog.is_fresh). With refresh the catalog is
+    synchronized first, for the tools that own the processed folder.
+    """
+    folder = folder.resolve()
+    for candidate in [folder, *folder.parents]:
+        if ( candidate.joinpath(CATALOG_FILE).exists() ):
+            catalog = ImageCatalog(candidate)
+            try:
+                if ( refresh ):
+                    catalog.refresh()
+                elif ( not catalog.is_fresh(folder) ):
+                    print(f"Catalog {catalog} is out of date for {folder}, scanning the folder instead")
+                    return None
+            except (sqlite3.Error, OSError) as error:
+                print(f"Catalog {catalog} cannot be read ({error}), scanning {folder} instead")
+                return None
+            return catalog
+    return None